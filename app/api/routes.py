@@ -1,8 +1,34 @@
-from fastapi import APIRouter, Depends
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import anyio
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from starlette.types import Receive, Scope, Send
 
-from app.models.task import TaskCreate, TaskResponse, TaskStatusResponse
-from app.tasks.task_manager import TaskManager, task_manager
+from app.core.config import settings
+from app.models.task import (
+    LoadResponse,
+    TaskBatchCreate,
+    TaskBatchError,
+    TaskBatchResponse,
+    TaskCreate,
+    TaskEventsResponse,
+    TaskListResponse,
+    TaskResponse,
+    TaskStatesRequest,
+    TaskStatesResponse,
+    TaskStatus,
+    TaskStatusResponse,
+    WorkflowCreate,
+    WorkflowResponse,
+    WorkflowStatusResponse,
+)
+from app.tasks import registry
+from app.tasks.task_manager import StreamSlot, TaskManager, task_manager
 
 router = APIRouter()
 
@@ -12,9 +38,70 @@ async def get_task_manager() -> TaskManager:
     return task_manager
 
 
+class EventStreamResponse(StreamingResponse):
+    """
+    Server-Sent Events response that stops its generator as soon as the client
+    disconnects, rather than at its next write, so idle streams are released
+    promptly. Its stream ``slot`` is released once the response is over, even
+    if the stream never started.
+    """
+
+    media_type = "text/event-stream"
+
+    def __init__(
+        self,
+        content: AsyncIterator[str],
+        slot: Optional[StreamSlot] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(content, **kwargs)
+        self.slot = slot
+        self.headers.setdefault("Cache-Control", "no-cache")
+        self.headers.setdefault("X-Accel-Buffering", "no")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            async with anyio.create_task_group() as task_group:
+
+                async def stream(send: Send) -> None:
+                    await self.stream_response(send)
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(stream, send)
+                await self.listen_for_disconnect(receive)
+                task_group.cancel_scope.cancel()
+        finally:
+            if self.slot is not None:
+                self.slot.release()
+
+
+def reserve_stream(tm: TaskManager) -> StreamSlot:
+    slot = tm.reserve_stream()
+    if slot is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many open status streams",
+            headers={"Retry-After": str(settings.TASK_STREAM_RETRY_AFTER_SECONDS)},
+        )
+    return slot
+
+
+def validation_errors(error: ValidationError) -> List[Any]:
+    errors: List[Any] = json.loads(error.json(include_url=False))
+    return errors
+
+
+def check_task_type(task: TaskCreate) -> TaskCreate:
+    """Validate the parameters for the task's registered type, in place."""
+    task.parameters = registry.validate(task.name, task.parameters)
+    return task
+
+
 @router.post("/tasks", response_model=TaskResponse)
 async def create_task(
-    task_create: TaskCreate, tm: TaskManager = Depends(get_task_manager)
+    task_create: TaskCreate,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    tm: TaskManager = Depends(get_task_manager),
 ) -> TaskResponse:
     """
     Create a new task
@@ -22,30 +109,279 @@ async def create_task(
     - Returns a task ID immediately
     - Task will be executed asynchronously
     - Results will be sent to the callback URL when the task is completed
+    - `queue` (short, default or long) and `priority` (0-9, higher first) control
+      when the task runs relative to others
+    - With `deadline` (a time) or `timeout` (seconds), the task ends as TIMED_OUT
+      once that has passed
+    - Resubmitting with the same `idempotency_key` (or `Idempotency-Key` header),
+      or with `dedupe` and the same name and parameters, returns the original task ID
+    - Returns 429 with Retry-After while the task's queue is over its high-water mark,
+      unless admission control is set to defer
+    - Returns 422 when `parameters` do not match the task type registered for `name`
+    - With `run_at` the task runs at that time instead of now, and with `recurrence`
+      again every `recurrence.every` seconds, each run as a task of its own. `jitter`
+      spreads runs over that many seconds after their time; the returned ID, that of
+      the first run, also identifies the schedule
     """
+    try:
+        check_task_type(task_create)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [
+                {**error, "loc": ["body", *error["loc"]]}
+                for error in validation_errors(e)
+            ]
+        )
     task_id = await tm.create_task(
         name=task_create.name,
         parameters=task_create.parameters,
         callback_url=str(task_create.callback_url),
+        queue=task_create.queue,
+        priority=task_create.priority,
+        deadline=task_create.deadline,
+        timeout=task_create.timeout,
+        idempotency_key=task_create.idempotency_key or idempotency_key,
+        dedupe=task_create.dedupe,
+        run_at=task_create.run_at,
+        recurrence=task_create.recurrence,
+        jitter=task_create.jitter,
     )
 
     return TaskResponse(task_id=task_id)
 
 
-@router.get("/tasks/{task_id}", response_class=StreamingResponse)
+@router.post("/tasks/batch", response_model=TaskBatchResponse)
+async def create_tasks(
+    batch: TaskBatchCreate, tm: TaskManager = Depends(get_task_manager)
+) -> TaskBatchResponse:
+    """
+    Create many tasks in one request
+
+    - Each item has the same shape as the body of POST /api/tasks
+    - Returns the task IDs in input order, with null for items that were not created
+    - Invalid items and items that could not be queued are listed in `errors`
+    """
+    if len(batch.tasks) > settings.TASK_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=(
+                f"At most {settings.TASK_BATCH_MAX_SIZE} tasks can be created at once"
+            ),
+        )
+
+    errors = []
+    valid = {}
+    for index, item in enumerate(batch.tasks):
+        try:
+            valid[index] = check_task_type(TaskCreate.model_validate(item))
+        except ValidationError as e:
+            errors.append(TaskBatchError(index=index, detail=validation_errors(e)))
+
+    task_ids: List[Optional[str]] = [None] * len(batch.tasks)
+    if valid:
+        indexes = list(valid)
+        created, failures = await tm.create_tasks(list(valid.values()))
+        for position, index in enumerate(indexes):
+            task_ids[index] = created[position]
+            if position in failures:
+                errors.append(TaskBatchError(index=index, detail=failures[position]))
+
+    errors.sort(key=lambda error: error.index)
+    return TaskBatchResponse(
+        task_ids=task_ids,
+        accepted=sum(task_id is not None for task_id in task_ids),
+        errors=errors,
+    )
+
+
+@router.post("/workflows", response_model=WorkflowResponse)
+async def create_workflow(
+    workflow: WorkflowCreate, tm: TaskManager = Depends(get_task_manager)
+) -> WorkflowResponse:
+    """
+    Create a workflow: tasks (steps) that run once the steps they depend on complete
+
+    - Each step has a `key`, the `name` and `parameters` of its task and the keys
+      of the steps it `depends_on`; dependencies must not form a cycle
+    - Returns the workflow ID and the task ID of every step
+    - A step receives the results of its dependencies by reference in `run.inputs`
+    - Steps depending on a step that fails, times out or is cancelled are cancelled
+    - `callback_url` receives the workflow status and every step's result at the end
+    """
+    if len(workflow.steps) > settings.WORKFLOW_MAX_STEPS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"A workflow can have at most {settings.WORKFLOW_MAX_STEPS} steps",
+        )
+    errors: List[Dict[str, Any]] = []
+    for index, step in enumerate(workflow.steps):
+        try:
+            step.parameters = registry.validate(step.name, step.parameters)
+        except ValidationError as e:
+            errors.extend(
+                {**error, "loc": ["body", "steps", index, *error["loc"]]}
+                for error in validation_errors(e)
+            )
+    if errors:
+        raise RequestValidationError(errors)
+    return await tm.create_workflow(workflow)
+
+
+@router.get("/workflows/{workflow_id}", response_class=EventStreamResponse)
+async def stream_workflow_status(
+    workflow_id: str, tm: TaskManager = Depends(get_task_manager)
+) -> EventStreamResponse:
+    """
+    Stream the status of a workflow
+
+    - The first event has the aggregate status, progress and every step
+    - Later events are sent when steps change and list only the changed steps
+    - Stream ends when every step has finished
+    - Returns 503 with Retry-After when this process holds too many streams
+    """
+    slot = reserve_stream(tm)
+    return EventStreamResponse(tm.stream_workflow_status(workflow_id, slot), slot)
+
+
+@router.get("/workflows/{workflow_id}/state", response_model=WorkflowStatusResponse)
+async def get_workflow_status(
+    workflow_id: str, tm: TaskManager = Depends(get_task_manager)
+) -> WorkflowStatusResponse:
+    """
+    Get the current status of a workflow
+
+    - `status` is PENDING until a step starts, RUNNING until all have finished,
+      then COMPLETED, FAILED (a step failed or timed out) or CANCELLED
+    - `progress` is the mean progress of the steps
+    """
+    return await tm.get_workflow_status(workflow_id)
+
+
+@router.get("/load", response_model=LoadResponse)
+async def get_load(tm: TaskManager = Depends(get_task_manager)) -> LoadResponse:
+    """
+    Get the load used for admission control
+
+    - `pools` holds the backlog of each worker pool, for autoscalers such as KEDA
+    - `saturated` lists the queue classes whose submissions are refused or deferred
+    - Sampled at most every `TASK_LOAD_SAMPLE_INTERVAL` seconds per API process
+    """
+    return await tm.get_load()
+
+
+def parse_task_ids(ids: List[str]) -> List[str]:
+    task_ids = list(
+        dict.fromkeys(
+            task_id.strip()
+            for value in ids
+            for task_id in value.split(",")
+            if task_id.strip()
+        )
+    )
+    if len(task_ids) > settings.TASK_STATE_MAX_IDS:
+        raise HTTPException(
+            status_code=413,
+            detail=(
+                f"At most {settings.TASK_STATE_MAX_IDS} tasks can be queried at once"
+            ),
+        )
+    return task_ids
+
+
+@router.get("/tasks", response_model=TaskListResponse)
+async def list_tasks(
+    status: Optional[TaskStatus] = Query(None, description="Only tasks in this status"),
+    name: Optional[str] = Query(
+        None, min_length=1, description="Only tasks with this name"
+    ),
+    created_after: Optional[datetime] = Query(
+        None, description="Only tasks created later"
+    ),
+    cursor: Optional[str] = Query(
+        None, description="`next_cursor` of the previous page"
+    ),
+    limit: int = Query(100, ge=1, le=settings.TASK_LIST_MAX_LIMIT),
+    tm: TaskManager = Depends(get_task_manager),
+) -> TaskListResponse:
+    """
+    List tasks by status, name or both, newest first
+
+    - At least one of `status` and `name` is required
+    - Pages are chained with `cursor`; a short page may still have a `next_cursor`
+    - Tasks are listed until their record expires
+    """
+    if status is None and name is None:
+        raise HTTPException(status_code=400, detail="Filter by status, name or both")
+    return await tm.list_tasks(status, name, created_after, cursor, limit)
+
+
+@router.get("/tasks/state", response_model=TaskStatesResponse)
+async def get_tasks_status(
+    ids: List[str] = Query(..., description="Task IDs, repeated or comma-separated"),
+    tm: TaskManager = Depends(get_task_manager),
+) -> TaskStatesResponse:
+    """
+    Get the current status of many tasks
+
+    - Resolves all IDs in a single Redis round trip
+    - Unknown IDs are listed in `missing`
+    """
+    found, missing = await tm.get_task_statuses(parse_task_ids(ids))
+    return TaskStatesResponse(tasks=found, missing=missing)
+
+
+@router.post("/tasks/state", response_model=TaskStatesResponse)
+async def query_tasks_status(
+    query: TaskStatesRequest, tm: TaskManager = Depends(get_task_manager)
+) -> TaskStatesResponse:
+    """
+    Get the current status of many tasks
+
+    - Same as GET /api/tasks/state, for ID lists too long for a query string
+    """
+    found, missing = await tm.get_task_statuses(parse_task_ids(query.task_ids))
+    return TaskStatesResponse(tasks=found, missing=missing)
+
+
+@router.get("/tasks/stream", response_class=EventStreamResponse)
+async def stream_tasks_status(
+    ids: List[str] = Query([], description="Task IDs, repeated or comma-separated"),
+    name: Optional[str] = Query(None, description="Only tasks with this name"),
+    tm: TaskManager = Depends(get_task_manager),
+) -> EventStreamResponse:
+    """
+    Stream status updates of many tasks over one connection
+
+    - With `ids`, sends the current status of each task, then every change
+    - Stops reporting a task once it is completed or failed, and ends when all are
+    - Without `ids`, streams changes of all tasks (optionally filtered by `name`)
+    - Returns 503 with Retry-After when this process holds too many streams
+    """
+    task_ids = parse_task_ids(ids)
+    slot = reserve_stream(tm)
+    return EventStreamResponse(tm.stream_tasks_status(task_ids, name, slot), slot)
+
+
+@router.get("/tasks/{task_id}", response_class=EventStreamResponse)
 async def stream_task_status(
-    task_id: str, tm: TaskManager = Depends(get_task_manager)
-) -> StreamingResponse:
+    task_id: str,
+    last_event_id: Optional[str] = Header(None),
+    tm: TaskManager = Depends(get_task_manager),
+) -> EventStreamResponse:
     """
     Stream task status updates
 
     - Returns Server-Sent Events (SSE) with task status updates
-    - Updates are sent every 5 seconds
+    - Updates are pushed as soon as the task status changes
     - Stream ends when the task is completed or failed
+    - Events carry IDs; reconnecting with `Last-Event-ID` skips states already seen
+    - Returns 503 with Retry-After when this process holds too many streams
     """
-    return StreamingResponse(
-        tm.stream_task_status(task_id), media_type="text/event-stream"
+    resume_from = (
+        int(last_event_id) if last_event_id and last_event_id.isdigit() else None
     )
+    slot = reserve_stream(tm)
+    return EventStreamResponse(tm.stream_task_status(task_id, resume_from, slot), slot)
 
 
 @router.get("/tasks/{task_id}/state", response_model=TaskStatusResponse)
@@ -59,3 +395,47 @@ async def get_task_status(
     - Does not stream updates
     """
     return await tm.get_task_status(task_id)
+
+
+@router.get("/tasks/{task_id}/events", response_model=TaskEventsResponse)
+async def get_task_events(
+    task_id: str,
+    since: Optional[int] = Query(None, ge=0, description="Only events after this seq"),
+    limit: Optional[int] = Query(None, ge=1, description="At most this many events"),
+    tm: TaskManager = Depends(get_task_manager),
+) -> TaskEventsResponse:
+    """
+    Get the status history of a task
+
+    - Returns the recorded status transitions, oldest first, each with its `seq`
+    - `since` takes a `seq` (or SSE event ID) and returns only later events
+    - `truncated` is set when older events were dropped by the history cap
+    """
+    return await tm.get_task_events(task_id, since, limit)
+
+
+@router.delete("/tasks/{task_id}", response_model=TaskStatusResponse)
+async def cancel_task(
+    task_id: str, tm: TaskManager = Depends(get_task_manager)
+) -> TaskStatusResponse:
+    """
+    Cancel a task
+
+    - A queued task never starts; a running one stops after its current step
+    - Returns 409 if the task has already finished
+    """
+    return await tm.cancel_task(task_id)
+
+
+@router.delete("/schedules/{schedule_id}", response_model=TaskStatusResponse)
+async def cancel_schedule(
+    schedule_id: str, tm: TaskManager = Depends(get_task_manager)
+) -> TaskStatusResponse:
+    """
+    Cancel a delayed or recurring task
+
+    - `schedule_id` is the task ID returned when the task was submitted
+    - No further runs are created and the next one is cancelled, unless it has
+      already started; returns the status of that run
+    """
+    return await tm.cancel_schedule(schedule_id)
@@ -1,6 +1,8 @@
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Dict, Optional
+from urllib.parse import quote, urlparse
+
 from pydantic import Field, validator
-from urllib.parse import urlparse
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
@@ -10,11 +12,118 @@ class Settings(BaseSettings):
     REDIS_HOST: str = "redis"
     REDIS_PORT: str = "6379"
     REDIS_URL: str = "redis://redis:6379/0"
+    REDIS_POOL_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: float = 5.0
+    REDIS_SOCKET_TIMEOUT: float = 5.0
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 5.0
 
     RABBITMQ_HOST: str = Field("rabbitmq", env="RABBITMQ_HOST")
     RABBITMQ_PORT: int = Field(5672, env="RABBITMQ_PORT")
+    RABBITMQ_USER: str = "guest"
+    RABBITMQ_PASSWORD: str = "guest"
+    RABBITMQ_VHOST: str = "/"
+
+    # "redis" or "rabbitmq"; CELERY_BROKER_URL overrides the URL built from it.
+    CELERY_BROKER: str = "redis"
+    CELERY_BROKER_URL: Optional[str] = None
+    # Defaults to REDIS_URL; an empty value disables the result backend.
+    CELERY_RESULT_BACKEND: Optional[str] = None
+    CELERY_STORE_INTERNAL_RESULTS: bool = False
+    CELERY_TASK_TIME_LIMIT: int = 3600
+    # "orjson", "json" or "msgpack"; see app.core.serialization.
+    SERIALIZER: str = "orjson"
 
-    TASK_STATUS_UPDATE_INTERVAL: int = 5
+    CALLBACK_POOL_CONNECTIONS: int = 10
+    CALLBACK_POOL_MAXSIZE: int = 10
+    CALLBACK_CONNECT_TIMEOUT: float = 3.0
+    CALLBACK_TIMEOUT: float = 10.0
+    CALLBACK_DELIVERY: str = "dispatcher"
+    CALLBACK_MAX_IN_FLIGHT: int = 200
+    CALLBACK_MAX_PER_HOST: int = 20
+    CALLBACK_BATCH_MAX_SIZE: int = 1
+    CALLBACK_MAX_RETRIES: int = 3
+    CALLBACK_BACKOFF_BASE: float = 1.0
+    CALLBACK_BACKOFF_MAX: float = 300.0
+    CALLBACK_LEASE_SECONDS: float = 60.0
+    CALLBACK_DEAD_LETTER_MAX: int = 10000
+    # Send offloaded payloads chunk by chunk instead of building the body first.
+    CALLBACK_STREAM_PAYLOADS: bool = False
+
+    # Seconds between keep-alive comments on idle status streams.
+    TASK_STATUS_UPDATE_INTERVAL: float = 5.0
+    TASK_STREAM_MAX_OPEN: int = 20000
+    TASK_STREAM_RETRY_AFTER_SECONDS: int = 5
+    TASK_ACTIVE_TTL_SECONDS: int = 7 * 24 * 3600
+    TASK_TERMINAL_TTL_SECONDS: int = 24 * 3600
+    TASK_COMPACT_ON_FINISH: bool = False
+    # Status transitions kept per task in its history stream; 0 keeps none.
+    TASK_HISTORY_MAX_EVENTS: int = 100
+    TASK_HISTORY_MAX_READ: int = 1000
+    TASK_STORE_REPORT_INTERVAL: int = 300
+    CELERY_RESULT_EXPIRES_SECONDS: int = 3600
+    TASK_IDEMPOTENCY_WINDOW_SECONDS: int = 24 * 3600
+    TASK_DEDUPE_WINDOW_SECONDS: int = 600
+    TASK_RESULT_CACHE_TTL_SECONDS: int = 0
+    TASK_BATCH_MAX_SIZE: int = 10000
+    TASK_BATCH_PUBLISH_CHUNK_SIZE: int = 100
+    TASK_STATE_MAX_IDS: int = 1000
+    # GET /api/tasks: page size limit and index entries read per page at most.
+    TASK_LIST_MAX_LIMIT: int = 1000
+    TASK_LIST_MAX_SCAN: int = 10000
+    TASK_INDEX_PRUNE_INTERVAL: int = 60
+    # Parameters encoding to more bytes than this are stored once and passed by
+    # reference; 0 always passes them inline.
+    TASK_PAYLOAD_INLINE_MAX_BYTES: int = 64 * 1024
+    TASK_PAYLOAD_CHUNK_BYTES: int = 256 * 1024
+    TASK_PROGRESS_MAX_UPDATES_PER_SECOND: float = 0.0
+    # Coalesced updates still read the task's status this often, to notice cancellation.
+    TASK_PROGRESS_CANCEL_CHECK_INTERVAL: float = 0.1
+    # Admission control, see app.tasks.backpressure; a high-water mark of 0 is no limit.
+    TASK_LOAD_SAMPLE_INTERVAL: float = 1.0
+    TASK_BACKPRESSURE_MODE: str = "reject"
+    TASK_BACKPRESSURE_QUEUE_HIGH_WATER: int = 10000
+    TASK_BACKPRESSURE_IN_FLIGHT_HIGH_WATER: int = 0
+    TASK_BACKPRESSURE_LOW_WATER_RATIO: float = 0.8
+    TASK_BACKPRESSURE_MAX_DEFERRED: int = 100000
+    TASK_BACKPRESSURE_DRAIN_BATCH: int = 500
+    TASK_BACKPRESSURE_RETRY_AFTER_SECONDS: int = 5
+    TASK_DEFAULT_QUEUE_CLASS: str = "default"
+    TASK_DEFAULT_PRIORITY: int = 5
+    TASK_QUEUE_CONCURRENCY: Dict[str, int] = {"short": 8, "default": 4, "long": 2}
+    TASK_QUEUE_PREFETCH: Dict[str, int] = {"short": 4, "default": 1, "long": 1}
+    TASK_QUEUE_EXECUTOR: Dict[str, str] = {
+        "short": "prefork",
+        "default": "prefork",
+        "long": "prefork",
+    }
+    # Coroutine bodies in flight at once per asyncio pool process, see
+    # app.tasks.execution.
+    TASK_ASYNC_CONCURRENCY: int = 1000
+    TASK_ASYNC_LEASE_SECONDS: float = 60.0
+    TASK_ASYNC_SHUTDOWN_TIMEOUT: float = 30.0
+    # Task name -> module declaring its type, imported on first use.
+    TASK_TYPE_MODULES: Dict[str, str] = {}
+    TASK_REJECT_UNREGISTERED: bool = False
+    WORKFLOW_MAX_STEPS: int = 1000
+    # Delayed and recurring tasks, see app.tasks.scheduler.
+    TASK_SCHEDULE_JITTER_SECONDS: float = 0.0
+    TASK_SCHEDULER_INTERVAL: float = 1.0
+    TASK_SCHEDULER_BATCH_SIZE: int = 500
+    TASK_SCHEDULER_LEASE_SECONDS: float = 60.0
+    TASK_WORKLOAD_MIN_STEPS: int = 5
+    TASK_WORKLOAD_MAX_STEPS: int = 15
+    TASK_WORKLOAD_MIN_STEP_SECONDS: float = 1.0
+    TASK_WORKLOAD_MAX_STEP_SECONDS: float = 3.0
+    TASK_STATUS_CACHE_ENABLED: bool = True
+    TASK_STATUS_CACHE_MAX_ENTRIES: int = 100000
+    TASK_STATUS_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    TASK_STATUS_CACHE_TTL_SECONDS: float = 5.0
+    # Ports of the metrics exporters of workers, the callback dispatcher and
+    # the scheduler; 0 disables.
+    METRICS_WORKER_PORT: int = 9808
+    METRICS_DISPATCHER_PORT: int = 9809
+    METRICS_SCHEDULER_PORT: int = 9810
+    METRICS_QUEUE_DEPTH_TIMEOUT: float = 2.0
 
     @validator("REDIS_URL", pre=True)
     def parse_redis_url(cls, v):
@@ -24,6 +133,25 @@ class Settings(BaseSettings):
                 return v
         return f"redis://{cls.REDIS_HOST}:{cls.REDIS_PORT}/0"
 
+    @property
+    def celery_broker_url(self) -> str:
+        if self.CELERY_BROKER_URL:
+            return self.CELERY_BROKER_URL
+        if self.CELERY_BROKER == "rabbitmq":
+            vhost = quote(self.RABBITMQ_VHOST, safe="")
+            return (
+                f"amqp://{quote(self.RABBITMQ_USER, safe='')}:"
+                f"{quote(self.RABBITMQ_PASSWORD, safe='')}@"
+                f"{self.RABBITMQ_HOST}:{self.RABBITMQ_PORT}/{vhost}"
+            )
+        return self.REDIS_URL
+
+    @property
+    def celery_result_backend(self) -> Optional[str]:
+        if self.CELERY_RESULT_BACKEND is None:
+            return self.REDIS_URL
+        return self.CELERY_RESULT_BACKEND or None
+
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
 
@@ -0,0 +1,217 @@
+"""
+Prometheus metrics.
+
+Metrics are defined once at import and every label combination used on a hot
+path is bound here as well, so instrumented code only calls ``observe`` or
+``inc`` on existing objects and never allocates metric children per request.
+
+The API serves the metrics of its process on ``/metrics``. Workers, the
+callback dispatcher and the scheduler run in processes of their own and export
+theirs over HTTP on ``METRICS_WORKER_PORT``, ``METRICS_DISPATCHER_PORT`` and
+``METRICS_SCHEDULER_PORT``. Prefork workers aggregate their child processes
+when ``PROMETHEUS_MULTIPROC_DIR`` is set.
+"""
+import functools
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, TypeVar, cast
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    multiprocess,
+    start_http_server,
+)
+
+from app.models.task import TaskQueue
+
+# Multiprocess values are files created as metrics are defined below.
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Task-level operations take milliseconds, Redis commands well below that.
+OPERATION_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+REDIS_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.5,
+)
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+API_OPERATION_SECONDS = Histogram(
+    "task_api_operation_seconds",
+    "Time spent in TaskManager operations",
+    ["operation"],
+    buckets=OPERATION_BUCKETS,
+)
+CREATE_TASK_SECONDS = API_OPERATION_SECONDS.labels("create_task")
+CREATE_TASKS_SECONDS = API_OPERATION_SECONDS.labels("create_tasks")
+GET_TASK_STATUS_SECONDS = API_OPERATION_SECONDS.labels("get_task_status")
+GET_TASK_STATUSES_SECONDS = API_OPERATION_SECONDS.labels("get_task_statuses")
+LIST_TASKS_SECONDS = API_OPERATION_SECONDS.labels("list_tasks")
+CANCEL_TASK_SECONDS = API_OPERATION_SECONDS.labels("cancel_task")
+CANCEL_SCHEDULE_SECONDS = API_OPERATION_SECONDS.labels("cancel_schedule")
+GET_TASK_EVENTS_SECONDS = API_OPERATION_SECONDS.labels("get_task_events")
+CREATE_WORKFLOW_SECONDS = API_OPERATION_SECONDS.labels("create_workflow")
+GET_WORKFLOW_STATUS_SECONDS = API_OPERATION_SECONDS.labels("get_workflow_status")
+
+API_REDIS_SECONDS = Histogram(
+    "task_api_redis_seconds",
+    "Latency of the API's Redis round trips",
+    ["operation"],
+    buckets=REDIS_BUCKETS,
+)
+REDIS_STORE_TASK_SECONDS = API_REDIS_SECONDS.labels("store_task")
+REDIS_STORE_TASKS_SECONDS = API_REDIS_SECONDS.labels("store_tasks")
+REDIS_READ_STATUS_SECONDS = API_REDIS_SECONDS.labels("read_status")
+REDIS_READ_STATUSES_SECONDS = API_REDIS_SECONDS.labels("read_statuses")
+REDIS_UPDATE_STATUS_SECONDS = API_REDIS_SECONDS.labels("update_status")
+REDIS_READ_HISTORY_SECONDS = API_REDIS_SECONDS.labels("read_history")
+REDIS_LIST_TASKS_SECONDS = API_REDIS_SECONDS.labels("list_tasks")
+
+OPEN_STREAMS = Gauge(
+    "task_open_streams",
+    "Status streams currently open",
+    ["kind"],
+    multiprocess_mode="livesum",
+)
+OPEN_TASK_STREAMS = OPEN_STREAMS.labels("task")
+OPEN_MULTI_STREAMS = OPEN_STREAMS.labels("multi")
+OPEN_WORKFLOW_STREAMS = OPEN_STREAMS.labels("workflow")
+
+QUEUE_DEPTH = Gauge(
+    "task_queue_depth",
+    "Messages waiting in each broker queue, sampled when metrics are scraped",
+    ["queue"],
+    multiprocess_mode="max",
+)
+
+TASKS_IN_FLIGHT = Gauge(
+    "task_in_flight",
+    "Unfinished tasks, sampled for admission control",
+    multiprocess_mode="max",
+)
+
+TASKS_DEFERRED = Gauge(
+    "task_deferred",
+    "Submissions deferred by admission control, per queue class",
+    ["queue"],
+    multiprocess_mode="max",
+)
+
+TASK_COROUTINES = Gauge(
+    "task_coroutines",
+    "Task coroutines on a worker event loop, running or waiting for a slot",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+COROUTINES_RUNNING = TASK_COROUTINES.labels("running")
+COROUTINES_WAITING = TASK_COROUTINES.labels("waiting")
+
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    "task_queue_wait_seconds",
+    "Time from submission until a worker starts the task",
+    ["queue"],
+    buckets=WAIT_BUCKETS,
+)
+QUEUE_WAIT_SECONDS: Dict[str, Histogram] = {
+    queue.value: TASK_QUEUE_WAIT_SECONDS.labels(queue.value) for queue in TaskQueue
+}
+
+TASK_RUN_SECONDS = Histogram(
+    "task_run_seconds",
+    "Time a worker spent running a task",
+    ["task"],
+    buckets=WAIT_BUCKETS,
+)
+
+TASK_STEP_SECONDS = Histogram(
+    "task_step_seconds",
+    "Duration of one execute_task work step",
+    buckets=WAIT_BUCKETS,
+)
+
+CALLBACKS = Counter(
+    "task_callbacks",
+    "Callback delivery outcomes",
+    ["outcome"],
+)
+CALLBACKS_DELIVERED = CALLBACKS.labels("delivered")
+CALLBACKS_RETRIED = CALLBACKS.labels("retried")
+CALLBACKS_DEAD_LETTERED = CALLBACKS.labels("dead_lettered")
+CALLBACKS_FAILED = CALLBACKS.labels("failed")
+
+SCHEDULED_RUNS = Counter(
+    "task_scheduled_runs",
+    "Runs of delayed and recurring tasks taken off the schedule",
+    ["outcome"],
+)
+SCHEDULED_RUNS_PUBLISHED = SCHEDULED_RUNS.labels("published")
+SCHEDULED_RUNS_SKIPPED = SCHEDULED_RUNS.labels("skipped")
+SCHEDULED_RUNS_FAILED = SCHEDULED_RUNS.labels("failed")
+
+TASKS_REDELIVERED = Counter(
+    "task_redelivered",
+    "Tasks republished after the asyncio worker running them stopped",
+)
+
+SCHEDULE_LAG_SECONDS = Histogram(
+    "task_schedule_lag_seconds",
+    "Time from a run's scheduled time, jitter included, until it is published",
+    buckets=WAIT_BUCKETS,
+)
+
+
+def start_exporter(port: int) -> None:
+    """Serve this process's metrics, or those of all processes in multiprocess mode."""
+    if port <= 0:
+        return
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(port, registry=registry)
+    else:
+        start_http_server(port)
+
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+
+def timed(histogram: Histogram) -> Callable[[F], F]:
+    """Observe the duration of every call of the decorated coroutine function."""
+
+    def decorate(func: F) -> F:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+
+        return cast(F, wrapper)
+
+    return decorate
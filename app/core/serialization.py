@@ -0,0 +1,105 @@
+"""
+Serialization of task records, broker messages and SSE payloads.
+
+``SERIALIZER`` selects the codec:
+
+- ``orjson`` (default): JSON encoded and decoded by orjson, falling back to
+  the standard library when orjson is not installed
+- ``json``: the standard library
+- ``msgpack``: orjson for JSON, msgpack for Celery messages and results
+
+Task records, callback entries and SSE frames are always JSON, since Redis
+scripts (cjson) and browsers read them; the codecs only differ in speed and
+whitespace, so data written by one is read by the others. Celery messages use
+``celery_serializer()``, and workers accept every codec so they can be switched
+without draining the queues.
+"""
+import json
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, List, Union
+from uuid import UUID
+
+from kombu.serialization import register
+from pydantic import BaseModel
+
+from app.core.config import settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional speedup
+    msgpack = None
+
+ORJSON_CONTENT_TYPE = "application/x-orjson"
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def use_orjson() -> bool:
+    return orjson is not None and settings.SERIALIZER != "json"
+
+
+def dumps(value: Any) -> str:
+    """Encode ``value`` as JSON text."""
+    if use_orjson():
+        return orjson.dumps(value, default=_default).decode()
+    return json.dumps(value, default=_default)
+
+
+def dumps_bytes(value: Any) -> bytes:
+    if use_orjson():
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, default=_default).encode()
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if use_orjson():
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def model_dumps(model: BaseModel) -> str:
+    """Encode a response model the way the API returns it."""
+    return dumps(model.model_dump())
+
+
+def celery_serializer() -> str:
+    if settings.SERIALIZER == "msgpack" and msgpack is not None:
+        return "msgpack"
+    if use_orjson():
+        return "orjson"
+    return "json"
+
+
+def celery_accept_content() -> List[str]:
+    accept = ["json"]
+    if orjson is not None:
+        accept.append("orjson")
+    if msgpack is not None:
+        accept.append("msgpack")
+    return accept
+
+
+if orjson is not None:
+    register(
+        "orjson",
+        lambda value: orjson.dumps(value, default=_default),
+        orjson.loads,
+        content_type=ORJSON_CONTENT_TYPE,
+        content_encoding="binary",
+    )
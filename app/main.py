@@ -1,8 +1,18 @@
+import asyncio
+import logging
 from typing import Dict
-from fastapi import FastAPI
+
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
 from app.api.routes import router as api_router
+from app.core import metrics
 from app.core.config import settings
+from app.tasks.celery_tasks import celery
+from app.tasks.queues import queue_depths
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -24,3 +34,17 @@ app.include_router(api_router, prefix="/api")
 @app.get("/")
 async def root() -> Dict[str, str]:
     return {"message": "Welcome to the Task Execution API"}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics() -> Response:
+    try:
+        depths = await asyncio.wait_for(
+            asyncio.to_thread(queue_depths, celery),
+            timeout=settings.METRICS_QUEUE_DEPTH_TIMEOUT,
+        )
+        for queue, depth in depths.items():
+            metrics.QUEUE_DEPTH.labels(queue).set(depth)
+    except Exception as e:
+        logger.warning(f"Failed to sample queue depths: {str(e)!r}")
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
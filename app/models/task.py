@@ -1,31 +1,219 @@
-from enum import Enum
 from datetime import datetime
-from typing import Any, Dict, Optional
-from pydantic import BaseModel, HttpUrl, constr
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from pydantic import (
+    BaseModel,
+    Field,
+    HttpUrl,
+    confloat,
+    conint,
+    constr,
+    model_validator,
+)
+
 
 class TaskStatus(str, Enum):
     PENDING = "PENDING"
     RUNNING = "RUNNING"
     COMPLETED = "COMPLETED"
     FAILED = "FAILED"
+    CANCELLED = "CANCELLED"
+    TIMED_OUT = "TIMED_OUT"
+
+
+class TaskQueue(str, Enum):
+    SHORT = "short"
+    DEFAULT = "default"
+    LONG = "long"
+
+
+class TaskRecurrence(BaseModel):
+    # Seconds between runs, counted from the scheduled time of the previous run.
+    every: confloat(ge=1)
+    # Ends after this many runs, or with the last run due by `until`.
+    count: Optional[conint(ge=1)] = None
+    until: Optional[datetime] = None
+
 
 class TaskCreate(BaseModel):
     name: constr(min_length=1, strip_whitespace=True)
     parameters: Dict[str, Any]
     callback_url: HttpUrl
+    # Defaults to TASK_DEFAULT_QUEUE_CLASS.
+    queue: Optional[TaskQueue] = None
+    # 0 (lowest) to 9 (highest), ordering tasks within their queue.
+    priority: Optional[conint(ge=0, le=9)] = None
+    # The task ends as TIMED_OUT once the earlier of these has passed.
+    deadline: Optional[datetime] = None
+    timeout: Optional[confloat(gt=0)] = None
+    # Resubmissions with the same key, or with `dedupe` the same name and
+    # parameters, return the original task instead of creating a new one.
+    idempotency_key: Optional[constr(min_length=1, max_length=255)] = None
+    dedupe: bool = False
+    # Runs the task at `run_at` instead of now, then on every `recurrence`.
+    # Each run is a task of its own; `timeout` counts from when a run starts.
+    run_at: Optional[datetime] = None
+    recurrence: Optional[TaskRecurrence] = None
+    # Spreads the runs over this many seconds after their scheduled time.
+    # Defaults to TASK_SCHEDULE_JITTER_SECONDS.
+    jitter: Optional[confloat(ge=0)] = None
+
+    @model_validator(mode="after")
+    def check_schedule(self) -> "TaskCreate":
+        if self.recurrence is not None and self.deadline is not None:
+            raise ValueError("Recurring tasks take a timeout instead of a deadline")
+        return self
+
+    @property
+    def scheduled(self) -> bool:
+        return self.run_at is not None or self.recurrence is not None
+
 
 class TaskResponse(BaseModel):
     task_id: str
 
+
+class TaskBatchCreate(BaseModel):
+    # Items are validated one by one so that invalid ones are reported
+    # individually instead of rejecting the whole batch.
+    tasks: List[Dict[str, Any]] = Field(..., min_length=1)
+
+
+class TaskBatchError(BaseModel):
+    index: int
+    detail: Any
+
+
+class TaskBatchResponse(BaseModel):
+    task_ids: List[Optional[str]]
+    accepted: int
+    errors: List[TaskBatchError] = []
+
+
 class TaskStatusResponse(BaseModel):
     task_id: str
     status: TaskStatus
     progress: float
     message: Optional[str] = None
+    # Number of status changes applied so far; the task's latest SSE event ID.
+    seq: Optional[int] = None
+
+
+class TaskSummary(TaskStatusResponse):
+    name: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+class TaskListResponse(BaseModel):
+    # Newest first.
+    tasks: List[TaskSummary]
+    # Pass as `cursor` for the next page; null once there are no more tasks.
+    # A page may hold fewer tasks than requested and still have a next one.
+    next_cursor: Optional[str] = None
+
+
+class TaskEvent(BaseModel):
+    seq: int
+    status: TaskStatus
+    progress: float
+    message: Optional[str] = None
+    at: Optional[datetime] = None
+
+
+class TaskEventsResponse(BaseModel):
+    task_id: str
+    events: List[TaskEvent]
+    # Older events than requested were dropped by the history cap.
+    truncated: bool = False
+
+
+class TaskStatesRequest(BaseModel):
+    task_ids: List[str] = Field(..., min_length=1)
+
+
+class TaskStatesResponse(BaseModel):
+    tasks: List[TaskStatusResponse]
+    missing: List[str] = []
+
 
 class TaskResult(BaseModel):
     task_id: str
     status: TaskStatus
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
-    completed_at: Optional[datetime] = None 
\ No newline at end of file
+    completed_at: Optional[datetime] = None
+
+
+class WorkflowStep(BaseModel):
+    # Names the step within its workflow, in `depends_on` and in `run.inputs`.
+    key: str = Field(..., min_length=1, max_length=100, pattern=r"^[A-Za-z0-9_.-]+$")
+    name: constr(min_length=1, strip_whitespace=True)
+    parameters: Dict[str, Any] = {}
+    depends_on: List[str] = []
+    queue: Optional[TaskQueue] = None
+    priority: Optional[conint(ge=0, le=9)] = None
+    # Counted from when the step is started, not from the submission.
+    timeout: Optional[confloat(gt=0)] = None
+
+
+class WorkflowCreate(BaseModel):
+    steps: List[WorkflowStep] = Field(..., min_length=1)
+    # Receives the workflow status and the result of every step at the end.
+    callback_url: Optional[HttpUrl] = None
+
+    @model_validator(mode="after")
+    def check_graph(self) -> "WorkflowCreate":
+        keys = [step.key for step in self.steps]
+        if len(set(keys)) != len(keys):
+            raise ValueError("Step keys must be unique")
+        dependents: Dict[str, List[str]] = {key: [] for key in keys}
+        waiting: Dict[str, int] = {}
+        for step in self.steps:
+            unknown = set(step.depends_on) - set(dependents)
+            if unknown:
+                raise ValueError(
+                    f"Step {step.key} depends on unknown steps {sorted(unknown)}"
+                )
+            waiting[step.key] = len(set(step.depends_on))
+            for dependency in set(step.depends_on):
+                dependents[dependency].append(step.key)
+        ready = [key for key, count in waiting.items() if count == 0]
+        while ready:
+            for dependent in dependents[ready.pop()]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+        cycle = sorted(key for key, count in waiting.items() if count > 0)
+        if cycle:
+            raise ValueError(f"Steps {cycle} depend on each other in a cycle")
+        return self
+
+
+class WorkflowResponse(BaseModel):
+    workflow_id: str
+    # Task ID of every step, by step key.
+    task_ids: Dict[str, str]
+
+
+class WorkflowStatusResponse(BaseModel):
+    workflow_id: str
+    status: TaskStatus
+    # Mean progress of the steps.
+    progress: float
+    steps: Dict[str, TaskStatusResponse]
+
+
+class LoadResponse(BaseModel):
+    # Messages waiting per broker queue.
+    queues: Dict[str, int]
+    # Backlog per worker pool: its queues plus its deferred submissions.
+    pools: Dict[str, int]
+    in_flight: int
+    deferred: Dict[str, int]
+    # Tasks waiting for their scheduled time.
+    scheduled: int = 0
+    # Queue classes whose submissions are currently refused or deferred.
+    saturated: List[str]
+    sampled_at: datetime
@@ -1,3 +1,3 @@
-from app.tasks.celery_tasks import execute_task, update_task_status, send_callback
+from app.tasks.celery_tasks import execute_task, send_callback, update_task_status
 
-__all__ = ['execute_task', 'update_task_status', 'send_callback']
+__all__ = ["execute_task", "update_task_status", "send_callback"]
@@ -0,0 +1,272 @@
+"""
+Admission control and autoscaling signals.
+
+Each API process keeps a snapshot of the load: messages waiting in every
+broker queue, unfinished tasks (``task_store:in_flight``), submissions
+deferred per queue class and tasks waiting for their scheduled time (see
+``app.tasks.scheduler``). It is refreshed every ``TASK_LOAD_SAMPLE_INTERVAL``
+seconds in the background, so admitting a submission is an in-memory check.
+
+Once a queue class holds ``TASK_BACKPRESSURE_QUEUE_HIGH_WATER`` messages, or
+``TASK_BACKPRESSURE_IN_FLIGHT_HIGH_WATER`` tasks are unfinished, submissions
+are refused with 429 (``TASK_BACKPRESSURE_MODE=reject``) or accepted and parked
+in ``tasks:deferred:{queue}`` (``defer``). Deferred tasks are published in
+submission order once their queue falls below the low-water mark. The same
+snapshot is served by ``GET /api/load`` for autoscalers.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, cast
+
+import redis.asyncio as redis
+
+from app.core import metrics, serialization
+from app.core.config import settings
+from app.models.task import TaskQueue
+from app.tasks.celery_tasks import execute_task
+from app.tasks.queues import WORKER_POOLS, queue_depths
+from app.tasks.scheduler import SCHEDULED_KEY
+from app.tasks.status_store import IN_FLIGHT_KEY
+
+logger = logging.getLogger(__name__)
+
+DEFERRED_KEY_PREFIX = "tasks:deferred:"
+
+ADMIT = "admit"
+DEFER = "defer"
+REJECT = "reject"
+
+
+def deferred_key(queue: str) -> str:
+    return f"{DEFERRED_KEY_PREFIX}{queue}"
+
+
+def deferred_entry(call: List[Any], options: Dict[str, Any]) -> str:
+    """A deferred ``execute_task`` publish: its call and ``apply_async`` options."""
+    return serialization.dumps({"call": call, "options": options})
+
+
+class LoadMonitor:
+    """
+    Samples the load in the background and decides on submissions.
+
+    Between samples, submissions that were admitted or deferred are charged to
+    the snapshot once they have been queued, so a burst cannot overshoot the
+    high-water mark by more than what other processes admit in one interval.
+    Duplicates and submissions that fail are not charged. A snapshot older
+    than three intervals is ignored and everything is admitted.
+    """
+
+    def __init__(self) -> None:
+        self._redis: Optional[redis.Redis] = None
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._sampled_at = 0.0
+        self._sampler: Optional[asyncio.Task] = None
+
+    def bind(self, client: redis.Redis) -> None:
+        self._redis = client
+
+    @property
+    def client(self) -> redis.Redis:
+        assert self._redis is not None, "LoadMonitor is not bound to a client"
+        return self._redis
+
+    def start(self) -> None:
+        if settings.TASK_LOAD_SAMPLE_INTERVAL <= 0:
+            return
+        if self._sampler is None or self._sampler.done():
+            self._sampler = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._sampler is not None:
+            self._sampler.cancel()
+            try:
+                await self._sampler
+            except asyncio.CancelledError:
+                pass
+            self._sampler = None
+
+    def admit(self, queue: str) -> str:
+        """Decide on a submission to ``queue``: ADMIT, DEFER or REJECT."""
+        return self.admit_all([queue])[0]
+
+    def admit_all(self, queues: List[str]) -> List[str]:
+        """
+        Decide on one submission per entry of ``queues``, each as if those
+        before it had been queued. Nothing is charged until ``charge``.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or (
+            time.monotonic() - self._sampled_at > 3 * settings.TASK_LOAD_SAMPLE_INTERVAL
+        ):
+            return [ADMIT] * len(queues)
+        trial = {
+            **snapshot,
+            "queues": dict(snapshot["queues"]),
+            "deferred": dict(snapshot["deferred"]),
+        }
+        admissions = []
+        for queue in queues:
+            admission = self._decide(trial, queue)
+            self._add(trial, queue, admission, 1)
+            admissions.append(admission)
+        return admissions
+
+    def charge(self, queue: str, admission: str, count: int = 1) -> None:
+        """Count ``count`` submissions queued with ``admission`` until next sample."""
+        if self._snapshot is not None:
+            self._add(self._snapshot, queue, admission, count)
+
+    def _decide(self, snapshot: Dict[str, Any], queue: str) -> str:
+        deferred = snapshot["deferred"].get(queue, 0)
+        if not deferred and not self._saturated(snapshot, queue):
+            return ADMIT
+        if (
+            settings.TASK_BACKPRESSURE_MODE == DEFER
+            and deferred < settings.TASK_BACKPRESSURE_MAX_DEFERRED
+        ):
+            return DEFER
+        return REJECT
+
+    @staticmethod
+    def _add(snapshot: Dict[str, Any], queue: str, admission: str, count: int) -> None:
+        if admission == ADMIT:
+            snapshot["queues"][queue] = snapshot["queues"].get(queue, 0) + count
+        elif admission == DEFER:
+            snapshot["deferred"][queue] = snapshot["deferred"].get(queue, 0) + count
+        else:
+            return
+        snapshot["in_flight"] += count
+
+    async def get(self) -> Dict[str, Any]:
+        """The latest snapshot, sampled now if the background sampler is not running."""
+        snapshot = self._snapshot
+        if snapshot is None or (
+            time.monotonic() - self._sampled_at > 3 * settings.TASK_LOAD_SAMPLE_INTERVAL
+        ):
+            snapshot = await self.sample()
+        return self.describe(snapshot)
+
+    async def sample(self) -> Dict[str, Any]:
+        depths = await asyncio.wait_for(
+            asyncio.to_thread(queue_depths, execute_task.app),
+            timeout=settings.METRICS_QUEUE_DEPTH_TIMEOUT,
+        )
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(IN_FLIGHT_KEY)
+        pipe.zcard(SCHEDULED_KEY)
+        for queue in TaskQueue:
+            pipe.llen(deferred_key(queue.value))
+        in_flight, scheduled, *deferred = await asyncio.wait_for(
+            pipe.execute(), timeout=5.0
+        )
+        snapshot: Dict[str, Any] = {
+            "queues": depths,
+            "in_flight": max(0, int(in_flight or 0)),
+            "deferred": {
+                queue.value: length for queue, length in zip(TaskQueue, deferred)
+            },
+            "scheduled": scheduled,
+            "sampled_at": time.time(),
+        }
+        self._snapshot = snapshot
+        self._sampled_at = time.monotonic()
+        for name, depth in depths.items():
+            metrics.QUEUE_DEPTH.labels(name).set(depth)
+        metrics.TASKS_IN_FLIGHT.set(snapshot["in_flight"])
+        for name, length in snapshot["deferred"].items():
+            metrics.TASKS_DEFERRED.labels(name).set(length)
+        return snapshot
+
+    @staticmethod
+    def describe(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+        """The snapshot with the backlog of each worker pool and saturated queues."""
+        pools = {
+            pool: sum(snapshot["queues"].get(queue, 0) for queue in queues)
+            + snapshot["deferred"].get(pool, 0)
+            for pool, queues in WORKER_POOLS.items()
+        }
+        return {
+            **snapshot,
+            "pools": pools,
+            "saturated": [
+                queue.value
+                for queue in TaskQueue
+                if LoadMonitor._saturated(snapshot, queue.value)
+            ],
+        }
+
+    @staticmethod
+    def _saturated(snapshot: Dict[str, Any], queue: str, ratio: float = 1.0) -> bool:
+        queue_limit = settings.TASK_BACKPRESSURE_QUEUE_HIGH_WATER * ratio
+        in_flight_limit = settings.TASK_BACKPRESSURE_IN_FLIGHT_HIGH_WATER * ratio
+        # Deferred and scheduled tasks are unfinished too, but only released
+        # ones load the workers.
+        released = (
+            snapshot["in_flight"]
+            - sum(snapshot["deferred"].values())
+            - snapshot.get("scheduled", 0)
+        )
+        return bool(
+            (queue_limit > 0 and snapshot["queues"].get(queue, 0) >= queue_limit)
+            or (in_flight_limit > 0 and released >= in_flight_limit)
+        )
+
+    async def drain(self) -> int:
+        """Publish deferred tasks of every queue below its low-water mark."""
+        published = 0
+        snapshot = self._snapshot
+        if snapshot is None:
+            return published
+        for queue, deferred in snapshot["deferred"].items():
+            if not deferred or self._saturated(
+                snapshot, queue, settings.TASK_BACKPRESSURE_LOW_WATER_RATIO
+            ):
+                continue
+            entries = cast(
+                Optional[List[str]],
+                await self.client.lpop(
+                    deferred_key(queue), settings.TASK_BACKPRESSURE_DRAIN_BATCH
+                ),
+            )
+            if not entries:
+                continue
+            failed = await asyncio.to_thread(self._publish, entries)
+            if failed:
+                await self.client.lpush(deferred_key(queue), *reversed(failed))
+            count = len(entries) - len(failed)
+            published += count
+            snapshot["queues"][queue] = snapshot["queues"].get(queue, 0) + count
+            snapshot["deferred"][queue] = max(0, deferred - count)
+        if published:
+            logger.info(f"Published {published} deferred tasks")
+        return published
+
+    def _publish(self, entries: List[str]) -> List[str]:
+        """Publish deferred entries in order; returns those from the first failure."""
+        with execute_task.app.producer_or_acquire() as producer:
+            for position, raw in enumerate(entries):
+                entry = serialization.loads(raw)
+                try:
+                    execute_task.apply_async(
+                        entry["call"],
+                        task_id=entry["call"][0],
+                        producer=producer,
+                        **entry["options"],
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to publish deferred tasks: {str(e)}")
+                    return entries[position:]
+        return []
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sample()
+                await self.drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to sample task load: {str(e)!r}")
+            await asyncio.sleep(settings.TASK_LOAD_SAMPLE_INTERVAL)
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import redis.asyncio as redis
+
+from app.core import serialization
+from app.tasks.status_store import TASK_CHANNEL_PREFIX
+
+logger = logging.getLogger(__name__)
+
+RESYNC = None
+
+
+class StatusSubscription:
+    """
+    Pending status events of one stream, coalesced per task.
+
+    Only the latest state of a task matters to a stream, so a newer event
+    replaces an older one that has not been read yet. Memory is therefore
+    bounded by the number of tasks the stream watches, however slow it reads.
+    """
+
+    def __init__(
+        self, task_ids: Iterable[str] = (), name: Optional[str] = None
+    ) -> None:
+        self.task_ids: Set[str] = set(task_ids)
+        self.name = name
+        self._pending: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._changed = asyncio.Event()
+
+    def push(self, task_id: str, data: Optional[str]) -> None:
+        self._pending.pop(task_id, None)
+        self._pending[task_id] = data
+        self._changed.set()
+
+    def matches(self, data: str) -> bool:
+        return self.name is None or serialization.loads(data).get("name") == self.name
+
+    async def get(
+        self, timeout: Optional[float] = None
+    ) -> List[Tuple[str, Optional[str]]]:
+        """
+        Wait for events and return them as ``(task_id, payload or RESYNC)``
+        pairs, or an empty list if none arrived within ``timeout`` seconds.
+        """
+        if not self._changed.is_set():
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._changed.clear()
+        events = list(self._pending.items())
+        self._pending.clear()
+        return events
+
+
+class StatusBroadcaster:
+    """
+    Fans task status events out to open streams.
+
+    A single pattern subscription per API process receives every status change
+    published by the workers and hands it to the subscriptions watching that
+    task, or to filter subscriptions watching every task. A ``RESYNC`` marker is
+    delivered instead when the subscription had to be re-established, so
+    streams re-read the stored state.
+
+    Change hooks are called with the ID of every task that changed, or with
+    ``None`` after a reconnect when changes may have been missed.
+    """
+
+    _reconnect_delay = 1.0
+    _ready_timeout = 5.0
+
+    def __init__(self) -> None:
+        self._redis: Optional[redis.Redis] = None
+        self._subscribers: Dict[str, Set[StatusSubscription]] = {}
+        self._filters: Set[StatusSubscription] = set()
+        self._hooks: List[Callable[[Optional[str]], None]] = []
+        self._listener: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    def bind(self, client: redis.Redis) -> None:
+        self._redis = client
+
+    @property
+    def client(self) -> redis.Redis:
+        assert self._redis is not None, "StatusBroadcaster is not bound to a client"
+        return self._redis
+
+    def add_hook(self, hook: Callable[[Optional[str]], None]) -> None:
+        if hook not in self._hooks:
+            self._hooks.append(hook)
+
+    def start(self) -> None:
+        """Listen for changes even while no stream is open, e.g. for change hooks."""
+        self._ensure_listener()
+
+    async def subscribe(
+        self, task_ids: Iterable[str] = (), name: Optional[str] = None
+    ) -> StatusSubscription:
+        """
+        Watch the given tasks, or every task (optionally only those named
+        ``name``) when no IDs are given.
+        """
+        subscription = StatusSubscription(task_ids, name)
+        if subscription.task_ids:
+            for task_id in subscription.task_ids:
+                self._subscribers.setdefault(task_id, set()).add(subscription)
+        else:
+            self._filters.add(subscription)
+        ready = self._ensure_listener()
+        try:
+            await asyncio.wait_for(ready.wait(), timeout=self._ready_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Status subscription not ready, relying on resync reads")
+        return subscription
+
+    def unsubscribe(
+        self, subscription: StatusSubscription, task_ids: Optional[Iterable[str]] = None
+    ) -> None:
+        """Stop delivering events for ``task_ids``, or for everything by default."""
+        if task_ids is None:
+            self._filters.discard(subscription)
+            task_ids = list(subscription.task_ids)
+        for task_id in task_ids:
+            subscription.task_ids.discard(task_id)
+            subscriptions = self._subscribers.get(task_id)
+            if subscriptions is None:
+                continue
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[task_id]
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        self._ready = None
+
+    def _ensure_listener(self) -> asyncio.Event:
+        if self._ready is None or self._listener is None or self._listener.done():
+            self._ready = asyncio.Event()
+            self._listener = asyncio.create_task(self._listen(self._ready))
+        return self._ready
+
+    async def _listen(self, ready: asyncio.Event) -> None:
+        reconnecting = False
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(f"{TASK_CHANNEL_PREFIX}*")
+                ready.set()
+                if reconnecting:
+                    self._broadcast_resync()
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    task_id = message["channel"][len(TASK_CHANNEL_PREFIX) :]
+                    self._dispatch(task_id, message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Status subscription lost: {str(e)}")
+            finally:
+                ready.clear()
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            reconnecting = True
+            await asyncio.sleep(self._reconnect_delay)
+
+    def _dispatch(self, task_id: str, data: str) -> None:
+        for hook in self._hooks:
+            hook(task_id)
+        for subscription in self._subscribers.get(task_id, ()):
+            subscription.push(task_id, data)
+        for subscription in self._filters:
+            if subscription.matches(data):
+                subscription.push(task_id, data)
+
+    def _broadcast_resync(self) -> None:
+        for hook in self._hooks:
+            hook(None)
+        for task_id, subscriptions in self._subscribers.items():
+            for subscription in subscriptions:
+                subscription.push(task_id, RESYNC)
@@ -0,0 +1,128 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.models.task import TaskStatusResponse
+from app.tasks.status_store import TERMINAL_STATUSES
+
+# Rough per-entry overhead of the cached model and bookkeeping, in bytes.
+_ENTRY_OVERHEAD = 200
+
+
+class StatusCache:
+    """
+    LRU cache of task statuses, bounded by entry count and approximate size.
+
+    Finished tasks never change again, so their status is kept until evicted.
+    Unfinished tasks are kept for ``ttl`` seconds at most and are dropped as
+    soon as a change notification for them arrives. A read that started before
+    the latest notification for its task is not cached, so a slow read can
+    never put an outdated state back.
+    """
+
+    # Longer than any status read is allowed to take.
+    _invalidation_window = 10.0
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[TaskStatusResponse, int, float]]" = (
+            OrderedDict()
+        )
+        self._invalidated: "OrderedDict[str, float]" = OrderedDict()
+        self._bytes = 0
+
+    @classmethod
+    def from_settings(cls) -> Optional["StatusCache"]:
+        if not settings.TASK_STATUS_CACHE_ENABLED:
+            return None
+        return cls(
+            max_entries=settings.TASK_STATUS_CACHE_MAX_ENTRIES,
+            max_bytes=settings.TASK_STATUS_CACHE_MAX_BYTES,
+            ttl=settings.TASK_STATUS_CACHE_TTL_SECONDS,
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, task_id: str) -> Optional[TaskStatusResponse]:
+        entry = self._entries.get(task_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        status, _, expires_at = entry
+        if expires_at < time.monotonic():
+            self._remove(task_id)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(task_id)
+        self.hits += 1
+        return status
+
+    def put(self, status: TaskStatusResponse, read_started: float) -> None:
+        """Cache ``status`` as read at ``read_started``, in ``time.monotonic()``."""
+        task_id = status.task_id
+        if self._invalidated.get(task_id, float("-inf")) >= read_started:
+            return
+        if status.status in TERMINAL_STATUSES:
+            expires_at = float("inf")
+        elif self.ttl > 0:
+            expires_at = time.monotonic() + self.ttl
+        else:
+            return
+
+        self._remove(task_id)
+        size = len(task_id) + len(status.message or "") + _ENTRY_OVERHEAD
+        self._entries[task_id] = (status, size, expires_at)
+        self._bytes += size
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, task_id: Optional[str]) -> None:
+        """
+        Handle a change notification for ``task_id``. ``None`` means changes
+        may have been missed, so every unfinished entry is dropped.
+        """
+        now = time.monotonic()
+        if task_id is None:
+            for cached_id, (status, _, _) in list(self._entries.items()):
+                if status.status not in TERMINAL_STATUSES:
+                    self._remove(cached_id)
+                    self._invalidated[cached_id] = now
+            return
+
+        self._remove(task_id)
+        self._invalidated.pop(task_id, None)
+        self._invalidated[task_id] = now
+        while self._invalidated:
+            oldest_id, invalidated_at = next(iter(self._invalidated.items()))
+            if invalidated_at > now - self._invalidation_window:
+                break
+            del self._invalidated[oldest_id]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._invalidated.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, task_id: str) -> None:
+        entry = self._entries.pop(task_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
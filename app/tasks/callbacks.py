@@ -0,0 +1,325 @@
+"""
+Asynchronous callback delivery.
+
+Workers hand finished results to the dispatcher by pushing them onto a Redis
+list instead of POSTing them themselves. The dispatcher (``python -m
+app.tasks.callbacks``) delivers many callbacks concurrently over pooled
+keep-alive connections, caps in-flight requests per callback host, optionally
+batches several results for the same URL into one POST, and retries failures
+with jittered exponential backoff. Callbacks that run out of retries end up in
+a capped dead-letter list.
+
+Results that carry references to offloaded payloads (see
+``app.tasks.payloads``) get the payloads spliced in when they are sent.
+
+Claimed callbacks are leased rather than removed: they sit in the scheduled set
+until delivered, so callbacks held by a dispatcher that dies are picked up
+again once their lease runs out.
+"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+import redis.asyncio as aioredis
+from redis import Redis
+from redis.exceptions import RedisError
+
+from app.core import metrics, serialization
+from app.core.config import settings
+from app.tasks.connections import create_async_redis_pool
+from app.tasks.payloads import aiter_body, find_refs
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "callbacks:pending"
+SCHEDULED_KEY = "callbacks:scheduled"
+DEAD_LETTER_KEY = "callbacks:dead"
+
+# KEYS: pending list, scheduled set
+# ARGV: now, lease deadline, max entries
+# Moves due retries and expired leases back to pending, then claims entries.
+CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+for _, entry in ipairs(due) do
+    redis.call('ZREM', KEYS[2], entry)
+    redis.call('RPUSH', KEYS[1], entry)
+end
+local claimed = redis.call('LPOP', KEYS[1], ARGV[3])
+if not claimed then
+    return {}
+end
+for _, entry in ipairs(claimed) do
+    redis.call('ZADD', KEYS[2], ARGV[2], entry)
+end
+return claimed
+"""
+
+
+def new_callback_entry(callback_url: str, data: Dict[str, Any]) -> str:
+    return serialization.dumps(
+        {"id": uuid.uuid4().hex, "url": callback_url, "data": data, "attempts": 0}
+    )
+
+
+def enqueue_callback(redis: Redis, callback_url: str, data: Dict[str, Any]) -> None:
+    redis.rpush(PENDING_KEY, new_callback_entry(callback_url, data))
+
+
+async def enqueue_callback_async(
+    redis: aioredis.Redis, callback_url: str, data: Dict[str, Any]
+) -> None:
+    await redis.rpush(PENDING_KEY, new_callback_entry(callback_url, data))
+
+
+def backoff_delay(attempts: int) -> float:
+    """Full-jitter exponential backoff."""
+    ceiling = min(
+        settings.CALLBACK_BACKOFF_MAX, settings.CALLBACK_BACKOFF_BASE * 2**attempts
+    )
+    return random.uniform(0, ceiling)
+
+
+class CallbackDispatcher:
+    """
+    Delivers queued callbacks concurrently.
+
+    At most ``max_in_flight`` batches are claimed at a time. Batches for a host
+    that already has ``max_per_host`` requests in flight wait in a local backlog
+    so that one slow receiver cannot occupy every slot. Successful deliveries
+    are acknowledged in bulk once per dispatch round.
+    """
+
+    _idle_delay = 0.2
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        max_in_flight: Optional[int] = None,
+        max_per_host: Optional[int] = None,
+        batch_size: Optional[int] = None,
+    ) -> None:
+        self._redis = redis
+        self._max_in_flight = max_in_flight or settings.CALLBACK_MAX_IN_FLIGHT
+        self._max_per_host = max_per_host or settings.CALLBACK_MAX_PER_HOST
+        self._batch_size = batch_size or settings.CALLBACK_BATCH_MAX_SIZE
+        self._claim = redis.register_script(CLAIM_SCRIPT)
+        self._host_in_flight: Dict[str, int] = defaultdict(int)
+        self._backlog: Dict[str, Deque[Tuple[str, List[str], float]]] = defaultdict(
+            deque
+        )
+        self._backlog_size = 0
+        self._deliveries: Set[asyncio.Task] = set()
+        self._acks: List[str] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.delivered = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    async def __aenter__(self) -> "CallbackDispatcher":
+        connector = aiohttp.TCPConnector(
+            limit=self._max_in_flight,
+            limit_per_host=self._max_per_host,
+            keepalive_timeout=30,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=settings.CALLBACK_TIMEOUT,
+                connect=settings.CALLBACK_CONNECT_TIMEOUT,
+            ),
+            headers={"Content-Type": "application/json"},
+        )
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.drain()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The HTTP session, open inside ``async with``."""
+        assert self._session is not None, "CallbackDispatcher is not open"
+        return self._session
+
+    async def run(self) -> None:
+        while True:
+            if not await self.dispatch_once():
+                await asyncio.sleep(self._idle_delay)
+
+    async def drain(self) -> None:
+        """Wait for every claimed callback, including the backlog, to be handled."""
+        while self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+        await self._flush_acks()
+
+    async def dispatch_once(self) -> int:
+        """Claim as many callbacks as there are free slots and start delivering them."""
+        await self._flush_acks()
+        free = self._max_in_flight - len(self._deliveries) - self._backlog_size
+        if free <= 0:
+            await asyncio.wait(self._deliveries, return_when=asyncio.FIRST_COMPLETED)
+            return 0
+        now = time.time()
+        try:
+            claimed = await self._claim(
+                keys=[PENDING_KEY, SCHEDULED_KEY],
+                args=[
+                    now,
+                    now + settings.CALLBACK_LEASE_SECONDS,
+                    free * self._batch_size,
+                ],
+            )
+        except RedisError as e:
+            logger.error(f"Failed to claim callbacks: {str(e)}")
+            return 0
+        if not claimed:
+            return 0
+
+        by_url: Dict[str, List[str]] = defaultdict(list)
+        malformed = []
+        for raw in claimed:
+            try:
+                by_url[serialization.loads(raw)["url"]].append(raw)
+            except Exception:
+                malformed.append(raw)
+        if malformed:
+            logger.error(f"Dead-lettering {len(malformed)} malformed callback entries")
+            try:
+                await self._dead_letter(malformed)
+            except RedisError as e:
+                logger.error(f"Failed to dead-letter malformed callbacks: {str(e)}")
+        for url, entries in by_url.items():
+            host = urlsplit(url).netloc
+            for start in range(0, len(entries), self._batch_size):
+                batch = entries[start : start + self._batch_size]
+                if self._host_in_flight[host] < self._max_per_host:
+                    self._start(host, url, batch, now)
+                else:
+                    self._backlog[host].append((url, batch, now))
+                    self._backlog_size += 1
+        return len(claimed)
+
+    def _start(self, host: str, url: str, batch: List[str], claimed_at: float) -> None:
+        self._host_in_flight[host] += 1
+        delivery = asyncio.create_task(self._deliver(host, url, batch, claimed_at))
+        self._deliveries.add(delivery)
+        delivery.add_done_callback(self._deliveries.discard)
+
+    def _release(self, host: str) -> None:
+        self._host_in_flight[host] -= 1
+        backlog = self._backlog.get(host)
+        if backlog:
+            self._backlog_size -= 1
+            self._start(host, *backlog.popleft())
+        else:
+            self._backlog.pop(host, None)
+            if not self._host_in_flight[host]:
+                del self._host_in_flight[host]
+
+    async def _deliver(
+        self, host: str, url: str, batch: List[str], claimed_at: float
+    ) -> None:
+        try:
+            if time.time() - claimed_at > settings.CALLBACK_LEASE_SECONDS / 2:
+                # Waited in the backlog long enough to risk a second delivery.
+                deadline = time.time() + settings.CALLBACK_LEASE_SECONDS
+                await self._redis.zadd(
+                    SCHEDULED_KEY, {raw: deadline for raw in batch}, xx=True
+                )
+            try:
+                payloads = [serialization.loads(raw)["data"] for raw in batch]
+                body = await self._body(payloads[0] if len(payloads) == 1 else payloads)
+                async with self.session.post(url, data=body) as response:
+                    status = response.status
+                    await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Callback to {url} failed: {str(e)!r}")
+                await self._retry(batch)
+                return
+            except RedisError:
+                raise
+            except Exception as e:
+                # Retrying cannot fix an entry or body that does not encode.
+                logger.error(f"Failed to build callback to {url}: {str(e)!r}")
+                await self._dead_letter(batch)
+                return
+
+            if status < 400:
+                self._acks.extend(batch)
+                self.delivered += len(batch)
+                metrics.CALLBACKS_DELIVERED.inc(len(batch))
+            elif status >= 500 or status == 429:
+                logger.warning(f"Callback to {url} returned {status}")
+                await self._retry(batch)
+            else:
+                logger.error(f"Callback to {url} rejected with {status}")
+                await self._dead_letter(batch)
+        except RedisError as e:
+            # The lease is still held, so the batch is retried once it expires.
+            logger.error(f"Failed to record callback outcome for {url}: {str(e)}")
+        finally:
+            self._release(host)
+
+    async def _body(self, data: Any) -> Any:
+        if not find_refs(data):
+            return serialization.dumps_bytes(data)
+        if settings.CALLBACK_STREAM_PAYLOADS:
+            return aiter_body(self._redis, data, stream=True)
+        return b"".join([chunk async for chunk in aiter_body(self._redis, data)])
+
+    async def _flush_acks(self) -> None:
+        if not self._acks:
+            return
+        acks, self._acks = self._acks, []
+        try:
+            await self._redis.zrem(SCHEDULED_KEY, *acks)
+        except RedisError as e:
+            logger.error(f"Failed to acknowledge {len(acks)} callbacks: {str(e)}")
+
+    async def _retry(self, batch: List[str]) -> None:
+        exhausted = []
+        pipe = self._redis.pipeline(transaction=True)
+        for raw in batch:
+            entry = serialization.loads(raw)
+            entry["attempts"] += 1
+            if entry["attempts"] > settings.CALLBACK_MAX_RETRIES:
+                exhausted.append(raw)
+                continue
+            pipe.zrem(SCHEDULED_KEY, raw)
+            due = time.time() + backoff_delay(entry["attempts"])
+            pipe.zadd(SCHEDULED_KEY, {serialization.dumps(entry): due})
+            self.retried += 1
+            metrics.CALLBACKS_RETRIED.inc()
+        await pipe.execute()
+        if exhausted:
+            await self._dead_letter(exhausted)
+
+    async def _dead_letter(self, batch: List[str]) -> None:
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.zrem(SCHEDULED_KEY, *batch)
+        pipe.lpush(DEAD_LETTER_KEY, *batch)
+        pipe.ltrim(DEAD_LETTER_KEY, 0, settings.CALLBACK_DEAD_LETTER_MAX - 1)
+        await pipe.execute()
+        self.dead_lettered += len(batch)
+        metrics.CALLBACKS_DEAD_LETTERED.inc(len(batch))
+
+
+async def main() -> None:
+    redis = aioredis.Redis(connection_pool=create_async_redis_pool())
+    metrics.start_exporter(settings.METRICS_DISPATCHER_PORT)
+    async with CallbackDispatcher(redis) as dispatcher:
+        logger.info("Callback dispatcher started")
+        await dispatcher.run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
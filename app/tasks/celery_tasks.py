@@ -1,125 +1,368 @@
-import json
+import asyncio
 import logging
-import random
+import os
 import time
-from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, List, Optional, Union, cast
+
 import requests
 from celery import Celery
+from celery.signals import (
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    task_revoked,
+    worker_init,
+    worker_process_shutdown,
+    worker_shutdown,
+)
+from prometheus_client import multiprocess
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 from redis.exceptions import RedisError
+
+from app.core import metrics, serialization
 from app.core.config import settings
-from app.models.task import TaskResult, TaskStatus
+from app.core.serialization import celery_accept_content, celery_serializer
+from app.models.task import TaskStatus
+from app.tasks.callbacks import backoff_delay, enqueue_callback, enqueue_callback_async
+from app.tasks.connections import get_http_session, get_redis_connection
+from app.tasks.execution import (
+    AsyncTaskRun,
+    TaskRun,
+    async_executor,
+    body_for,
+    detached_entry,
+    run_task,
+    run_task_async,
+    run_with_own_client,
+    stop_async_executor,
+)
+from app.tasks.payloads import PayloadExpired, find_refs, iter_body
+from app.tasks.queues import MAX_PRIORITY, TASK_ROUTES, transport_priority
+from app.tasks.status_store import prune_indexes, report_usage, update_status
+from app.tasks.workflows import advance_workflow
 
 logger = logging.getLogger(__name__)
 
-celery = Celery(
+celery: Celery = Celery(
     "tasks",
-    broker="redis://redis:6379/0",
-    backend="redis://redis:6379/0"
+    broker=settings.celery_broker_url,
+    backend=settings.celery_result_backend,
 )
 celery.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
+    task_serializer=celery_serializer(),
+    accept_content=celery_accept_content(),
+    result_serializer=celery_serializer(),
+    result_accept_content=celery_accept_content(),
     timezone="UTC",
     enable_utc=True,
+    task_time_limit=settings.CELERY_TASK_TIME_LIMIT,
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    result_expires=settings.CELERY_RESULT_EXPIRES_SECONDS,
+    task_routes=TASK_ROUTES,
+    task_default_queue=settings.TASK_DEFAULT_QUEUE_CLASS,
+    task_default_priority=transport_priority(
+        settings.TASK_DEFAULT_PRIORITY, celery.conf.broker_url
+    ),
+    broker_transport_options={
+        "priority_steps": list(range(MAX_PRIORITY + 1)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+        # With late acks an unacknowledged message is redelivered after this,
+        # so it must outlast the longest allowed run.
+        "visibility_timeout": settings.CELERY_TASK_TIME_LIMIT + 600,
+    },
+    task_queue_max_priority=MAX_PRIORITY,
+    beat_schedule={
+        "report-task-store-usage": {
+            "task": "report_task_store_usage",
+            "schedule": settings.TASK_STORE_REPORT_INTERVAL,
+        },
+        "prune-task-indexes": {
+            "task": "prune_task_indexes",
+            "schedule": settings.TASK_INDEX_PRUNE_INTERVAL,
+        },
+    },
 )
 
-def get_redis_connection() -> Redis:
-    try:
-        redis = Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            db=0,
-            decode_responses=True,
-            socket_timeout=5,
-            socket_connect_timeout=5
-        )
-        return redis
-    except RedisError as e:
-        logger.error(f"Failed to connect to Redis: {str(e)}")
-        raise
+RUN_SECONDS = {name: metrics.TASK_RUN_SECONDS.labels(name) for name in TASK_ROUTES}
+_run_started: Dict[str, float] = {}
+
+
+@before_task_publish.connect
+def stamp_submission(headers: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+    if headers is not None and "submitted_at" not in headers:
+        headers["submitted_at"] = time.time()
+
+
+@task_prerun.connect
+def record_task_start(task_id: str, task: Any, **kwargs: Any) -> None:
+    now = time.time()
+    _run_started[task_id] = now
+    if task.name != "execute_task":
+        return
+    submitted_at = task.request.get("submitted_at")
+    queue = (task.request.delivery_info or {}).get("routing_key")
+    if submitted_at is not None and queue in metrics.QUEUE_WAIT_SECONDS:
+        metrics.QUEUE_WAIT_SECONDS[queue].observe(max(0.0, now - submitted_at))
+
+
+@task_postrun.connect
+def record_task_end(task_id: str, task: Any, **kwargs: Any) -> None:
+    started = _run_started.pop(task_id, None)
+    if started is not None and task.name in RUN_SECONDS:
+        RUN_SECONDS[task.name].observe(time.time() - started)
+
+
+@worker_init.connect
+def start_metrics_exporter(**kwargs: Any) -> None:
+    metrics.start_exporter(settings.METRICS_WORKER_PORT)
+
+
+@worker_process_shutdown.connect
+def release_process_metrics(pid: Optional[int] = None, **kwargs: Any) -> None:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+@worker_shutdown.connect
+def stop_task_event_loop(**kwargs: Any) -> None:
+    stop_async_executor()
+
+
+# Internal tasks report through the task records, so by default nothing reads
+# their Celery results and storing one per status update only adds writes.
+IGNORE_INTERNAL_RESULTS = not settings.CELERY_STORE_INTERNAL_RESULTS
+
 
 @celery.task(bind=True, name="execute_task")
-def execute_task(self, task_id: str, name: str, parameters: Dict[str, Any], callback_url: str) -> None:
-    redis = None
-    try:
+def execute_task(
+    self,
+    task_id: str,
+    name: str,
+    parameters: Dict[str, Any],
+    callback_url: str,
+    deadline: Optional[float] = None,
+    workflow: Optional[Dict[str, Any]] = None,
+) -> None:
+    body = body_for(name)
+    inputs = workflow["inputs"] if workflow is not None else None
+    if not asyncio.iscoroutinefunction(body):
         redis = get_redis_connection()
-        update_task_status.delay(task_id, TaskStatus.RUNNING, 0.0, "Task started")
-        total_steps = random.randint(5, 15)
-        start_time = time.time()
-        for step in range(1, total_steps + 1):
-            work_time = random.uniform(1.0, 3.0)
-            time.sleep(work_time)
-            progress = step / total_steps
-            message = f"Processing step {step}/{total_steps} ({(progress * 100):.1f}%)"
-            update_task_status.delay(task_id, TaskStatus.RUNNING, progress, message)
-        execution_time = time.time() - start_time
-        result = {
-            "name": name,
-            "parameters": parameters,
-            "completed_at": datetime.utcnow().isoformat(),
-            "result_data": {
-                "message": "Task completed successfully",
-                "total_steps": total_steps,
-                "execution_time": execution_time
-            }
-        }
-        update_task_status.delay(task_id, TaskStatus.COMPLETED, 1.0, "Task completed")
-        task_result = TaskResult(
-            task_id=task_id,
-            status=TaskStatus.COMPLETED,
-            result=result,
-            completed_at=datetime.utcnow()
+        run_task(
+            TaskRun(redis, task_id, name, parameters, deadline, inputs),
+            body,
+            lambda data: task_finished(redis, callback_url, workflow, data),
         )
-        send_callback.delay(callback_url, task_result.dict())
-    except Exception as e:
-        error_message = f"Task failed: {str(e)}"
-        update_task_status.delay(task_id, TaskStatus.FAILED, 0.0, error_message)
-        task_result = TaskResult(
-            task_id=task_id,
-            status=TaskStatus.FAILED,
-            error=error_message,
-            completed_at=datetime.utcnow()
+        return
+
+    async def run(client: AsyncRedis) -> None:
+        await run_task_async(
+            AsyncTaskRun(client, task_id, name, parameters, deadline, inputs),
+            body,
+            lambda data: task_finished_async(client, callback_url, workflow, data),
+        )
+
+    executor = async_executor()
+    if executor is None:
+        asyncio.run(run_with_own_client(run))
+        return
+    # The message is acknowledged while the task runs, so the task is leased
+    # for redelivery to the queue it came from (see app.tasks.execution).
+    delivery_info = self.request.delivery_info or {}
+    options: Dict[str, Any] = {
+        "queue": delivery_info.get("routing_key") or settings.TASK_DEFAULT_QUEUE_CLASS
+    }
+    if delivery_info.get("priority") is not None:
+        options["priority"] = delivery_info["priority"]
+    call = [task_id, name, parameters, callback_url, deadline, workflow]
+    executor.detach(get_redis_connection(), task_id, detached_entry(call, options), run)
+
+
+def task_finished(
+    redis: Redis,
+    callback_url: str,
+    workflow: Optional[Dict[str, Any]],
+    data: Dict[str, Any],
+) -> None:
+    # Workflow steps have no callback of their own.
+    if callback_url:
+        deliver_callback(redis, callback_url, data)
+    if workflow is not None:
+        advance_step(redis, workflow, data)
+
+
+async def task_finished_async(
+    redis: AsyncRedis,
+    callback_url: str,
+    workflow: Optional[Dict[str, Any]],
+    data: Dict[str, Any],
+) -> None:
+    if callback_url:
+        await deliver_callback_async(redis, callback_url, data)
+    if workflow is not None:
+        await asyncio.to_thread(advance_step, get_redis_connection(), workflow, data)
+
+
+def advance_step(redis: Redis, workflow: Dict[str, Any], data: Dict[str, Any]) -> None:
+    try:
+        advance_workflow(
+            redis,
+            workflow,
+            data,
+            publish_step,
+            lambda url, body: deliver_callback(redis, url, body),
+        )
+    except RedisError as e:
+        logger.error(f"Failed to advance workflow {workflow['id']}: {str(e)}")
+
+
+def publish_step(call: List[Any], options: Dict[str, Any]) -> None:
+    execute_task.apply_async(call, task_id=call[0], **options)
+
+
+@task_revoked.connect
+def skip_revoked_step(request: Any = None, **kwargs: Any) -> None:
+    """A step cancelled while queued never runs, so its workflow is advanced here."""
+    if request is None or getattr(request, "task_name", None) != "execute_task":
+        return
+    args = request.args or []
+    workflow = args[5] if len(args) > 5 else (request.kwargs or {}).get("workflow")
+    if workflow is not None:
+        advance_step(
+            get_redis_connection(), workflow, {"status": TaskStatus.CANCELLED.value}
         )
-        send_callback.delay(callback_url, task_result.dict())
 
-@celery.task(name="update_task_status")
-def update_task_status(task_id: str, status: TaskStatus, progress: float, message: str) -> None:
+
+def deliver_callback(redis: Redis, callback_url: str, data: Dict[str, Any]) -> None:
+    if settings.CALLBACK_DELIVERY == "celery":
+        send_callback.delay(callback_url, data)
+        return
+    try:
+        enqueue_callback(redis, callback_url, data)
+    except RedisError as e:
+        logger.error(f"Failed to queue callback to {callback_url}: {str(e)}")
+        send_callback.delay(callback_url, data)
+
+
+async def deliver_callback_async(
+    redis: AsyncRedis, callback_url: str, data: Dict[str, Any]
+) -> None:
+    # Publishing to the broker is blocking, so it is kept off the event loop.
+    if settings.CALLBACK_DELIVERY == "celery":
+        await asyncio.to_thread(send_callback.delay, callback_url, data)
+        return
+    try:
+        await enqueue_callback_async(redis, callback_url, data)
+    except RedisError as e:
+        logger.error(f"Failed to queue callback to {callback_url}: {str(e)}")
+        await asyncio.to_thread(send_callback.delay, callback_url, data)
+
+
+@celery.task(name="dispatch_tasks", ignore_result=IGNORE_INTERNAL_RESULTS)
+def dispatch_tasks(
+    calls: List[List[Any]], options: Optional[Dict[str, Any]] = None
+) -> None:
+    """Publish the execute_task messages for a chunk of a batch submission."""
+    # Queue wait is measured from the batch submission, not from this fan-out.
+    headers = {
+        "submitted_at": dispatch_tasks.request.get("submitted_at") or time.time()
+    }
+    with celery.producer_or_acquire() as producer:
+        for call in calls:
+            try:
+                execute_task.apply_async(
+                    call,
+                    task_id=call[0],
+                    producer=producer,
+                    headers=headers,
+                    **(options or {}),
+                )
+            except Exception as e:
+                task_id = call[0]
+                logger.error(f"Failed to queue task {task_id}: {str(e)}")
+                update_status(
+                    get_redis_connection(),
+                    task_id,
+                    TaskStatus.FAILED,
+                    0.0,
+                    f"Failed to create Celery task: {str(e)}",
+                )
+
+
+@celery.task(name="update_task_status", ignore_result=IGNORE_INTERNAL_RESULTS)
+def update_task_status(
+    task_id: str, status: TaskStatus, progress: float, message: str
+) -> None:
     redis = None
     try:
         redis = get_redis_connection()
-        task_data = redis.get(f"task:{task_id}")
-        if not task_data:
-            return
-        task_data = json.loads(task_data)
-        task_data.update({
-            "status": status,
-            "progress": progress,
-            "message": message,
-            "updated_at": datetime.utcnow().isoformat()
-        })
-        redis.set(f"task:{task_id}", json.dumps(task_data))
+        stored_status = update_status(redis, task_id, status, progress, message)
+        if stored_status is not None and stored_status != status:
+            logger.info(
+                f"Ignored {status} update for task {task_id} in {stored_status}"
+            )
     except Exception as e:
         logger.error(f"Failed to update task {task_id} status: {str(e)}")
 
-@celery.task(name="send_callback", bind=True, max_retries=3)
+
+@celery.task(name="report_task_store_usage", ignore_result=True)
+def report_task_store_usage() -> Dict[str, Dict[str, int]]:
+    return report_usage(get_redis_connection())
+
+
+@celery.task(name="prune_task_indexes", ignore_result=True)
+def prune_task_indexes() -> int:
+    pruned = prune_indexes(get_redis_connection())
+    if pruned:
+        logger.info(f"Dropped {pruned} expired tasks from the indexes")
+    return pruned
+
+
+@celery.task(
+    name="send_callback",
+    bind=True,
+    max_retries=settings.CALLBACK_MAX_RETRIES,
+    ignore_result=IGNORE_INTERNAL_RESULTS,
+)
 def send_callback(self, callback_url: str, data: Dict[str, Any]) -> None:
     try:
-        response = requests.post(
+        body: Union[bytes, Iterator[bytes]]
+        if find_refs(data):
+            parts = iter_body(
+                get_redis_connection(), data, settings.CALLBACK_STREAM_PAYLOADS
+            )
+            body = parts if settings.CALLBACK_STREAM_PAYLOADS else b"".join(parts)
+        else:
+            body = serialization.dumps_bytes(data)
+        response = get_http_session().post(
             callback_url,
-            json=data,
-            timeout=10,
-            headers={"Content-Type": "application/json"}
+            data=body,
+            timeout=(settings.CALLBACK_CONNECT_TIMEOUT, settings.CALLBACK_TIMEOUT),
         )
         if response.status_code >= 400:
             if response.status_code >= 500 or response.status_code == 429:
-                retry_delay = 2 ** self.request.retries
-                raise self.retry(exc=Exception("Callback error"), countdown=retry_delay)
+                raise retry_callback(self, Exception("Callback error"))
+            metrics.CALLBACKS_FAILED.inc()
+            return
+        metrics.CALLBACKS_DELIVERED.inc()
     except requests.exceptions.Timeout:
-        retry_delay = 2 ** self.request.retries
-        raise self.retry(exc=requests.exceptions.Timeout(), countdown=retry_delay)
+        raise retry_callback(self, requests.exceptions.Timeout())
     except requests.exceptions.RequestException as e:
-        retry_delay = 2 ** self.request.retries
-        raise self.retry(exc=e, countdown=retry_delay)
\ No newline at end of file
+        raise retry_callback(self, e)
+    except PayloadExpired as e:
+        # The retry sends the expired payload as null.
+        raise retry_callback(self, e)
+
+
+def retry_callback(task: Any, exc: Exception) -> Exception:
+    if task.request.retries >= task.max_retries:
+        metrics.CALLBACKS_FAILED.inc()
+    else:
+        metrics.CALLBACKS_RETRIED.inc()
+    return cast(
+        Exception,
+        task.retry(exc=exc, countdown=backoff_delay(task.request.retries + 1)),
+    )
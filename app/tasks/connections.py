@@ -0,0 +1,81 @@
+import logging
+from typing import Any, Dict, Optional
+
+import redis.asyncio as aioredis
+import requests
+from celery.signals import worker_process_init
+from redis import ConnectionPool, Redis
+from requests.adapters import HTTPAdapter
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_redis_pool: Optional[ConnectionPool] = None
+_http_session: Optional[requests.Session] = None
+
+
+def create_redis_pool() -> ConnectionPool:
+    """Pool for worker clients, on the same ``REDIS_URL`` as the Celery broker."""
+    return ConnectionPool.from_url(
+        settings.REDIS_URL,
+        decode_responses=True,
+        max_connections=settings.REDIS_POOL_MAX_CONNECTIONS,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        health_check_interval=30,
+    )
+
+
+def create_async_redis_pool(**overrides: Any) -> aioredis.BlockingConnectionPool:
+    """
+    Pool for the API's asyncio client, on ``REDIS_URL`` like the workers. Requests
+    beyond ``max_connections`` wait up to ``REDIS_POOL_TIMEOUT`` for a free
+    connection instead of failing.
+    """
+    options: Dict[str, Any] = dict(
+        decode_responses=True,
+        max_connections=settings.REDIS_POOL_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        retry_on_timeout=True,
+        health_check_interval=30,
+    )
+    options.update(overrides)
+    return aioredis.BlockingConnectionPool.from_url(settings.REDIS_URL, **options)
+
+
+def create_http_session() -> requests.Session:
+    adapter = HTTPAdapter(
+        pool_connections=settings.CALLBACK_POOL_CONNECTIONS,
+        pool_maxsize=settings.CALLBACK_POOL_MAXSIZE,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+
+@worker_process_init.connect
+def init_worker_connections(**kwargs: Any) -> None:
+    """Give every worker process its own pools instead of inheriting the parent's."""
+    global _redis_pool, _http_session
+    _redis_pool = create_redis_pool()
+    _http_session = create_http_session()
+    logger.info("Initialized Redis and callback connection pools")
+
+
+def get_redis_connection() -> Redis:
+    global _redis_pool
+    if _redis_pool is None:
+        _redis_pool = create_redis_pool()
+    return Redis(connection_pool=_redis_pool)
+
+
+def get_http_session() -> requests.Session:
+    global _http_session
+    if _http_session is None:
+        _http_session = create_http_session()
+    return _http_session
@@ -0,0 +1,577 @@
+"""
+Task bodies and the engines running them.
+
+A task body does the work of a task and returns its result data. A plain
+function gets a ``TaskRun``. A coroutine function gets an ``AsyncTaskRun``,
+which has the same attributes and the same methods as coroutines. Bodies are
+registered per task name with ``@task_body(name)`` (see ``app.tasks.registry``).
+Tasks whose name has no body run the simulated workload.
+
+Prefork pools run one task per process. A coroutine body there gets an event
+loop of its own for the length of the task, so one interface serves
+CPU-bound and I/O-bound bodies. Pools whose ``TASK_QUEUE_EXECUTOR`` is
+``asyncio`` run Celery's thread pool instead and hand every coroutine body to
+one ``AsyncExecutor`` per process. There the tasks share one event loop and
+one Redis connection pool, with at most ``TASK_ASYNC_CONCURRENCY`` of them in
+flight at once.
+
+A pool thread hands its task to the loop and returns, so the message is
+acknowledged while the task runs and the threads only bound how fast tasks
+are taken from the broker. In its place the task is leased in
+``tasks:detached``: its ``execute_task`` call is kept in
+``tasks:detached:entries`` and its lease is renewed by the executor until the
+task ends. If the process dies first, the scheduler republishes the call once
+the lease has run out, unless the task's record shows it has finished (see
+``app.tasks.scheduler``). A task is therefore run at least once, as with
+late acknowledgement on prefork pools.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.exceptions import RedisError
+
+from app.core import metrics, serialization
+from app.core.config import settings
+from app.models.task import TaskResult, TaskStatus
+from app.tasks.connections import create_async_redis_pool
+from app.tasks.payloads import is_ref, load, load_async
+from app.tasks.progress import AsyncProgressReporter, ProgressReporter
+from app.tasks.registry import TaskBody, lookup
+
+logger = logging.getLogger(__name__)
+
+DETACHED_KEY = "tasks:detached"
+DETACHED_ENTRIES_KEY = "tasks:detached:entries"
+
+T = TypeVar("T")
+Deliver = Callable[[Dict[str, Any]], None]
+DeliverAsync = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class TaskInterrupted(Exception):
+    """Raised inside a task body when the task must stop before completing."""
+
+    def __init__(self, status: TaskStatus, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def body_for(name: str) -> TaskBody:
+    task_type = lookup(name)
+    if task_type is not None:
+        return task_type.body
+    if _executor is not None:
+        return simulated_work_async
+    return simulated_work
+
+
+class _RunState:
+    def __init__(
+        self,
+        task_id: str,
+        name: str,
+        parameters: Any,
+        deadline: Optional[float],
+        progress: Any,
+        inputs: Optional[Dict[str, Any]],
+    ) -> None:
+        # Large parameters arrive as a reference (see app.tasks.payloads) and
+        # are resolved before the body runs; the result keeps the reference.
+        # The results of the workflow steps this one depends on, in
+        # ``inputs``, stay references that bodies resolve with ``payloads.load``.
+        self.task_id = task_id
+        self.name = name
+        self.parameters = parameters
+        self.parameters_ref = parameters if is_ref(parameters) else None
+        self.deadline = deadline
+        self.inputs = inputs or {}
+        self.progress = progress
+        self.fraction = 0.0
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, if the task has one."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+    def check(self) -> None:
+        # Both checks are local: cancellation is learned from the refused
+        # progress write, the deadline from the clock.
+        interrupted = self.progress.interrupted
+        if self.progress.missing:
+            raise TaskInterrupted(TaskStatus.CANCELLED, "Task record no longer exists")
+        if interrupted == TaskStatus.CANCELLED:
+            raise TaskInterrupted(TaskStatus.CANCELLED, "Task was cancelled")
+        if interrupted is not None:
+            raise TaskInterrupted(interrupted, f"Task already {interrupted.value}")
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise TaskInterrupted(TaskStatus.TIMED_OUT, "Task deadline exceeded")
+
+    def _bounded(self, seconds: float) -> float:
+        remaining = self.remaining()
+        return seconds if remaining is None else min(seconds, remaining)
+
+    def _resolved(self, parameters: Any) -> None:
+        if parameters is None:
+            raise Exception("Task parameters have expired")
+        self.parameters = parameters
+
+
+class TaskRun(_RunState):
+    """What a plain task body gets: its task and ways to report progress and wait."""
+
+    def __init__(
+        self,
+        redis: Redis,
+        task_id: str,
+        name: str,
+        parameters: Any,
+        deadline: Optional[float] = None,
+        inputs: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        super().__init__(
+            task_id,
+            name,
+            parameters,
+            deadline,
+            ProgressReporter(redis, task_id),
+            inputs,
+        )
+        self.redis = redis
+
+    def load_parameters(self) -> None:
+        """Replace offloaded parameters with their stored value."""
+        if self.parameters_ref is not None:
+            self._resolved(load(self.redis, self.parameters_ref))
+
+    def report(self, fraction: float, message: str) -> None:
+        """Record progress, then stop if the task was cancelled or ran out of time."""
+        self.fraction = fraction
+        self.progress.update(fraction, message)
+        self.check()
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Wait, but no longer than the deadline, then stop if the task must. A
+        coalesced progress update is written as soon as its interval has passed.
+        """
+        seconds = self._bounded(seconds)
+        delay = self.progress.pending_delay()
+        if delay is not None and delay <= seconds:
+            if delay > 0:
+                time.sleep(delay)
+            self.progress.flush()
+            seconds -= delay
+        if seconds > 0:
+            time.sleep(seconds)
+        self.check()
+
+
+class AsyncTaskRun(_RunState):
+    """``TaskRun`` for coroutine bodies."""
+
+    def __init__(
+        self,
+        redis: AsyncRedis,
+        task_id: str,
+        name: str,
+        parameters: Any,
+        deadline: Optional[float] = None,
+        inputs: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        super().__init__(
+            task_id,
+            name,
+            parameters,
+            deadline,
+            AsyncProgressReporter(redis, task_id),
+            inputs,
+        )
+        self.redis = redis
+
+    async def load_parameters(self) -> None:
+        if self.parameters_ref is not None:
+            self._resolved(await load_async(self.redis, self.parameters_ref))
+
+    async def report(self, fraction: float, message: str) -> None:
+        self.fraction = fraction
+        await self.progress.update(fraction, message)
+        self.check()
+
+    async def sleep(self, seconds: float) -> None:
+        seconds = self._bounded(seconds)
+        delay = self.progress.pending_delay()
+        if delay is not None and delay <= seconds:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.progress.flush()
+            seconds -= delay
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+        self.check()
+
+
+def simulated_work(run: TaskRun) -> Dict[str, Any]:
+    """Steps of random length standing in for real work."""
+    total_steps = random.randint(
+        settings.TASK_WORKLOAD_MIN_STEPS, settings.TASK_WORKLOAD_MAX_STEPS
+    )
+    start_time = time.time()
+    for step in range(1, total_steps + 1):
+        step_started = time.monotonic()
+        run.sleep(
+            random.uniform(
+                settings.TASK_WORKLOAD_MIN_STEP_SECONDS,
+                settings.TASK_WORKLOAD_MAX_STEP_SECONDS,
+            )
+        )
+        metrics.TASK_STEP_SECONDS.observe(time.monotonic() - step_started)
+        fraction = step / total_steps
+        run.report(
+            fraction, f"Processing step {step}/{total_steps} ({(fraction * 100):.1f}%)"
+        )
+    return {
+        "message": "Task completed successfully",
+        "total_steps": total_steps,
+        "execution_time": time.time() - start_time,
+    }
+
+
+async def simulated_work_async(run: AsyncTaskRun) -> Dict[str, Any]:
+    """``simulated_work`` waiting on the event loop."""
+    total_steps = random.randint(
+        settings.TASK_WORKLOAD_MIN_STEPS, settings.TASK_WORKLOAD_MAX_STEPS
+    )
+    start_time = time.time()
+    for step in range(1, total_steps + 1):
+        step_started = time.monotonic()
+        await run.sleep(
+            random.uniform(
+                settings.TASK_WORKLOAD_MIN_STEP_SECONDS,
+                settings.TASK_WORKLOAD_MAX_STEP_SECONDS,
+            )
+        )
+        metrics.TASK_STEP_SECONDS.observe(time.monotonic() - step_started)
+        fraction = step / total_steps
+        await run.report(
+            fraction, f"Processing step {step}/{total_steps} ({(fraction * 100):.1f}%)"
+        )
+    return {
+        "message": "Task completed successfully",
+        "total_steps": total_steps,
+        "execution_time": time.time() - start_time,
+    }
+
+
+def _completed(run: _RunState, result_data: Any) -> Dict[str, Any]:
+    result = {
+        "name": run.name,
+        "parameters": run.parameters_ref or run.parameters,
+        "completed_at": datetime.utcnow().isoformat(),
+        "result_data": result_data,
+    }
+    return TaskResult(
+        task_id=run.task_id,
+        status=TaskStatus.COMPLETED,
+        result=result,
+        completed_at=datetime.utcnow(),
+    ).model_dump(mode="json")
+
+
+def _stopped(run: _RunState, status: TaskStatus, error: str) -> Dict[str, Any]:
+    return TaskResult(
+        task_id=run.task_id, status=status, error=error, completed_at=datetime.utcnow()
+    ).model_dump(mode="json")
+
+
+async def _within_time_limit(work: Awaitable[T]) -> T:
+    # Stands in for the hard time limit that only prefork pools enforce. Not
+    # ``wait_for``, so that timeouts raised by the body itself stay failures.
+    future = asyncio.ensure_future(work)
+    try:
+        done, _ = await asyncio.wait({future}, timeout=settings.CELERY_TASK_TIME_LIMIT)
+    finally:
+        if not future.done():
+            future.cancel()
+    if not done:
+        raise TaskInterrupted(TaskStatus.TIMED_OUT, "Task time limit exceeded")
+    return future.result()
+
+
+def run_task(run: TaskRun, body: TaskBody, deliver: Deliver) -> None:
+    """Run a plain body, recording its outcome and delivering the callback."""
+    try:
+        run.progress.start("Task started")
+        run.check()
+        run.load_parameters()
+        result_data = body(run)
+        run.progress.finish(TaskStatus.COMPLETED, 1.0, "Task completed")
+        deliver(_completed(run, result_data))
+    except TaskInterrupted as e:
+        logger.info(f"Task {run.task_id} stopped early: {str(e)}")
+        if run.progress.interrupted is None:
+            try:
+                run.progress.finish(e.status, run.fraction, str(e))
+            except RedisError as redis_error:
+                logger.error(
+                    f"Failed to update task {run.task_id} status: {str(redis_error)}"
+                )
+        deliver(_stopped(run, e.status, str(e)))
+    except Exception as e:
+        error_message = f"Task failed: {str(e)}"
+        try:
+            run.progress.finish(TaskStatus.FAILED, 0.0, error_message)
+        except RedisError as redis_error:
+            logger.error(
+                f"Failed to update task {run.task_id} status: {str(redis_error)}"
+            )
+        deliver(_stopped(run, TaskStatus.FAILED, error_message))
+
+
+async def run_task_async(
+    run: AsyncTaskRun, body: TaskBody, deliver: DeliverAsync
+) -> None:
+    """``run_task`` for coroutine bodies, which are also held to the task time limit."""
+    try:
+        await run.progress.start("Task started")
+        run.check()
+        await run.load_parameters()
+        result_data = await _within_time_limit(body(run))
+        await run.progress.finish(TaskStatus.COMPLETED, 1.0, "Task completed")
+        await deliver(_completed(run, result_data))
+    except TaskInterrupted as e:
+        logger.info(f"Task {run.task_id} stopped early: {str(e)}")
+        if run.progress.interrupted is None:
+            try:
+                await run.progress.finish(e.status, run.fraction, str(e))
+            except RedisError as redis_error:
+                logger.error(
+                    f"Failed to update task {run.task_id} status: {str(redis_error)}"
+                )
+        await deliver(_stopped(run, e.status, str(e)))
+    except Exception as e:
+        error_message = f"Task failed: {str(e)}"
+        try:
+            await run.progress.finish(TaskStatus.FAILED, 0.0, error_message)
+        except RedisError as redis_error:
+            logger.error(
+                f"Failed to update task {run.task_id} status: {str(redis_error)}"
+            )
+        await deliver(_stopped(run, TaskStatus.FAILED, error_message))
+
+
+async def run_with_own_client(task: Callable[[AsyncRedis], Awaitable[T]]) -> T:
+    """Run ``task`` with an asyncio client used only by it, e.g. on a prefork pool."""
+    client = AsyncRedis(connection_pool=create_async_redis_pool(max_connections=2))
+    try:
+        return await task(client)
+    finally:
+        await client.aclose()
+
+
+def detached_entry(call: List[Any], options: Dict[str, Any]) -> str:
+    """A leased ``execute_task`` call and the ``apply_async`` options for it."""
+    # The lease time tells a redelivered entry from the one it replaces.
+    return serialization.dumps(
+        {"call": call, "options": options, "leased_at": time.time()}
+    )
+
+
+class AsyncExecutor:
+    """
+    Runs task coroutines on an event loop in a background thread.
+
+    At most ``concurrency`` coroutines are in flight; callers wait for a slot
+    in their own thread. All of them share one asyncio Redis client.
+    """
+
+    def __init__(self, concurrency: int) -> None:
+        self._concurrency = max(1, concurrency)
+        self._slots = threading.BoundedSemaphore(self._concurrency)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._redis: Optional[AsyncRedis] = None
+        self._renewer: Optional[asyncio.Task] = None
+        # Coroutines in flight and the task IDs of the detached ones.
+        self._running: Dict[asyncio.Task, Optional[str]] = {}
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=loop.run_forever, name="task-event-loop", daemon=True
+                )
+                self._thread.start()
+                self._loop = loop
+            return self._loop
+
+    def run(self, task: Callable[[AsyncRedis], Awaitable[T]]) -> T:
+        """Run ``task`` with the shared client and wait for its result."""
+        self._acquire()
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._run(task), self.start())
+        except BaseException:
+            self._slots.release()
+            raise
+        return future.result()
+
+    def detach(
+        self,
+        redis: Redis,
+        task_id: str,
+        entry: str,
+        task: Callable[[AsyncRedis], Awaitable[None]],
+    ) -> None:
+        """
+        Lease ``entry`` for ``task_id`` and start ``task``, without waiting for
+        it. If the lease cannot be written the task is run as with ``run``.
+        """
+        self._acquire()
+        try:
+            pipe = redis.pipeline()
+            pipe.hset(DETACHED_ENTRIES_KEY, task_id, entry)
+            pipe.zadd(
+                DETACHED_KEY, {task_id: time.time() + settings.TASK_ASYNC_LEASE_SECONDS}
+            )
+            pipe.execute()
+        except RedisError as e:
+            self._slots.release()
+            logger.warning(
+                f"Failed to lease task {task_id}, running it attached: {str(e)}"
+            )
+            self.run(task)
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._run(task, task_id), self.start())
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _acquire(self) -> None:
+        metrics.COROUTINES_WAITING.inc()
+        try:
+            self._slots.acquire()
+        finally:
+            metrics.COROUTINES_WAITING.dec()
+
+    async def _run(
+        self, task: Callable[[AsyncRedis], Awaitable[T]], task_id: Optional[str] = None
+    ) -> T:
+        if self._redis is None:
+            self._redis = AsyncRedis(connection_pool=create_async_redis_pool())
+            self._renewer = asyncio.ensure_future(self._renew_leases(self._redis))
+        redis = self._redis
+        current = asyncio.current_task()
+        assert current is not None
+        self._running[current] = task_id
+        metrics.COROUTINES_RUNNING.inc()
+        try:
+            result = await task(redis)
+        finally:
+            metrics.COROUTINES_RUNNING.dec()
+            del self._running[current]
+            self._slots.release()
+        # A detached task that is cancelled or fails keeps its lease, so it is
+        # republished unless its record shows that it finished.
+        if task_id is not None:
+            try:
+                pipe = redis.pipeline(transaction=False)
+                pipe.zrem(DETACHED_KEY, task_id)
+                pipe.hdel(DETACHED_ENTRIES_KEY, task_id)
+                await pipe.execute()
+            except RedisError as e:
+                logger.error(f"Failed to release the lease of task {task_id}: {str(e)}")
+        return result
+
+    async def _renew_leases(self, redis: AsyncRedis) -> None:
+        while True:
+            await asyncio.sleep(settings.TASK_ASYNC_LEASE_SECONDS / 3)
+            detached = [
+                task_id for task_id in self._running.values() if task_id is not None
+            ]
+            if not detached:
+                continue
+            deadline = time.time() + settings.TASK_ASYNC_LEASE_SECONDS
+            try:
+                await redis.zadd(
+                    DETACHED_KEY, dict.fromkeys(detached, deadline), xx=True
+                )
+            except RedisError as e:
+                logger.warning(f"Failed to renew task leases: {str(e)}")
+
+    async def _shutdown(self, timeout: float) -> None:
+        # Tasks still running after ``timeout`` are cancelled, and the detached
+        # ones are made due for redelivery right away.
+        if self._running:
+            await asyncio.wait(set(self._running), timeout=timeout)
+        unfinished = dict(self._running)
+        for running in unfinished:
+            running.cancel()
+        if self._renewer is not None:
+            self._renewer.cancel()
+        await asyncio.gather(
+            *unfinished,
+            *([self._renewer] if self._renewer else []),
+            return_exceptions=True,
+        )
+        detached = [task_id for task_id in unfinished.values() if task_id is not None]
+        if self._redis is not None:
+            if detached:
+                logger.warning(
+                    f"Stopped {len(detached)} tasks, which will be redelivered"
+                )
+                try:
+                    await self._redis.zadd(
+                        DETACHED_KEY, dict.fromkeys(detached, 0), xx=True
+                    )
+                except RedisError as e:
+                    logger.error(
+                        f"Failed to release the leases of stopped tasks: {str(e)}"
+                    )
+            await self._redis.aclose()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Wait up to ``timeout`` seconds for the tasks in flight, then stop."""
+        if timeout is None:
+            timeout = settings.TASK_ASYNC_SHUTDOWN_TIMEOUT
+        with self._lock:
+            loop, self._loop = self._loop, None
+            if loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._shutdown(timeout), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            if self._thread is not None:
+                self._thread.join(timeout=5)
+            loop.close()
+            self._thread = self._redis = self._renewer = None
+
+
+_executor: Optional[AsyncExecutor] = None
+
+
+def use_async_executor(concurrency: Optional[int] = None) -> AsyncExecutor:
+    """Run the coroutine bodies of this process on a shared event loop."""
+    global _executor
+    if _executor is None:
+        _executor = AsyncExecutor(concurrency or settings.TASK_ASYNC_CONCURRENCY)
+    return _executor
+
+
+def async_executor() -> Optional[AsyncExecutor]:
+    return _executor
+
+
+def stop_async_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.stop()
+        _executor = None
@@ -0,0 +1,199 @@
+"""
+Large task payloads.
+
+Parameters whose encoded JSON is larger than ``TASK_PAYLOAD_INLINE_MAX_BYTES``
+are stored once, under ``task_payload:{sha256}``, as a Redis list of chunks of
+at most ``TASK_PAYLOAD_CHUNK_BYTES`` characters. Only a small reference,
+``{"$payload": key, "size": ..., "chunks": ...}``, is passed through the task
+record, the ``execute_task`` message, the result and the callback queue.
+Identical payloads share one key, whose TTL every new reference extends, so
+it lives at least as long as the longest-lived task referring to it.
+
+The callback body is assembled when it is sent, by splicing the stored JSON in
+place of each reference. With ``CALLBACK_STREAM_PAYLOADS`` it is streamed one
+chunk at a time instead of being built in memory first.
+"""
+import hashlib
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+from app.core import serialization
+from app.core.config import settings
+
+PAYLOAD_KEY_PREFIX = "task_payload:"
+REF_FIELD = "$payload"
+
+# KEYS: payload key
+# ARGV: TTL, chunk1, chunk2, ...
+# Writes the chunks unless an identical payload is already stored, then
+# extends the TTL; a shorter one never replaces a longer one. Returns the
+# number of chunks stored.
+STORE_PAYLOAD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+end
+local ttl = tonumber(ARGV[1])
+if ttl > 0 and redis.call('TTL', KEYS[1]) < ttl then
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+return redis.call('LLEN', KEYS[1])
+"""
+
+BodyPart = Union[bytes, Dict[str, Any]]
+
+
+class PayloadExpired(Exception):
+    """Raised when a payload expires while its body is being streamed."""
+
+
+def is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and REF_FIELD in value
+
+
+def offload(value: Any) -> Tuple[Any, Optional[Tuple[str, List[str]]]]:
+    """
+    Return ``value`` itself, or a reference to it if it is too large to pass
+    inline, together with the key and chunks to store for that reference.
+    """
+    limit = settings.TASK_PAYLOAD_INLINE_MAX_BYTES
+    if limit <= 0:
+        return value, None
+    encoded = serialization.dumps_bytes(value)
+    if len(encoded) <= limit:
+        return value, None
+    return _reference(encoded)
+
+
+def reference(value: Any) -> Tuple[Dict[str, Any], Tuple[str, List[str]]]:
+    """Like ``offload``, but for a value passed by reference whatever its size."""
+    return _reference(serialization.dumps_bytes(value))
+
+
+def _reference(encoded: bytes) -> Tuple[Dict[str, Any], Tuple[str, List[str]]]:
+    key = f"{PAYLOAD_KEY_PREFIX}{hashlib.sha256(encoded).hexdigest()}"
+    # Chunks are cut from the decoded text so none splits a UTF-8 sequence.
+    text = encoded.decode()
+    size = max(1, settings.TASK_PAYLOAD_CHUNK_BYTES)
+    chunks = [text[start : start + size] for start in range(0, len(text), size)]
+    ref = {REF_FIELD: key, "size": len(encoded), "chunks": len(chunks)}
+    return ref, (key, chunks)
+
+
+def store_payload_call(
+    key: str, chunks: List[str], ttl: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Arguments of ``STORE_PAYLOAD_SCRIPT`` for a payload returned by ``offload``,
+    kept for ``ttl`` seconds (``TASK_ACTIVE_TTL_SECONDS`` by default).
+    """
+    if ttl is None:
+        ttl = settings.TASK_ACTIVE_TTL_SECONDS
+    return {"keys": [key], "args": [ttl, *chunks]}
+
+
+def load(redis: Redis, value: Any) -> Any:
+    """Resolve a reference to the value it stands for; other values pass through."""
+    if not is_ref(value):
+        return value
+    chunks = cast(List[str], redis.lrange(value[REF_FIELD], 0, -1))
+    return serialization.loads("".join(chunks)) if chunks else None
+
+
+async def load_async(redis: AsyncRedis, value: Any) -> Any:
+    """``load`` for asyncio clients."""
+    if not is_ref(value):
+        return value
+    chunks = cast(List[str], await redis.lrange(value[REF_FIELD], 0, -1))
+    return serialization.loads("".join(chunks)) if chunks else None
+
+
+def find_refs(value: Any) -> List[Dict[str, Any]]:
+    if is_ref(value):
+        return [value]
+    children: Iterable[Any]
+    if isinstance(value, dict):
+        children = value.values()
+    elif isinstance(value, list):
+        children = value
+    else:
+        return []
+    return [ref for child in children for ref in find_refs(child)]
+
+
+def body_parts(value: Any) -> List[BodyPart]:
+    """Encode ``value`` as JSON, keeping each reference as a separate part."""
+    parts: List[BodyPart] = [serialization.dumps_bytes(value)]
+    refs = {ref[REF_FIELD]: ref for ref in find_refs(value)}
+    for ref in refs.values():
+        marker = serialization.dumps_bytes(ref)
+        split: List[BodyPart] = []
+        for part in parts:
+            if not isinstance(part, bytes):
+                split.append(part)
+                continue
+            pieces = part.split(marker)
+            for piece in pieces[:-1]:
+                split.extend((piece, ref))
+            split.append(pieces[-1])
+        parts = split
+    return [part for part in parts if part != b""]
+
+
+def iter_body(redis: Redis, value: Any, stream: bool = False) -> Iterator[bytes]:
+    """
+    Yield the JSON body of ``value`` with every reference replaced by its
+    payload, reading one chunk per round trip when ``stream`` is set. Expired
+    payloads are sent as ``null``; one that expires after part of it has been
+    streamed raises ``PayloadExpired`` rather than leave the JSON truncated.
+    """
+    for part in body_parts(value):
+        if isinstance(part, bytes):
+            yield part
+        elif stream:
+            key = part[REF_FIELD]
+            if redis.llen(key) != part["chunks"]:
+                yield b"null"
+                continue
+            for index in range(part["chunks"]):
+                chunk = cast(Optional[str], redis.lindex(key, index))
+                if chunk is None:
+                    raise PayloadExpired(key)
+                yield chunk.encode()
+        else:
+            chunks = cast(List[str], redis.lrange(part[REF_FIELD], 0, -1))
+            yield "".join(chunks).encode() or b"null"
+
+
+async def aiter_body(
+    redis: AsyncRedis, value: Any, stream: bool = False
+) -> AsyncIterator[bytes]:
+    """``iter_body`` for asyncio clients."""
+    for part in body_parts(value):
+        if isinstance(part, bytes):
+            yield part
+        elif stream:
+            key = part[REF_FIELD]
+            if await redis.llen(key) != part["chunks"]:
+                yield b"null"
+                continue
+            for index in range(part["chunks"]):
+                chunk = cast(Optional[str], await redis.lindex(key, index))
+                if chunk is None:
+                    raise PayloadExpired(key)
+                yield chunk.encode()
+        else:
+            chunks = cast(List[str], await redis.lrange(part[REF_FIELD], 0, -1))
+            yield "".join(chunks).encode() or b"null"
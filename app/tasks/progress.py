@@ -0,0 +1,188 @@
+import logging
+import time
+from typing import Optional, Tuple, cast
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+from app.core.config import settings
+from app.models.task import TaskStatus
+from app.tasks.status_store import (
+    TERMINAL_STATUSES,
+    task_key,
+    update_status,
+    update_status_async,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _ProgressState:
+    """Rate limiting and cancellation tracking shared by both reporters."""
+
+    def __init__(
+        self, task_id: str, max_updates_per_second: Optional[float] = None
+    ) -> None:
+        if max_updates_per_second is None:
+            max_updates_per_second = settings.TASK_PROGRESS_MAX_UPDATES_PER_SECOND
+        self._task_id = task_id
+        self._min_interval = (
+            1.0 / max_updates_per_second if max_updates_per_second > 0 else 0.0
+        )
+        self._check_interval = settings.TASK_PROGRESS_CANCEL_CHECK_INTERVAL
+        self._last_write = float("-inf")
+        self._last_check = float("-inf")
+        self._pending: Optional[Tuple[float, str]] = None
+        self._interrupted: Optional[TaskStatus] = None
+        self._missing = False
+
+    @property
+    def interrupted(self) -> Optional[TaskStatus]:
+        """The final status the task was given by someone else, e.g. CANCELLED."""
+        return self._interrupted
+
+    @property
+    def missing(self) -> bool:
+        """Whether a write found no task record, e.g. of an abandoned submission."""
+        return self._missing
+
+    def pending_delay(self) -> Optional[float]:
+        """Seconds until a coalesced update can be written, or None if there is none."""
+        if self._pending is None:
+            return None
+        return max(0.0, self._last_write + self._min_interval - time.monotonic())
+
+    def _coalesce(self, progress: float, message: str) -> bool:
+        """Keep an update for later if it comes too soon after the previous write."""
+        if time.monotonic() - self._last_write < self._min_interval:
+            self._pending = (progress, message)
+            return True
+        return False
+
+    def _due_check(self) -> bool:
+        """Whether a coalesced update should read the status: none was read lately."""
+        now = time.monotonic()
+        if now - max(self._last_write, self._last_check) < self._check_interval:
+            return False
+        self._last_check = now
+        return True
+
+    def _begin_write(self) -> None:
+        self._pending = None
+        self._last_write = time.monotonic()
+
+    def _end_write(self, status: TaskStatus, stored: Optional[str]) -> Optional[str]:
+        if stored is None:
+            # Nothing is left to report to, so the task stops as if cancelled.
+            self._missing = True
+            self._interrupted = TaskStatus.CANCELLED
+        elif stored != status and stored in TERMINAL_STATUSES:
+            self._interrupted = TaskStatus(stored)
+        return stored
+
+
+class ProgressReporter(_ProgressState):
+    """
+    Reports task progress straight to the status store from inside a task body.
+
+    Updates are written with the atomic status script instead of being sent
+    through the broker. With ``max_updates_per_second`` set, updates arriving
+    faster than that are coalesced: only the latest one is kept, and it is written
+    by the next update or ``flush`` after the interval has passed (``TaskRun.sleep``
+    flushes it as soon as it is due). ``finish`` always writes immediately. A
+    coalesced update reads just the status instead, at most once per
+    ``TASK_PROGRESS_CANCEL_CHECK_INTERVAL``, so cancellation is still noticed.
+
+    A write is refused once the task has been cancelled, which ``interrupted``
+    reports so that the task body can stop at its next step. A write that finds
+    no record at all, because it expired or its submission was abandoned,
+    interrupts the task the same way.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        task_id: str,
+        max_updates_per_second: Optional[float] = None,
+    ) -> None:
+        super().__init__(task_id, max_updates_per_second)
+        self._redis = redis
+
+    def start(self, message: str = "Task started") -> Optional[str]:
+        return self._write(TaskStatus.RUNNING, 0.0, message)
+
+    def update(self, progress: float, message: str) -> Optional[str]:
+        if self._coalesce(progress, message):
+            if self._due_check():
+                stored = cast(
+                    Optional[str], self._redis.hget(task_key(self._task_id), "status")
+                )
+                self._end_write(TaskStatus.RUNNING, stored)
+            return None
+        return self._write(TaskStatus.RUNNING, progress, message)
+
+    def flush(self) -> Optional[str]:
+        """Write the coalesced update, if there is one and its interval has passed."""
+        if self._pending is None or self.pending_delay():
+            return None
+        progress, message = self._pending
+        return self._write(TaskStatus.RUNNING, progress, message)
+
+    def finish(
+        self, status: TaskStatus, progress: float, message: str
+    ) -> Optional[str]:
+        return self._write(status, progress, message)
+
+    def _write(
+        self, status: TaskStatus, progress: float, message: str
+    ) -> Optional[str]:
+        self._begin_write()
+        stored = update_status(self._redis, self._task_id, status, progress, message)
+        return self._end_write(status, stored)
+
+
+class AsyncProgressReporter(_ProgressState):
+    """``ProgressReporter`` for task coroutines, writing with the asyncio client."""
+
+    def __init__(
+        self,
+        redis: AsyncRedis,
+        task_id: str,
+        max_updates_per_second: Optional[float] = None,
+    ) -> None:
+        super().__init__(task_id, max_updates_per_second)
+        self._redis = redis
+
+    async def start(self, message: str = "Task started") -> Optional[str]:
+        return await self._write(TaskStatus.RUNNING, 0.0, message)
+
+    async def update(self, progress: float, message: str) -> Optional[str]:
+        if self._coalesce(progress, message):
+            if self._due_check():
+                stored = cast(
+                    Optional[str],
+                    await self._redis.hget(task_key(self._task_id), "status"),
+                )
+                self._end_write(TaskStatus.RUNNING, stored)
+            return None
+        return await self._write(TaskStatus.RUNNING, progress, message)
+
+    async def flush(self) -> Optional[str]:
+        if self._pending is None or self.pending_delay():
+            return None
+        progress, message = self._pending
+        return await self._write(TaskStatus.RUNNING, progress, message)
+
+    async def finish(
+        self, status: TaskStatus, progress: float, message: str
+    ) -> Optional[str]:
+        return await self._write(status, progress, message)
+
+    async def _write(
+        self, status: TaskStatus, progress: float, message: str
+    ) -> Optional[str]:
+        self._begin_write()
+        stored = await update_status_async(
+            self._redis, self._task_id, status, progress, message
+        )
+        return self._end_write(status, stored)
@@ -0,0 +1,127 @@
+"""
+Celery queues and the worker pools consuming them.
+
+Submitted tasks run on the queue of their class (``short``, ``default`` or
+``long``), so short jobs never wait behind a backlog of long ones. Internal
+tasks are routed by name to queues of their own, consumed by the pool whose
+latency they need. Each pool is a separate worker with its own concurrency
+and prefetch from ``TASK_QUEUE_CONCURRENCY`` and ``TASK_QUEUE_PREFETCH``:
+
+    python -m app.tasks.queues short|default|long [extra celery worker options]
+
+Pools whose ``TASK_QUEUE_EXECUTOR`` is ``asyncio`` run Celery's thread pool and
+share one event loop per process between the tasks with coroutine bodies (see
+``app.tasks.execution``). They get ``TASK_ASYNC_CONCURRENCY`` threads for those
+on top of ``TASK_QUEUE_CONCURRENCY`` for everything else.
+"""
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.models.task import TaskQueue
+
+STATUS_QUEUE = "status"
+CALLBACK_QUEUE = "callbacks"
+DISPATCH_QUEUE = "dispatch"
+MAINTENANCE_QUEUE = "maintenance"
+
+TASK_ROUTES = {
+    "execute_task": {"queue": TaskQueue.DEFAULT.value},
+    "update_task_status": {"queue": STATUS_QUEUE},
+    "dispatch_tasks": {"queue": DISPATCH_QUEUE},
+    "send_callback": {"queue": CALLBACK_QUEUE},
+    "report_task_store_usage": {"queue": MAINTENANCE_QUEUE},
+    "prune_task_indexes": {"queue": MAINTENANCE_QUEUE},
+}
+
+# The first queue of each pool is the one it is named and configured after.
+WORKER_POOLS: Dict[str, Tuple[str, ...]] = {
+    TaskQueue.SHORT.value: (TaskQueue.SHORT.value, STATUS_QUEUE, DISPATCH_QUEUE),
+    TaskQueue.DEFAULT.value: (
+        TaskQueue.DEFAULT.value,
+        CALLBACK_QUEUE,
+        MAINTENANCE_QUEUE,
+    ),
+    TaskQueue.LONG.value: (TaskQueue.LONG.value,),
+}
+
+MAX_PRIORITY = 9
+
+
+def transport_priority(priority: int, broker_url: str) -> int:
+    """
+    Map an API priority (higher runs first) to the broker's scale. The Redis
+    transport consumes priority 0 first, AMQP brokers priority 9.
+    """
+    if broker_url.startswith("redis"):
+        return MAX_PRIORITY - priority
+    return priority
+
+
+def execution_options(
+    queue: Optional[TaskQueue], priority: Optional[int], broker_url: str
+) -> Dict[str, Any]:
+    """``apply_async`` options placing an ``execute_task`` message."""
+    queue = TaskQueue(queue or settings.TASK_DEFAULT_QUEUE_CLASS)
+    options: Dict[str, Any] = {"queue": queue.value}
+    if priority is not None:
+        options["priority"] = transport_priority(priority, broker_url)
+    return options
+
+
+def queue_depths(app: Any) -> Dict[str, int]:
+    """
+    Messages waiting in every queue consumed by the worker pools, read over a
+    connection from the app's broker pool rather than a new one per call.
+    """
+    depths = {}
+    with app.pool.acquire(block=True) as connection:
+        channel = connection.channel()
+        for queues in WORKER_POOLS.values():
+            for queue in queues:
+                try:
+                    depths[queue] = channel.queue_declare(
+                        queue=queue, passive=True
+                    ).message_count
+                except connection.channel_errors:
+                    # Not declared yet; AMQP closes the channel on this error.
+                    depths[queue] = 0
+                    channel = connection.channel()
+        channel.close()
+    return depths
+
+
+def uses_event_loop(pool: str) -> bool:
+    return settings.TASK_QUEUE_EXECUTOR.get(pool, "prefork") == "asyncio"
+
+
+def worker_argv(pool: str) -> List[str]:
+    options = []
+    if uses_event_loop(pool):
+        options = ["--pool", "threads"]
+    return [
+        "worker",
+        "--queues",
+        ",".join(WORKER_POOLS[pool]),
+        "--concurrency",
+        str(settings.TASK_QUEUE_CONCURRENCY[pool]),
+        "--prefetch-multiplier",
+        str(settings.TASK_QUEUE_PREFETCH[pool]),
+        "--hostname",
+        f"{pool}@%h",
+        *options,
+    ]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in WORKER_POOLS:
+        sys.exit(
+            f"usage: python -m app.tasks.queues {'|'.join(WORKER_POOLS)} [options]"
+        )
+
+    from app.tasks.celery_tasks import celery
+    from app.tasks.execution import use_async_executor
+
+    if uses_event_loop(sys.argv[1]):
+        use_async_executor(settings.TASK_ASYNC_CONCURRENCY)
+    celery.worker_main(worker_argv(sys.argv[1]) + sys.argv[2:])
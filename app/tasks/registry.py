@@ -0,0 +1,110 @@
+"""
+Registered task types.
+
+A task type ties a task ``name`` to its body (see ``app.tasks.execution``)
+and, optionally, to a type for its parameters, usually a pydantic model.
+Types are declared where their body is defined:
+
+    @task_body("resize_images", parameters=ResizeParameters)
+    async def resize_images(run): ...
+
+The module declaring them is listed for each of its names in
+``TASK_TYPE_MODULES`` and is imported the first time one of those names is
+looked up. The API and the workers therefore import no task code at startup,
+however many types there are. The validator for a type's parameters is built
+once, when the type is declared.
+
+The API validates parameters when a task is submitted and stores them in
+their validated JSON form, so invalid tasks are refused before anything is
+queued. Names without a type run the simulated workload with unchecked
+parameters, or are refused with ``TASK_REJECT_UNREGISTERED``.
+"""
+import importlib
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from pydantic import ValidationError, create_model
+from pydantic_core import InitErrorDetails, PydanticCustomError
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+TaskBody = Callable[[Any], Any]
+
+
+class TaskType:
+    def __init__(
+        self, name: str, body: TaskBody, parameters: Optional[Any] = None
+    ) -> None:
+        self.name = name
+        self.body = body
+        # Wrapped in a field of their own so errors are located under "parameters".
+        self._model = (
+            create_model(f"TaskParameters[{name}]", parameters=(parameters, ...))
+            if parameters is not None
+            else None
+        )
+
+    def validate(self, parameters: Any) -> Any:
+        if self._model is None:
+            return parameters
+        return self._model.model_validate({"parameters": parameters}).model_dump(
+            mode="json"
+        )["parameters"]
+
+
+_types: Dict[str, TaskType] = {}
+
+
+def task_body(
+    name: str, parameters: Optional[Any] = None
+) -> Callable[[TaskBody], TaskBody]:
+    """Register the decorated function or coroutine function as task ``name``."""
+
+    def register(body: TaskBody) -> TaskBody:
+        _types[name] = TaskType(name, body, parameters)
+        return body
+
+    return register
+
+
+def lookup(name: str) -> Optional[TaskType]:
+    task_type = _types.get(name)
+    if task_type is not None:
+        return task_type
+    module = settings.TASK_TYPE_MODULES.get(name)
+    if module is None:
+        return None
+    importlib.import_module(module)
+    task_type = _types.get(name)
+    if task_type is None:
+        logger.warning(f"Module {module} does not declare task type {name}")
+    return task_type
+
+
+def validate(name: str, parameters: Any) -> Any:
+    """
+    The parameters of a submitted task in their validated JSON form. Raises
+    pydantic's ValidationError, located like ``TaskCreate``'s own errors, for
+    invalid parameters and refused names.
+    """
+    task_type = lookup(name)
+    if task_type is not None:
+        return task_type.validate(parameters)
+    if settings.TASK_REJECT_UNREGISTERED:
+        raise ValidationError.from_exception_data(
+            "TaskCreate",
+            [
+                InitErrorDetails(
+                    type=PydanticCustomError(
+                        "unknown_task",
+                        "No task type is registered as {name}",
+                        {"name": name},
+                    ),
+                    loc=("name",),
+                    input=name,
+                )
+            ],
+        )
+    return parameters
@@ -0,0 +1,431 @@
+"""
+Delayed and recurring tasks.
+
+A task submitted with ``run_at`` or a ``recurrence`` gets its PENDING record
+right away, but its ``execute_task`` call is parked in
+``tasks:scheduled:entries`` and its due time in the ``tasks:scheduled`` sorted
+set. ``python -m app.tasks.scheduler`` claims due entries, up to
+``TASK_SCHEDULER_BATCH_SIZE`` per round trip, and publishes them. Due entries
+are found by a range query on the set, O(log n) plus the entries returned, so
+a tick costs the same however many tasks are scheduled further out.
+
+Claimed entries are leased rather than removed: their due time moves
+``TASK_SCHEDULER_LEASE_SECONDS`` ahead until they have been published. Any
+number of schedulers can therefore run side by side, and the entries claimed
+by one that dies are picked up by another once their lease ends, so a run is
+published at least once. Runs that are no longer PENDING, such as cancelled
+ones, are skipped.
+
+A recurring task keeps one entry, named after the task ID of its first run.
+When a run is published the record of the next one is created and the entry
+moves to its due time, counted from the previous one so that runs do not
+drift. Runs missed while no scheduler was running are skipped, not caught up.
+``DELETE /api/schedules/{id}`` ends a recurrence.
+
+Runs are spread over ``jitter`` seconds after their scheduled time
+(``TASK_SCHEDULE_JITTER_SECONDS`` by default). The offset is derived from the
+entry name, so a cohort of tasks scheduled for the same time is spread evenly
+over the window, and a recurring task keeps the same offset for every run.
+
+The scheduler also redelivers the tasks of asyncio worker pools, whose
+messages are acknowledged while the task runs (see ``app.tasks.execution``).
+Leases in ``tasks:detached`` that ran out are claimed the same way, and their
+calls republished unless the task's record shows it has finished.
+"""
+import hashlib
+import logging
+import math
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from redis import Redis
+from redis.exceptions import RedisError
+
+from app.core import metrics, serialization
+from app.core.config import settings
+from app.models.task import TaskRecurrence, TaskStatus
+from app.tasks.celery_tasks import execute_task
+from app.tasks.connections import get_redis_connection
+from app.tasks.execution import DETACHED_ENTRIES_KEY, DETACHED_KEY
+from app.tasks.payloads import REF_FIELD, find_refs
+from app.tasks.status_store import (
+    IN_FLIGHT_KEY,
+    created_score,
+    name_index_key,
+    new_task_record,
+    status_index_key,
+    task_key,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEDULED_KEY = "tasks:scheduled"
+SCHEDULE_ENTRIES_KEY = "tasks:scheduled:entries"
+
+# Admission outcome of submissions with a run_at or recurrence.
+SCHEDULE = "schedule"
+
+# KEYS: scheduled set, entries
+# ARGV: now, lease deadline, max entries
+# Leases due entries; returns their names and entries, interleaved. Names
+# without an entry, left behind by a cancelled schedule, are dropped.
+CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+if #due == 0 then
+    return {}
+end
+local entries = redis.call('HMGET', KEYS[2], unpack(due))
+local claimed = {}
+for i, name in ipairs(due) do
+    if entries[i] then
+        redis.call('ZADD', KEYS[1], ARGV[2], name)
+        table.insert(claimed, name)
+        table.insert(claimed, entries[i])
+    else
+        redis.call('ZREM', KEYS[1], name)
+    end
+end
+return claimed
+"""
+
+# KEYS: leased set, entries
+# ARGV: name1, claimed entry1, name2, claimed entry2, ...
+# Drops claimed entries, unless they were leased again meanwhile.
+RELEASE_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[2], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[2], ARGV[i])
+        redis.call('ZREM', KEYS[1], ARGV[i])
+    end
+end
+return 0
+"""
+
+# KEYS: scheduled set, entries, next run's record, in-flight counter,
+#       status index, name index, payload1, payload2, ...
+# ARGV: name, claimed entry, next entry, next due time, record TTL, index score,
+#       next run's task ID, field1, value1, ...
+# Moves a recurring entry to its next run and creates that run's record, unless
+# the schedule was cancelled or moved on by another scheduler meanwhile. The
+# payloads the run's parameters refer to are kept at least as long as its record.
+RESCHEDULE_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('HSET', KEYS[3], unpack(ARGV, 8))
+local ttl = tonumber(ARGV[5])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[3], ttl)
+    for i = 7, #KEYS do
+        if redis.call('TTL', KEYS[i]) < ttl then
+            redis.call('EXPIRE', KEYS[i], ttl)
+        end
+    end
+end
+redis.call('INCR', KEYS[4])
+redis.call('ZADD', KEYS[5], ARGV[6], ARGV[7])
+redis.call('ZADD', KEYS[6], ARGV[6], ARGV[7])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+return 1
+"""
+
+
+def timestamp(value: datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def jitter_offset(name: str, jitter: float) -> float:
+    """A stable offset in ``[0, jitter)``, uniformly distributed over entry names."""
+    if jitter <= 0:
+        return 0.0
+    digest = hashlib.sha256(name.encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 * jitter
+
+
+def scheduled_fields(
+    task_id: str, due: float, schedule_id: Optional[str] = None
+) -> Dict[str, str]:
+    """Record fields of a run due at ``due``, jitter included."""
+    run_at = datetime.utcfromtimestamp(due).isoformat()
+    fields = {"run_at": run_at, "message": f"Scheduled for {run_at}"}
+    if schedule_id is not None:
+        fields["schedule_id"] = schedule_id
+    return fields
+
+
+def scheduled_ttl(due: float) -> int:
+    """TTL of a scheduled run's record: it may not expire before it has run."""
+    if settings.TASK_ACTIVE_TTL_SECONDS <= 0:
+        return 0
+    return settings.TASK_ACTIVE_TTL_SECONDS + max(0, math.ceil(due - time.time()))
+
+
+def schedule_entry(
+    call: List[Any],
+    options: Dict[str, Any],
+    priority: Optional[int],
+    run_at: float,
+    timeout: Optional[float],
+    recurrence: Optional[TaskRecurrence],
+    jitter: Optional[float],
+) -> Tuple[str, float, str]:
+    """
+    The name, due time and entry scheduling an ``execute_task`` call and, with
+    ``recurrence``, the runs after it.
+    """
+    name = call[0]
+    if jitter is None:
+        jitter = settings.TASK_SCHEDULE_JITTER_SECONDS
+    entry: Dict[str, Any] = {
+        "call": call,
+        "options": options,
+        "priority": priority,
+        "timeout": timeout,
+        "due": run_at,
+        "jitter": jitter,
+    }
+    if recurrence is not None:
+        entry.update(
+            every=recurrence.every,
+            remaining=recurrence.count - 1 if recurrence.count is not None else None,
+            until=timestamp(recurrence.until) if recurrence.until is not None else None,
+        )
+    return name, run_at + jitter_offset(name, jitter), serialization.dumps(entry)
+
+
+def next_due(entry: Dict[str, Any], now: float) -> Optional[float]:
+    """When the run after ``entry``'s is due, before jitter; None after the last."""
+    every = entry.get("every")
+    if not every or entry.get("remaining") == 0:
+        return None
+    due: float = entry["due"] + every
+    if due < now:
+        due += math.ceil((now - due) / every) * every
+    if entry.get("until") is not None and due > entry["until"]:
+        return None
+    return due
+
+
+class Scheduler:
+    """Publishes due runs, in batches, until stopped."""
+
+    def __init__(self, redis: Redis, batch_size: Optional[int] = None) -> None:
+        self._redis = redis
+        self._batch_size = batch_size or settings.TASK_SCHEDULER_BATCH_SIZE
+        self._claim = redis.register_script(CLAIM_SCRIPT)
+        self._reschedule = redis.register_script(RESCHEDULE_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+
+    def run(self) -> None:
+        while True:
+            try:
+                claimed = max(self.tick(), self.redeliver())
+            except RedisError as e:
+                logger.error(f"Failed to claim scheduled tasks: {str(e)}")
+                claimed = 0
+            # A full batch means more runs are due right now.
+            if claimed < self._batch_size:
+                time.sleep(settings.TASK_SCHEDULER_INTERVAL)
+
+    def tick(self) -> int:
+        """Claim the due runs and publish them; returns how many were claimed."""
+        now = time.time()
+        claimed = self._claim(
+            keys=[SCHEDULED_KEY, SCHEDULE_ENTRIES_KEY],
+            args=[now, now + settings.TASK_SCHEDULER_LEASE_SECONDS, self._batch_size],
+        )
+        if not claimed:
+            return 0
+        names, raw_entries = claimed[0::2], claimed[1::2]
+        entries = [serialization.loads(raw) for raw in raw_entries]
+
+        pipe = self._redis.pipeline(transaction=False)
+        for entry in entries:
+            pipe.hget(task_key(entry["call"][0]), "status")
+        statuses = pipe.execute()
+        due = [
+            index
+            for index, status in enumerate(statuses)
+            if status == TaskStatus.PENDING
+        ]
+        skipped = len(entries) - len(due)
+        if skipped:
+            logger.info(f"Skipped {skipped} scheduled runs that are no longer pending")
+            metrics.SCHEDULED_RUNS_SKIPPED.inc(skipped)
+        failed = self._publish([entries[index] for index in due], now)
+        metrics.SCHEDULED_RUNS_FAILED.inc(len(failed))
+        # Entries that could not be published keep their lease and are retried after it.
+        published = [
+            index for position, index in enumerate(due) if position not in failed
+        ]
+        metrics.SCHEDULED_RUNS_PUBLISHED.inc(len(published))
+        if published:
+            logger.info(f"Published {len(published)} scheduled tasks")
+
+        done = set(published) | {
+            index
+            for index, status in enumerate(statuses)
+            if status != TaskStatus.PENDING
+        }
+        pipe = self._redis.pipeline(transaction=False)
+        finished = []
+        for index in sorted(done):
+            following = next_due(entries[index], now)
+            if following is None:
+                finished.append(names[index])
+            else:
+                self._queue_next_run(
+                    pipe, names[index], raw_entries[index], entries[index], following
+                )
+        if finished:
+            pipe.zrem(SCHEDULED_KEY, *finished)
+            pipe.hdel(SCHEDULE_ENTRIES_KEY, *finished)
+        pipe.execute()
+        return len(names)
+
+    def redeliver(self) -> int:
+        """
+        Republish the tasks whose asyncio worker stopped before they ended;
+        returns how many leases were claimed.
+        """
+        now = time.time()
+        claimed = self._claim(
+            keys=[DETACHED_KEY, DETACHED_ENTRIES_KEY],
+            args=[now, now + settings.TASK_SCHEDULER_LEASE_SECONDS, self._batch_size],
+        )
+        if not claimed:
+            return 0
+        names, raw_entries = claimed[0::2], claimed[1::2]
+        entries = [serialization.loads(raw) for raw in raw_entries]
+
+        pipe = self._redis.pipeline(transaction=False)
+        for name in names:
+            pipe.hget(task_key(name), "status")
+        statuses = pipe.execute()
+        orphaned = [
+            index
+            for index, status in enumerate(statuses)
+            if status in (TaskStatus.PENDING, TaskStatus.RUNNING)
+        ]
+        failed = self._publish([entries[index] for index in orphaned], now)
+        published = [
+            index for position, index in enumerate(orphaned) if position not in failed
+        ]
+        metrics.TASKS_REDELIVERED.inc(len(published))
+        if published:
+            logger.warning(f"Redelivered {len(published)} tasks of stopped workers")
+        # Entries that could not be published keep their lease and are retried after it.
+        done = set(range(len(names))) - {orphaned[position] for position in failed}
+        if done:
+            self._release(
+                keys=[DETACHED_KEY, DETACHED_ENTRIES_KEY],
+                args=[
+                    item
+                    for index in sorted(done)
+                    for item in (names[index], raw_entries[index])
+                ],
+            )
+        return len(names)
+
+    def _publish(self, entries: List[Dict[str, Any]], now: float) -> Set[int]:
+        """Publish runs; returns the positions of those that could not be."""
+        if not entries:
+            return set()
+        failed: Set[int] = set()
+        try:
+            with execute_task.app.producer_or_acquire() as producer:
+                for position, entry in enumerate(entries):
+                    call = entry["call"]
+                    if entry.get("timeout"):
+                        deadline = now + entry["timeout"]
+                        call[4] = min(call[4], deadline) if call[4] else deadline
+                    try:
+                        execute_task.apply_async(
+                            call, task_id=call[0], producer=producer, **entry["options"]
+                        )
+                    except Exception as e:
+                        logger.error(
+                            f"Failed to publish scheduled task {call[0]}: {str(e)}"
+                        )
+                        failed.add(position)
+                        continue
+                    # Redelivered calls have no scheduled time.
+                    if "due" in entry:
+                        due = entry["due"] + jitter_offset(call[0], entry["jitter"])
+                        metrics.SCHEDULE_LAG_SECONDS.observe(
+                            max(0.0, time.time() - due)
+                        )
+        except Exception as e:
+            logger.error(f"Failed to publish scheduled tasks: {str(e)}")
+            failed.update(range(len(entries)))
+        return failed
+
+    def _queue_next_run(
+        self,
+        pipe: Any,
+        name: str,
+        raw_entry: str,
+        entry: Dict[str, Any],
+        due: float,
+    ) -> None:
+        task_id = str(uuid.uuid4())
+        call = [task_id, *entry["call"][1:4], None]
+        options = entry["options"]
+        remaining = entry.get("remaining")
+        following = serialization.dumps(
+            {
+                **entry,
+                "call": call,
+                "due": due,
+                "remaining": remaining - 1 if remaining is not None else None,
+            }
+        )
+        at = due + jitter_offset(name, entry["jitter"])
+        record = new_task_record(
+            task_id,
+            call[1],
+            call[2],
+            call[3],
+            options["queue"],
+            entry["priority"],
+            None,
+        )
+        record.update(scheduled_fields(task_id, at, name))
+        self._reschedule(
+            keys=[
+                SCHEDULED_KEY,
+                SCHEDULE_ENTRIES_KEY,
+                task_key(task_id),
+                IN_FLIGHT_KEY,
+                status_index_key(TaskStatus.PENDING),
+                name_index_key(call[1]),
+                *{ref[REF_FIELD] for ref in find_refs(call[2])},
+            ],
+            args=[
+                name,
+                raw_entry,
+                following,
+                at,
+                scheduled_ttl(at),
+                created_score(record),
+                task_id,
+                *(item for pair in record.items() for item in pair),
+            ],
+            client=pipe,
+        )
+
+
+def main() -> None:
+    metrics.start_exporter(settings.METRICS_SCHEDULER_PORT)
+    logger.info("Task scheduler started")
+    Scheduler(get_redis_connection()).run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
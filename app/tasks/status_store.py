@@ -0,0 +1,623 @@
+"""
+Redis layout of task records.
+
+Each task is stored as a hash under ``task:{task_id}`` so that status and
+progress updates touch only the fields that change. Status transitions are
+applied by a Lua script which also publishes the change event, making every
+update a single atomic round trip. Records written by older releases as a JSON
+string are converted to a hash the first time they are updated, or in bulk
+with ``python -m app.tasks.status_store migrate``.
+
+Every applied update increments the record's ``seq`` field and carries it in
+the published event, giving each task a monotonic event ID for stream resume.
+The update is also appended to the task's history, a Redis Stream under
+``task_history:{task_id}`` whose entry IDs are ``{seq}-0``. It keeps the last
+``TASK_HISTORY_MAX_EVENTS`` transitions and expires together with the record,
+which stays the source of the current state.
+
+Records expire: unfinished tasks after ``TASK_ACTIVE_TTL_SECONDS`` without an
+update, finished ones ``TASK_TERMINAL_TTL_SECONDS`` after they end. With
+``TASK_COMPACT_ON_FINISH`` the bulky fields are dropped when a task finishes.
+
+``task_store:in_flight`` counts unfinished tasks: it is incremented when a
+record is created and decremented when the task reaches a final state. Records
+that expire unfinished are not subtracted, so the usage report resets it to the
+number of PENDING and RUNNING records it finds.
+
+Tasks are indexed by status and by name in sorted sets under
+``task_index:status:{status}`` and ``task_index:name:{name}``, scored by their
+creation time, for ``GET /api/tasks``. The record creation path adds a task to
+both and the update script moves it between status sets. A finished task is
+also added to ``task_index:expiring``, scored by when its record expires, so
+that ``prune_indexes`` can drop it from the indexes at the same time. Tasks
+whose record expired unfinished are dropped when a listing comes across them.
+
+Submissions with an idempotency key or in content-hash mode claim a
+``task_dedupe:`` key pointing at their task, created together with the record.
+The claim is released when the task fails, is cancelled or times out. Once it
+completes the claim lives until its window ends, or for
+``TASK_RESULT_CACHE_TTL_SECONDS`` when that is set, so identical submissions
+are answered with the finished task.
+"""
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, cast
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.typing import EncodableT, FieldT
+
+from app.core import serialization
+from app.core.config import settings
+from app.models.task import TaskStatus
+
+logger = logging.getLogger(__name__)
+
+TASK_KEY_PREFIX = "task:"
+TASK_CHANNEL_PREFIX = "task_events:"
+USAGE_KEY = "task_store:usage"
+IN_FLIGHT_KEY = "task_store:in_flight"
+DEDUPE_KEY_PREFIX = "task_dedupe:"
+HISTORY_KEY_PREFIX = "task_history:"
+INDEX_KEY_PREFIX = "task_index:"
+EXPIRING_INDEX_KEY = f"{INDEX_KEY_PREFIX}expiring"
+
+STATUS_FIELDS = ("status", "progress", "message", "seq")
+JSON_FIELDS = ("parameters",)
+# Bulky fields only needed until the task has run.
+COMPACT_FIELDS = ("parameters", "callback_url")
+TERMINAL_STATUSES = (
+    TaskStatus.COMPLETED,
+    TaskStatus.FAILED,
+    TaskStatus.CANCELLED,
+    TaskStatus.TIMED_OUT,
+)
+
+# Higher ranks may never be replaced by lower ones, and terminal states are final.
+STATUS_RANKS = {
+    TaskStatus.PENDING: 0,
+    TaskStatus.RUNNING: 1,
+    TaskStatus.COMPLETED: 2,
+    TaskStatus.FAILED: 2,
+    TaskStatus.CANCELLED: 2,
+    TaskStatus.TIMED_OUT: 2,
+}
+
+
+def task_key(task_id: str) -> str:
+    return f"{TASK_KEY_PREFIX}{task_id}"
+
+
+def task_channel(task_id: str) -> str:
+    return f"{TASK_CHANNEL_PREFIX}{task_id}"
+
+
+def history_key(task_id: str) -> str:
+    return f"{HISTORY_KEY_PREFIX}{task_id}"
+
+
+def status_index_key(status: str) -> str:
+    return f"{INDEX_KEY_PREFIX}status:{TaskStatus(status).value}"
+
+
+def name_index_key(name: str) -> str:
+    return f"{INDEX_KEY_PREFIX}name:{name}"
+
+
+def created_score(task_data: Mapping[str, str]) -> float:
+    """The index score of a new record: its creation time as a timestamp."""
+    return (
+        datetime.fromisoformat(task_data["created_at"])
+        .replace(tzinfo=timezone.utc)
+        .timestamp()
+    )
+
+
+def idempotency_dedupe_key(idempotency_key: str) -> str:
+    return f"{DEDUPE_KEY_PREFIX}key:{idempotency_key}"
+
+
+def content_dedupe_key(name: str, parameters: Mapping[str, Any]) -> str:
+    content = json.dumps([name, parameters], sort_keys=True, separators=(",", ":"))
+    return f"{DEDUPE_KEY_PREFIX}hash:{hashlib.sha256(content.encode()).hexdigest()}"
+
+
+def encode_record(task_data: Mapping[str, Any]) -> Dict[str, str]:
+    record = {}
+    for field, value in task_data.items():
+        if value is None:
+            continue
+        if field in JSON_FIELDS:
+            value = serialization.dumps(value)
+        elif isinstance(value, TaskStatus):
+            value = value.value
+        record[field] = str(value)
+    return record
+
+
+def decode_record(record: Mapping[str, str]) -> Dict[str, Any]:
+    task_data: Dict[str, Any] = dict(record)
+    for field in JSON_FIELDS:
+        if field in task_data:
+            task_data[field] = serialization.loads(task_data[field])
+    if "progress" in task_data:
+        task_data["progress"] = float(task_data["progress"])
+    if "seq" in task_data:
+        task_data["seq"] = int(task_data["seq"])
+    return task_data
+
+
+def new_task_record(
+    task_id: str,
+    name: str,
+    parameters: Any,
+    callback_url: str,
+    queue: str,
+    priority: Optional[int],
+    deadline: Optional[float],
+) -> Dict[str, str]:
+    """The fields of a new PENDING task record."""
+    created_at = datetime.utcnow().isoformat()
+    return encode_record(
+        {
+            "task_id": task_id,
+            "name": name,
+            "parameters": parameters,
+            "callback_url": callback_url,
+            "queue": queue,
+            "priority": priority,
+            "deadline": (
+                datetime.utcfromtimestamp(deadline).isoformat() if deadline else None
+            ),
+            "status": TaskStatus.PENDING,
+            "created_at": created_at,
+            "updated_at": created_at,
+            "progress": 0.0,
+            "message": "Task created",
+        }
+    )
+
+
+def decode_event(entry_id: str, fields: Mapping[str, str]) -> Dict[str, Any]:
+    """Turn a history stream entry into a task event."""
+    return {
+        "seq": int(entry_id.split("-", 1)[0]),
+        "status": fields["status"],
+        "progress": float(fields["progress"]),
+        "message": fields.get("message") or None,
+        "at": fields.get("at"),
+    }
+
+
+def _lua_table(values: Mapping[str, Any]) -> str:
+    return "{" + ", ".join(f"[{json.dumps(k)}] = {v}" for k, v in values.items()) + "}"
+
+
+# Converts a legacy JSON string record at KEYS[1] into a hash, keeping its TTL.
+_MIGRATE_LUA = """
+local function migrate(key)
+    local raw = redis.call('GET', key)
+    local ttl = redis.call('PTTL', key)
+    local record = cjson.decode(raw)
+    local fields = {}
+    for field, value in pairs(record) do
+        if value ~= cjson.null then
+            if type(value) == 'table' then
+                value = cjson.encode(value)
+            end
+            table.insert(fields, field)
+            table.insert(fields, tostring(value))
+        end
+    end
+    redis.call('DEL', key)
+    if #fields > 0 then
+        redis.call('HSET', key, unpack(fields))
+    end
+    if ttl > 0 then
+        redis.call('PEXPIRE', key, ttl)
+    end
+end
+"""
+
+MIGRATE_RECORD_SCRIPT = (
+    _MIGRATE_LUA
+    + """
+if redis.call('TYPE', KEYS[1])['ok'] ~= 'string' then
+    return 0
+end
+migrate(KEYS[1])
+return 1
+"""
+)
+
+# KEYS: task record, dedupe key, in-flight counter, status index, name index
+# ARGV: task_id, dedupe window, active TTL, index score, field1, value1, ...
+# Returns the ID of the task already claiming the dedupe key, or task_id after
+# claiming it and creating the record.
+CREATE_TASK_SCRIPT = """
+local existing = redis.call('GET', KEYS[2])
+if existing and redis.call('EXISTS', '%(prefix)s' .. existing) == 1 then
+    return existing
+end
+redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+redis.call('HSET', KEYS[1], 'dedupe_key', KEYS[2], unpack(ARGV, 5))
+redis.call('INCR', KEYS[3])
+redis.call('ZADD', KEYS[4], ARGV[4], ARGV[1])
+redis.call('ZADD', KEYS[5], ARGV[4], ARGV[1])
+if tonumber(ARGV[3]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return ARGV[1]
+""" % {
+    "prefix": TASK_KEY_PREFIX
+}
+
+# KEYS: task record, event channel, history stream, in-flight counter, expiring index
+# ARGV: task_id, status, progress, message, updated_at,
+#       active TTL, terminal TTL, compact on finish (1/0), result cache TTL,
+#       history length (0 keeps no history), now (timestamp)
+# Returns the status the task is in after the call, or false if it does not exist.
+# The status index keys are derived from the statuses.
+UPDATE_STATUS_SCRIPT = (
+    _MIGRATE_LUA
+    + """
+local ranks = %(ranks)s
+local kind = redis.call('TYPE', KEYS[1])['ok']
+if kind == 'none' then
+    return false
+end
+if kind == 'string' then
+    migrate(KEYS[1])
+end
+
+local current_fields = redis.call('HMGET', KEYS[1], 'status', 'name', 'dedupe_key')
+local current = current_fields[1]
+local current_rank = ranks[current] or 0
+local rank = ranks[ARGV[2]]
+if current_rank >= %(terminal_rank)d or rank < current_rank then
+    return current
+end
+
+redis.call('HSET', KEYS[1],
+    'status', ARGV[2], 'progress', ARGV[3], 'message', ARGV[4], 'updated_at', ARGV[5])
+local seq = redis.call('HINCRBY', KEYS[1], 'seq', 1)
+-- Records created before the indexes existed are not in them and stay out.
+local created = false
+if current then
+    created = redis.call('ZSCORE', '%(index_prefix)sstatus:' .. current, ARGV[1])
+end
+if created and current ~= ARGV[2] then
+    redis.call('ZREM', '%(index_prefix)sstatus:' .. current, ARGV[1])
+    redis.call('ZADD', '%(index_prefix)sstatus:' .. ARGV[2], created, ARGV[1])
+end
+if tonumber(ARGV[10]) > 0 then
+    -- A failing append (e.g. a stale stream with higher IDs) must not block the update.
+    redis.pcall('XADD', KEYS[3], 'MAXLEN', ARGV[10], seq .. '-0',
+        'status', ARGV[2], 'progress', ARGV[3], 'message', ARGV[4], 'at', ARGV[5])
+end
+local ttl = ARGV[6]
+if rank >= %(terminal_rank)d then
+    ttl = ARGV[7]
+    if redis.call('DECR', KEYS[4]) < 0 then
+        redis.call('SET', KEYS[4], 0)
+    end
+    if ARGV[8] == '1' then
+        redis.call('HDEL', KEYS[1], %(compact_fields)s)
+    end
+    if created and current_fields[2] and tonumber(ttl) > 0 then
+        redis.call('ZADD', KEYS[5], tonumber(ARGV[11]) + tonumber(ttl),
+            ARGV[2] .. ':' .. ARGV[1] .. ':' .. current_fields[2])
+    end
+    local dedupe = current_fields[3]
+    if dedupe and redis.call('GET', dedupe) == ARGV[1] then
+        if ARGV[2] ~= '%(completed)s' then
+            redis.call('DEL', dedupe)
+        elseif tonumber(ARGV[9]) > 0 then
+            redis.call('EXPIRE', dedupe, ARGV[9])
+        end
+    end
+end
+if tonumber(ttl) > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+    redis.call('EXPIRE', KEYS[3], ttl)
+end
+redis.call('PUBLISH', KEYS[2], cjson.encode({
+    task_id = ARGV[1],
+    name = current_fields[2] or nil,
+    status = ARGV[2],
+    progress = tonumber(ARGV[3]),
+    message = ARGV[4],
+    seq = seq,
+}))
+return ARGV[2]
+"""
+    % {
+        "ranks": _lua_table(
+            {status.value: rank for status, rank in STATUS_RANKS.items()}
+        ),
+        "terminal_rank": max(STATUS_RANKS.values()),
+        "compact_fields": ", ".join(f"'{field}'" for field in COMPACT_FIELDS),
+        "completed": TaskStatus.COMPLETED.value,
+        "index_prefix": INDEX_KEY_PREFIX,
+    }
+)
+
+# KEYS: expiring index
+# ARGV: now, max entries
+# Drops tasks whose record has expired from the status and name indexes.
+# Returns how many were dropped.
+PRUNE_INDEXES_SCRIPT = """
+local expired = redis.call(
+    'ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, entry in ipairs(expired) do
+    local status, task_id, name = string.match(entry, '^([^:]+):([^:]+):(.*)$')
+    redis.call('ZREM', '%(index_prefix)sstatus:' .. status, task_id)
+    redis.call('ZREM', '%(index_prefix)sname:' .. name, task_id)
+end
+if #expired > 0 then
+    redis.call('ZREM', KEYS[1], unpack(expired))
+end
+return #expired
+""" % {
+    "index_prefix": INDEX_KEY_PREFIX
+}
+
+LIST_FIELDS = (
+    "status",
+    "progress",
+    "message",
+    "seq",
+    "name",
+    "created_at",
+    "updated_at",
+)
+
+
+def _update_status_call(
+    task_id: str, status: TaskStatus, progress: float, message: Optional[str]
+) -> Dict[str, Any]:
+    return {
+        "keys": [
+            task_key(task_id),
+            task_channel(task_id),
+            history_key(task_id),
+            IN_FLIGHT_KEY,
+            EXPIRING_INDEX_KEY,
+        ],
+        "args": [
+            task_id,
+            TaskStatus(status).value,
+            repr(float(progress)),
+            message or "",
+            datetime.utcnow().isoformat(),
+            settings.TASK_ACTIVE_TTL_SECONDS,
+            settings.TASK_TERMINAL_TTL_SECONDS,
+            int(settings.TASK_COMPACT_ON_FINISH),
+            settings.TASK_RESULT_CACHE_TTL_SECONDS,
+            settings.TASK_HISTORY_MAX_EVENTS,
+            time.time(),
+        ],
+    }
+
+
+def update_status(
+    redis: Redis,
+    task_id: str,
+    status: TaskStatus,
+    progress: float,
+    message: Optional[str],
+) -> Optional[str]:
+    """
+    Atomically apply a status update and publish it to the task's event channel.
+
+    Returns the status stored after the call. It differs from ``status`` when
+    the update was refused because the task had already moved past it.
+    """
+    script = redis.register_script(UPDATE_STATUS_SCRIPT)
+    stored = script(**_update_status_call(task_id, status, progress, message))
+    return cast(Optional[str], stored)
+
+
+async def update_status_async(
+    redis: AsyncRedis,
+    task_id: str,
+    status: TaskStatus,
+    progress: float,
+    message: Optional[str],
+) -> Optional[str]:
+    """``update_status`` for the API's asyncio client."""
+    script = redis.register_script(UPDATE_STATUS_SCRIPT)
+    stored = await script(**_update_status_call(task_id, status, progress, message))
+    return cast(Optional[str], stored)
+
+
+async def list_tasks_async(
+    redis: AsyncRedis,
+    indexes: List[str],
+    max_score: str,
+    min_score: str,
+    after: str,
+    limit: int,
+    status: Optional[str] = None,
+    name: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[Tuple[float, str]]]:
+    """
+    Up to ``limit`` records listed in ``indexes`` with the given status and
+    name, newest first, reading at most ``TASK_LIST_MAX_SCAN`` index entries.
+
+    The smaller index is paged with ZREVRANGEBYSCORE from ``max_score`` down,
+    entries with the same score by descending ID, skipping those at or above the
+    cursor task ``after``; the records of each page are read in one pipelined
+    round trip. Returns the records and the position to continue from, None
+    once the index is exhausted. Entries whose record has expired are removed
+    from ``indexes``.
+    """
+    index = indexes[0]
+    if len(indexes) > 1:
+        pipe = redis.pipeline(transaction=False)
+        for key in indexes:
+            pipe.zcard(key)
+        sizes = await pipe.execute()
+        index = indexes[sizes.index(min(sizes))]
+    cursor_score = float(max_score) if after else None
+    bound, offset = max_score, 0
+    found: List[Dict[str, Any]] = []
+    stale: List[str] = []
+    read = 0
+    position: Optional[Tuple[float, str]] = None
+    exhausted = False
+    while len(found) < limit and read < settings.TASK_LIST_MAX_SCAN:
+        entries = cast(
+            List[Tuple[str, float]],
+            await redis.zrevrangebyscore(
+                index,
+                bound,
+                min_score,
+                start=offset,
+                num=min(limit, settings.TASK_LIST_MAX_SCAN - read),
+                withscores=True,
+            ),
+        )
+        if not entries:
+            exhausted = True
+            break
+        last_id, last_score = entries[-1]
+        same = sum(1 for _, score in entries if score == last_score)
+        offset = offset + same if float(bound) == last_score else same
+        bound = repr(last_score)
+        page = [
+            (task_id, score)
+            for task_id, score in entries
+            if cursor_score is None or score != cursor_score or task_id < after
+        ]
+        pipe = redis.pipeline(transaction=False)
+        for task_id, _ in page:
+            pipe.hmget(task_key(task_id), LIST_FIELDS)
+        for (task_id, score), values in zip(page, await pipe.execute()):
+            read += 1
+            position = (score, task_id)
+            fields = dict(zip(LIST_FIELDS, values))
+            if fields["status"] is None:
+                stale.append(task_id)
+            elif (status is None or fields["status"] == status) and (
+                name is None or fields["name"] == name
+            ):
+                found.append({"task_id": task_id, **fields})
+            if len(found) == limit or read == settings.TASK_LIST_MAX_SCAN:
+                break
+    if stale:
+        pipe = redis.pipeline(transaction=False)
+        for key in indexes:
+            pipe.zrem(key, *stale)
+        await pipe.execute()
+    return found, None if exhausted else position
+
+
+def prune_indexes(redis: Redis, batch_size: int = 1000) -> int:
+    """Drop every task whose record has expired after finishing from the indexes."""
+    script = redis.register_script(PRUNE_INDEXES_SCRIPT)
+    pruned = 0
+    while True:
+        count = script(keys=[EXPIRING_INDEX_KEY], args=[time.time(), batch_size])
+        pruned += count
+        if count < batch_size:
+            return pruned
+
+
+def migrate_legacy_records(redis: Redis, batch_size: int = 500) -> int:
+    """Convert every JSON string task record into the hash layout."""
+    script = redis.register_script(MIGRATE_RECORD_SCRIPT)
+    migrated = 0
+    keys: Iterable[str] = redis.scan_iter(
+        match=f"{TASK_KEY_PREFIX}*", count=batch_size, _type="string"
+    )
+    for key in keys:
+        migrated += script(keys=[key])
+    return migrated
+
+
+def collect_usage(redis: Redis, batch_size: int = 500) -> Dict[str, Dict[str, int]]:
+    """
+    Count task records and their memory per status.
+
+    Scans the keyspace incrementally and samples each batch in one pipelined
+    round trip. Records still stored as JSON strings are reported as ``legacy``.
+    """
+    usage: Dict[str, Dict[str, int]] = {}
+    batch: List[str] = []
+
+    def flush() -> None:
+        pipe = redis.pipeline(transaction=False)
+        for key in batch:
+            pipe.hget(key, "status")
+            pipe.memory_usage(key)
+        results = pipe.execute(raise_on_error=False)
+        for status, size in zip(results[::2], results[1::2]):
+            if isinstance(status, Exception):
+                status = "legacy"
+            if status is None:
+                continue
+            totals = usage.setdefault(status, {"keys": 0, "bytes": 0})
+            totals["keys"] += 1
+            # MEMORY USAGE is disabled on some managed Redis offerings.
+            if isinstance(size, int):
+                totals["bytes"] += size
+        batch.clear()
+
+    for key in redis.scan_iter(match=f"{TASK_KEY_PREFIX}*", count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return usage
+
+
+def report_usage(redis: Redis) -> Dict[str, Dict[str, int]]:
+    """
+    Collect usage, log it and keep the latest report under ``USAGE_KEY``.
+    Also resets the in-flight counter to the unfinished records found.
+    """
+    usage = collect_usage(redis)
+    report: Dict[FieldT, EncodableT] = {
+        status: json.dumps(totals) for status, totals in usage.items()
+    }
+    report["generated_at"] = datetime.utcnow().isoformat()
+    in_flight = sum(
+        usage.get(status.value, {}).get("keys", 0)
+        for status in STATUS_RANKS
+        if status not in TERMINAL_STATUSES
+    )
+    pipe = redis.pipeline(transaction=True)
+    pipe.delete(USAGE_KEY)
+    pipe.hset(USAGE_KEY, mapping=report)
+    pipe.set(IN_FLIGHT_KEY, in_flight)
+    pipe.execute()
+    for status, totals in sorted(usage.items()):
+        logger.info(
+            f"Task store: {totals['keys']} {status} tasks using {totals['bytes']} bytes"
+        )
+    return usage
+
+
+if __name__ == "__main__":
+    import sys
+
+    from app.tasks.connections import get_redis_connection
+
+    commands: Dict[str, Callable[[Redis], Any]] = {
+        "migrate": migrate_legacy_records,
+        "usage": report_usage,
+        "prune": prune_indexes,
+    }
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        sys.exit("usage: python -m app.tasks.status_store migrate|usage|prune")
+    logging.basicConfig(level=logging.INFO)
+    result = commands[sys.argv[1]](get_redis_connection())
+    if sys.argv[1] == "migrate":
+        logger.info(f"Migrated {result} task records")
+    elif sys.argv[1] == "prune":
+        logger.info(f"Dropped {result} expired tasks from the indexes")
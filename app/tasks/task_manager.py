@@ -1,23 +1,112 @@
 import asyncio
-import json
-import uuid
 import logging
-from datetime import datetime
-from typing import Any, AsyncGenerator, Dict, Optional
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple, cast
 
 import redis.asyncio as redis
 from fastapi import HTTPException
+from redis.exceptions import ResponseError
+from redis.typing import EncodableT, FieldT
 
+from app.core import metrics, serialization
 from app.core.config import settings
-from app.models.task import TaskResult, TaskStatus, TaskStatusResponse
-from app.tasks.celery_tasks import execute_task
+from app.models.task import (
+    LoadResponse,
+    TaskCreate,
+    TaskEvent,
+    TaskEventsResponse,
+    TaskListResponse,
+    TaskQueue,
+    TaskRecurrence,
+    TaskResult,
+    TaskStatus,
+    TaskStatusResponse,
+    TaskSummary,
+    WorkflowCreate,
+    WorkflowResponse,
+    WorkflowStatusResponse,
+)
+from app.tasks.backpressure import (
+    ADMIT,
+    DEFER,
+    REJECT,
+    LoadMonitor,
+    deferred_entry,
+    deferred_key,
+)
+from app.tasks.broadcaster import RESYNC, StatusBroadcaster
+from app.tasks.cache import StatusCache
+from app.tasks.celery_tasks import dispatch_tasks, execute_task
+from app.tasks.connections import create_async_redis_pool
+from app.tasks.payloads import STORE_PAYLOAD_SCRIPT, offload, store_payload_call
+from app.tasks.queues import execution_options
+from app.tasks.scheduler import (
+    SCHEDULE,
+    SCHEDULE_ENTRIES_KEY,
+    SCHEDULED_KEY,
+    jitter_offset,
+    schedule_entry,
+    scheduled_fields,
+    scheduled_ttl,
+    timestamp,
+)
+from app.tasks.status_store import (
+    CREATE_TASK_SCRIPT,
+    IN_FLIGHT_KEY,
+    STATUS_FIELDS,
+    TERMINAL_STATUSES,
+    content_dedupe_key,
+    created_score,
+    decode_event,
+    history_key,
+    idempotency_dedupe_key,
+    list_tasks_async,
+    name_index_key,
+    new_task_record,
+    status_index_key,
+    task_key,
+    update_status_async,
+)
+from app.tasks.workflows import (
+    WORKFLOW_PARTS,
+    aggregate_status,
+    workflow_arg,
+    workflow_key,
+)
 
 logger = logging.getLogger(__name__)
 
+# SSE comment line: ignored by clients, keeps proxies from closing idle streams.
+HEARTBEAT = ": keep-alive\n\n"
+
+
+class StreamSlot:
+    """
+    One of the ``TASK_STREAM_MAX_OPEN`` status streams a process may hold.
+    Releasing it more than once has no further effect, so both the stream and
+    the response serving it can release it.
+    """
+
+    def __init__(self, tm: "TaskManager") -> None:
+        self._tm: Optional["TaskManager"] = tm
+
+    def release(self) -> None:
+        if self._tm is not None:
+            self._tm._open_streams -= 1
+            self._tm = None
+
+
 class TaskManager:
     _instance: Optional["TaskManager"] = None
     _redis: Optional[redis.Redis] = None
+    _broadcaster: StatusBroadcaster = StatusBroadcaster()
+    _load: LoadMonitor = LoadMonitor()
+    _cache: Optional[StatusCache] = StatusCache.from_settings()
     _tasks: Dict[str, Dict[str, Any]] = {}
+    _open_streams = 0
     _max_retries = 5
     _retry_delay = 2
 
@@ -26,70 +115,157 @@ class TaskManager:
             cls._instance = super(TaskManager, cls).__new__(cls)
         return cls._instance
 
+    @property
+    def client(self) -> redis.Redis:
+        """The Redis client, once ``initialize`` has connected it."""
+        assert self._redis is not None, "TaskManager is not initialized"
+        return self._redis
+
     async def initialize(self) -> None:
         if self._redis is None:
             for attempt in range(self._max_retries):
                 try:
-                    self._redis = redis.Redis(
-                        host=settings.REDIS_HOST,
-                        port=settings.REDIS_PORT,
-                        db=0,
-                        decode_responses=True,
-                        socket_timeout=5,
-                        socket_connect_timeout=5,
-                        retry_on_timeout=True,
-                        health_check_interval=30
-                    )
-                    
-                    await asyncio.wait_for(self._redis.ping(), timeout=5.0)
+                    self._redis = redis.Redis(connection_pool=create_async_redis_pool())
+
+                    await asyncio.wait_for(self.client.ping(), timeout=5.0)
+                    self._broadcaster.bind(self.client)
+                    self._load.bind(self.client)
+                    self._load.start()
+                    if self._cache is not None:
+                        # Cached states of unfinished tasks are dropped as soon
+                        # as they change, so polling reads Redis once per change.
+                        self._broadcaster.add_hook(self._cache.invalidate)
+                    self._broadcaster.start()
                     logger.info("Successfully connected to Redis")
                     return
                 except asyncio.TimeoutError:
-                    logger.warning(f"Redis connection timeout (attempt {attempt + 1}/{self._max_retries})")
+                    logger.warning(
+                        "Redis connection timeout "
+                        f"(attempt {attempt + 1}/{self._max_retries})"
+                    )
                 except Exception as e:
-                    logger.warning(f"Failed to connect to Redis (attempt {attempt + 1}/{self._max_retries}): {str(e)}")
-                
+                    logger.warning(
+                        "Failed to connect to Redis "
+                        f"(attempt {attempt + 1}/{self._max_retries}): {str(e)}"
+                    )
+
                 if attempt < self._max_retries - 1:
                     await asyncio.sleep(self._retry_delay)
                 else:
                     logger.error("Failed to connect to Redis after all retries")
                     raise HTTPException(
                         status_code=500,
-                        detail="Failed to connect to Redis. Please try again later."
+                        detail="Failed to connect to Redis. Please try again later.",
                     )
 
+    @metrics.timed(metrics.CREATE_TASK_SECONDS)
     async def create_task(
-        self, name: str, parameters: Dict[str, Any], callback_url: str
+        self,
+        name: str,
+        parameters: Dict[str, Any],
+        callback_url: str,
+        queue: Optional[TaskQueue] = None,
+        priority: Optional[int] = None,
+        deadline: Optional[datetime] = None,
+        timeout: Optional[float] = None,
+        idempotency_key: Optional[str] = None,
+        dedupe: bool = False,
+        run_at: Optional[datetime] = None,
+        recurrence: Optional[TaskRecurrence] = None,
+        jitter: Optional[float] = None,
     ) -> str:
+        task_id: Optional[str] = None
+        stored_id: Any = None
         try:
             if self._redis is None:
                 await self.initialize()
 
+            options = self._execution_options(queue, priority)
+            # Scheduled tasks are published by the scheduler when they are due.
+            scheduled = run_at is not None or recurrence is not None
+            admission = SCHEDULE if scheduled else self._load.admit(options["queue"])
+            if admission == REJECT:
+                raise self._overloaded()
+
             task_id = str(uuid.uuid4())
-            created_at = datetime.utcnow().isoformat()
-
-            task_data = {
-                "task_id": task_id,
-                "name": name,
-                "parameters": parameters,
-                "callback_url": callback_url,
-                "status": TaskStatus.PENDING,
-                "created_at": created_at,
-                "updated_at": created_at,
-                "progress": 0.0,
-                "message": "Task created",
-            }
+            deadline_ts = self._deadline_timestamp(
+                deadline, None if scheduled else timeout
+            )
+            task_parameters, payload = offload(parameters)
+            task_data = new_task_record(
+                task_id,
+                name,
+                task_parameters,
+                callback_url,
+                options["queue"],
+                priority,
+                deadline_ts,
+            )
+            ttl = settings.TASK_ACTIVE_TTL_SECONDS
+            if scheduled:
+                run_at_ts = timestamp(run_at) if run_at is not None else time.time()
+                due = self._scheduled_run(
+                    task_id, task_data, run_at_ts, recurrence, jitter
+                )
+                ttl = scheduled_ttl(due)
 
-            await asyncio.wait_for(
-                self._redis.set(f"task:{task_id}", json.dumps(task_data)),
-                timeout=5.0
+            pipe = self.client.pipeline(transaction=False)
+            await self._store_new_task(
+                pipe,
+                task_id,
+                task_data,
+                self._dedupe_claim(name, parameters, idempotency_key, dedupe),
+                ttl,
             )
+            await self._store_payload(pipe, payload, ttl)
+            started = time.perf_counter()
+            stored_id = (await asyncio.wait_for(pipe.execute(), timeout=5.0))[0]
+            metrics.REDIS_STORE_TASK_SECONDS.observe(time.perf_counter() - started)
+            if stored_id != task_id and isinstance(stored_id, str):
+                logger.info(f"Duplicate submission of task {stored_id}")
+                return stored_id
             logger.info(f"Created task {task_id}")
 
-            task = execute_task.delay(task_id, name, parameters, callback_url)
+            call = [task_id, name, task_parameters, callback_url, deadline_ts]
+            if admission == SCHEDULE:
+                failures = await self._schedule_calls(
+                    [
+                        schedule_entry(
+                            call,
+                            options,
+                            priority,
+                            run_at_ts,
+                            timeout,
+                            recurrence,
+                            jitter,
+                        )
+                    ]
+                )
+                if failures:
+                    raise Exception(failures[0])
+                logger.info(f"Scheduled task {task_id}")
+                return task_id
+
+            if admission == DEFER:
+                await asyncio.wait_for(
+                    self.client.rpush(
+                        deferred_key(options["queue"]), deferred_entry(call, options)
+                    ),
+                    timeout=5.0,
+                )
+                self._load.charge(options["queue"], DEFER)
+                logger.info(f"Deferred execution of task {task_id}")
+                return task_id
+
+            # Publishing blocks on the broker, which must not stall the loop
+            # serving every open status stream.
+            task = await asyncio.to_thread(
+                execute_task.apply_async, call, task_id=task_id, **options
+            )
             if not task:
                 raise Exception("Failed to create Celery task")
-            
+
+            self._load.charge(options["queue"], ADMIT)
             logger.info(f"Started execution of task {task_id}")
             return task_id
 
@@ -97,98 +273,1288 @@ class TaskManager:
             logger.error("Redis operation timed out")
             raise HTTPException(
                 status_code=500,
-                detail="Redis operation timed out. Please try again later."
+                detail="Redis operation timed out. Please try again later.",
             )
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Failed to create task: {str(e)}")
-            if 'task_id' in locals():
+            if task_id is not None:
                 try:
-                    await self._redis.delete(f"task:{task_id}")
+                    pipe = self.client.pipeline(transaction=False)
+                    pipe.delete(task_key(task_id))
+                    if stored_id == task_id:
+                        pipe.decr(IN_FLIGHT_KEY)
+                        pipe.zrem(status_index_key(TaskStatus.PENDING), task_id)
+                        pipe.zrem(name_index_key(name), task_id)
+                    await pipe.execute()
                 except Exception:
                     pass
+            raise HTTPException(
+                status_code=500, detail=f"Failed to create task: {str(e)}"
+            )
+
+    @metrics.timed(metrics.CREATE_TASKS_SECONDS)
+    async def create_tasks(
+        self, tasks: List[TaskCreate]
+    ) -> Tuple[List[Optional[str]], Dict[int, str]]:
+        """
+        Create many tasks at once.
+
+        All records are written in one pipelined round trip and the Celery
+        messages are published over a single producer connection. Returns the
+        task IDs in input order, with ``None`` for tasks that could not be
+        queued, and the error for each of those by index.
+        """
+        queues = [
+            (task.queue or TaskQueue(settings.TASK_DEFAULT_QUEUE_CLASS)).value
+            for task in tasks
+        ]
+        # Only the tasks that turn out to be new and get queued are charged.
+        decided = iter(
+            self._load.admit_all(
+                [queue for task, queue in zip(tasks, queues) if not task.scheduled]
+            )
+        )
+        admissions = [SCHEDULE if task.scheduled else next(decided) for task in tasks]
+        if REJECT in admissions:
+            raise self._overloaded()
+
+        try:
+            if self._redis is None:
+                await self.initialize()
+
+            task_ids = [str(uuid.uuid4()) for _ in tasks]
+            for task in tasks:
+                if task.scheduled and task.run_at is None:
+                    task.run_at = datetime.now(timezone.utc)
+            pipe = self.client.pipeline(transaction=False)
+            claims = []
+            payloads = []
+            task_parameters = []
+            for index, (task_id, task) in enumerate(zip(task_ids, tasks)):
+                claim = self._dedupe_claim(
+                    task.name, task.parameters, task.idempotency_key, task.dedupe
+                )
+                parameters, payload = offload(task.parameters)
+                task_parameters.append(parameters)
+                task_data = new_task_record(
+                    task_id,
+                    task.name,
+                    parameters,
+                    str(task.callback_url),
+                    queues[index],
+                    task.priority,
+                    self._task_deadline(task),
+                )
+                ttl = settings.TASK_ACTIVE_TTL_SECONDS
+                if task.scheduled:
+                    ttl = scheduled_ttl(
+                        self._scheduled_run(
+                            task_id,
+                            task_data,
+                            self._run_at(task),
+                            task.recurrence,
+                            task.jitter,
+                        )
+                    )
+                if payload is not None:
+                    payloads.append((payload, ttl))
+                claims.append((len(pipe), claim))
+                await self._store_new_task(pipe, task_id, task_data, claim, ttl)
+            # Queued after the records so the claim results keep their positions.
+            for payload, ttl in payloads:
+                await self._store_payload(pipe, payload, ttl)
+            started = time.perf_counter()
+            results = await asyncio.wait_for(pipe.execute(), timeout=30.0)
+            metrics.REDIS_STORE_TASKS_SECONDS.observe(time.perf_counter() - started)
+            new = []
+            for index, (position, claim) in enumerate(claims):
+                if claim is not None and results[position] != task_ids[index]:
+                    task_ids[index] = results[position]
+                else:
+                    new.append(index)
+            logger.info(
+                f"Created {len(new)} tasks, "
+                f"{len(tasks) - len(new)} duplicate submissions"
+            )
+        except asyncio.TimeoutError:
+            logger.error("Redis operation timed out")
             raise HTTPException(
                 status_code=500,
-                detail=f"Failed to create task: {str(e)}"
+                detail="Redis operation timed out. Please try again later.",
+            )
+        except Exception as e:
+            logger.error(f"Failed to create tasks: {str(e)}")
+            raise HTTPException(
+                status_code=500, detail=f"Failed to create tasks: {str(e)}"
             )
 
-    async def get_task_status(self, task_id: str) -> TaskStatusResponse:
+        failures: Dict[int, str] = {}
+        for admission in set(admissions[index] for index in new):
+            indexes = [index for index in new if admissions[index] == admission]
+            args = (
+                [task_ids[index] for index in indexes],
+                [tasks[index] for index in indexes],
+                [task_parameters[index] for index in indexes],
+            )
+            if admission == SCHEDULE:
+                unqueued = await self._schedule_tasks(*args)
+            elif admission == DEFER:
+                unqueued = await self._defer_tasks(*args)
+            else:
+                unqueued = await asyncio.to_thread(self._publish_tasks, *args)
+            failures.update(
+                {indexes[position]: error for position, error in unqueued.items()}
+            )
+        if failures:
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                pipe.delete(*(task_key(task_ids[i]) for i in failures))
+                pipe.decrby(IN_FLIGHT_KEY, len(failures))
+                pipe.zrem(
+                    status_index_key(TaskStatus.PENDING),
+                    *(task_ids[i] for i in failures),
+                )
+                for index in failures:
+                    pipe.zrem(name_index_key(tasks[index].name), task_ids[index])
+                await pipe.execute()
+            except Exception:
+                pass
+        charged = Counter(
+            (queues[index], admissions[index]) for index in new if index not in failures
+        )
+        for (queue, admission), count in charged.items():
+            self._load.charge(queue, admission, count)
+        deferred = sum(
+            admissions[index] == DEFER for index in new if index not in failures
+        )
+        scheduled = sum(
+            admissions[index] == SCHEDULE for index in new if index not in failures
+        )
+        logger.info(
+            f"Started execution of {len(new) - len(failures) - deferred - scheduled} "
+            "tasks, "
+            f"deferred {deferred}, scheduled {scheduled}"
+        )
+        return [
+            None if index in failures else task_id
+            for index, task_id in enumerate(task_ids)
+        ], failures
+
+    async def _defer_tasks(
+        self, task_ids: List[str], tasks: List[TaskCreate], parameters: List[Any]
+    ) -> Dict[int, str]:
+        """Park tasks until admission control lets them; returns failures by index."""
+        return await self._defer_calls(*self._task_calls(task_ids, tasks, parameters))
+
+    async def _defer_calls(
+        self, calls: List[List[Any]], options: List[Dict[str, Any]]
+    ) -> Dict[int, str]:
+        pipe = self.client.pipeline(transaction=False)
+        for call, task_options in zip(calls, options):
+            pipe.rpush(
+                deferred_key(task_options["queue"]), deferred_entry(call, task_options)
+            )
+        try:
+            await asyncio.wait_for(pipe.execute(), timeout=30.0)
+        except Exception as e:
+            logger.error(f"Failed to defer tasks: {str(e)!r}")
+            return {
+                index: f"Failed to defer task: {str(e)}" for index in range(len(calls))
+            }
+        return {}
+
+    async def _schedule_tasks(
+        self, task_ids: List[str], tasks: List[TaskCreate], parameters: List[Any]
+    ) -> Dict[int, str]:
+        """Park tasks until their scheduled time; returns failures by index."""
+        calls, options = self._task_calls(task_ids, tasks, parameters)
+        return await self._schedule_calls(
+            [
+                schedule_entry(
+                    call,
+                    task_options,
+                    task.priority,
+                    self._run_at(task),
+                    task.timeout,
+                    task.recurrence,
+                    task.jitter,
+                )
+                for call, task_options, task in zip(calls, options, tasks)
+            ]
+        )
+
+    async def _schedule_calls(
+        self, entries: List[Tuple[str, float, str]]
+    ) -> Dict[int, str]:
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(
+            SCHEDULE_ENTRIES_KEY, mapping={name: entry for name, _, entry in entries}
+        )
+        pipe.zadd(SCHEDULED_KEY, {name: due for name, due, _ in entries})
+        try:
+            await asyncio.wait_for(pipe.execute(), timeout=30.0)
+        except Exception as e:
+            logger.error(f"Failed to schedule tasks: {str(e)!r}")
+            return {
+                index: f"Failed to schedule task: {str(e)}"
+                for index in range(len(entries))
+            }
+        return {}
+
+    @staticmethod
+    def _scheduled_run(
+        task_id: str,
+        task_data: Dict[str, str],
+        run_at: float,
+        recurrence: Optional[TaskRecurrence],
+        jitter: Optional[float],
+    ) -> float:
+        """Mark a new record as scheduled; returns when its run is due."""
+        if jitter is None:
+            jitter = settings.TASK_SCHEDULE_JITTER_SECONDS
+        due = run_at + jitter_offset(task_id, jitter)
+        task_data.update(
+            scheduled_fields(task_id, due, task_id if recurrence is not None else None)
+        )
+        return due
+
+    @staticmethod
+    def _run_at(task: TaskCreate) -> float:
+        """When a scheduled task's first run is due, before jitter."""
+        return timestamp(task.run_at) if task.run_at is not None else time.time()
+
+    @staticmethod
+    def _overloaded() -> HTTPException:
+        return HTTPException(
+            status_code=429,
+            detail="Too many tasks are waiting, please retry later",
+            headers={
+                "Retry-After": str(settings.TASK_BACKPRESSURE_RETRY_AFTER_SECONDS)
+            },
+        )
+
+    @staticmethod
+    def _task_calls(
+        task_ids: List[str], tasks: List[TaskCreate], parameters: List[Any]
+    ) -> Tuple[List[List[Any]], List[Dict[str, Any]]]:
+        """The ``execute_task`` arguments and ``apply_async`` options of each task."""
+        calls = [
+            [
+                task_id,
+                task.name,
+                task_parameters,
+                str(task.callback_url),
+                TaskManager._task_deadline(task),
+            ]
+            for task_id, task, task_parameters in zip(task_ids, tasks, parameters)
+        ]
+        options = [
+            TaskManager._execution_options(task.queue, task.priority) for task in tasks
+        ]
+        return calls, options
+
+    @staticmethod
+    def _publish_tasks(
+        task_ids: List[str], tasks: List[TaskCreate], parameters: List[Any]
+    ) -> Dict[int, str]:
+        return TaskManager._publish_calls(
+            *TaskManager._task_calls(task_ids, tasks, parameters)
+        )
+
+    @staticmethod
+    def _publish_calls(
+        calls: List[List[Any]], options: List[Dict[str, Any]]
+    ) -> Dict[int, str]:
+        # Publishing a Celery message costs a few hundred microseconds, so large
+        # batches are sent as chunks that a worker fans out into execute_task
+        # messages, keeping the request path short.
+        chunk_size = settings.TASK_BATCH_PUBLISH_CHUNK_SIZE
+        messages: List[Tuple[List[int], Any, Any, Dict[str, Any]]]
+        if len(calls) <= chunk_size:
+            messages = [
+                ([index], execute_task, call, {**options[index], "task_id": call[0]})
+                for index, call in enumerate(calls)
+            ]
+        else:
+            # Each chunk is fanned out with one set of options, so tasks are
+            # grouped by queue and priority first.
+            groups: Dict[Tuple[Any, ...], List[int]] = {}
+            for index, task_options in enumerate(options):
+                groups.setdefault(tuple(sorted(task_options.items())), []).append(index)
+            messages = []
+            for key, group in groups.items():
+                for start in range(0, len(group), chunk_size):
+                    indexes = group[start : start + chunk_size]
+                    chunk = [calls[index] for index in indexes]
+                    messages.append((indexes, dispatch_tasks, (chunk, dict(key)), {}))
+
+        failures = {}
+        try:
+            with execute_task.app.producer_or_acquire() as producer:
+                for indexes, task, args, task_options in messages:
+                    try:
+                        task.apply_async(args, producer=producer, **task_options)
+                    except Exception as e:
+                        for index in indexes:
+                            failures[index] = f"Failed to create Celery task: {str(e)}"
+        except Exception as e:
+            logger.error(f"Failed to publish tasks: {str(e)}")
+            for index in range(len(calls)):
+                failures.setdefault(index, f"Failed to create Celery task: {str(e)}")
+        return failures
+
+    @staticmethod
+    def _execution_options(
+        queue: Optional[TaskQueue], priority: Optional[int]
+    ) -> Dict[str, Any]:
+        return execution_options(queue, priority, execute_task.app.conf.broker_url)
+
+    @staticmethod
+    def _deadline_timestamp(
+        deadline: Optional[datetime], timeout: Optional[float]
+    ) -> Optional[float]:
+        candidates = []
+        if deadline is not None:
+            candidates.append(timestamp(deadline))
+        if timeout is not None:
+            candidates.append(time.time() + timeout)
+        return min(candidates) if candidates else None
+
+    @staticmethod
+    def _task_deadline(task: TaskCreate) -> Optional[float]:
+        # The timeout of a scheduled task counts from when it is published.
+        return TaskManager._deadline_timestamp(
+            task.deadline, None if task.scheduled else task.timeout
+        )
+
+    @staticmethod
+    def _dedupe_claim(
+        name: str,
+        parameters: Dict[str, Any],
+        idempotency_key: Optional[str],
+        dedupe: bool,
+    ) -> Optional[Tuple[str, int]]:
+        """The dedupe key a submission claims and for how long, if any."""
+        if idempotency_key is not None:
+            return (
+                idempotency_dedupe_key(idempotency_key),
+                settings.TASK_IDEMPOTENCY_WINDOW_SECONDS,
+            )
+        if dedupe:
+            return (
+                content_dedupe_key(name, parameters),
+                settings.TASK_DEDUPE_WINDOW_SECONDS,
+            )
+        return None
+
+    async def _store_new_task(
+        self,
+        pipe: Any,
+        task_id: str,
+        task_data: Dict[str, str],
+        claim: Optional[Tuple[str, int]] = None,
+        ttl: Optional[int] = None,
+    ) -> None:
+        """
+        Queue the commands creating a task record and indexing it. With a dedupe
+        ``claim`` the first queued command returns the ID of the task owning the claim.
+        """
+        if ttl is None:
+            ttl = settings.TASK_ACTIVE_TTL_SECONDS
+        indexes = [
+            status_index_key(TaskStatus.PENDING),
+            name_index_key(task_data["name"]),
+        ]
+        score = created_score(task_data)
+        if claim is not None:
+            key, window = claim
+            fields = [item for pair in task_data.items() for item in pair]
+            script = self.client.register_script(CREATE_TASK_SCRIPT)
+            await script(
+                keys=[task_key(task_id), key, IN_FLIGHT_KEY, *indexes],
+                args=[task_id, window, ttl, score, *fields],
+                client=pipe,
+            )
+            return
+        pipe.hset(task_key(task_id), mapping=task_data)
+        if ttl > 0:
+            pipe.expire(task_key(task_id), ttl)
+        pipe.incr(IN_FLIGHT_KEY)
+        for index in indexes:
+            pipe.zadd(index, {task_id: score})
+
+    async def _store_payload(
+        self,
+        pipe: Any,
+        payload: Optional[Tuple[str, List[str]]],
+        ttl: Optional[int] = None,
+    ) -> None:
+        """
+        Queue the command storing a payload offloaded from a task, if any, for
+        at least as long as the task's record.
+        """
+        if payload is None:
+            return
+        script = self.client.register_script(STORE_PAYLOAD_SCRIPT)
+        await script(**store_payload_call(*payload, ttl), client=pipe)
+
+    @metrics.timed(metrics.CREATE_WORKFLOW_SECONDS)
+    async def create_workflow(self, workflow: WorkflowCreate) -> WorkflowResponse:
+        """
+        Create the tasks of a workflow and start the steps that depend on none.
+
+        Every step gets its task record up front, so that it can be looked up
+        and streamed while it waits. Steps with dependencies are stored with
+        their ``execute_task`` call for the worker that releases them (see
+        ``app.tasks.workflows``). Only the steps started now go through
+        admission control.
+        """
+        steps = workflow.steps
+        options = {
+            step.key: self._execution_options(step.queue, step.priority)
+            for step in steps
+        }
+        roots = [step.key for step in steps if not step.depends_on]
+        admissions = dict(
+            zip(roots, self._load.admit_all([options[key]["queue"] for key in roots]))
+        )
+        if REJECT in admissions.values():
+            raise self._overloaded()
+
+        try:
+            if self._redis is None:
+                await self.initialize()
+
+            workflow_id = str(uuid.uuid4())
+            task_ids = {step.key: str(uuid.uuid4()) for step in steps}
+            calls: Dict[str, List[Any]] = {}
+            waiting: Dict[FieldT, EncodableT] = {}
+            entries: Dict[FieldT, EncodableT] = {}
+            dependents: Dict[str, List[str]] = {}
+            pipe = self.client.pipeline(transaction=False)
+            payloads = []
+            for step in steps:
+                parameters, payload = offload(step.parameters)
+                if payload is not None:
+                    payloads.append(payload)
+                task_data = new_task_record(
+                    task_ids[step.key],
+                    step.name,
+                    parameters,
+                    "",
+                    options[step.key]["queue"],
+                    step.priority,
+                    None,
+                )
+                task_data.update(workflow_id=workflow_id, workflow_step=step.key)
+                await self._store_new_task(pipe, task_ids[step.key], task_data)
+                depends_on = list(dict.fromkeys(step.depends_on))
+                deadline = None
+                if not depends_on:
+                    deadline = self._deadline_timestamp(None, step.timeout)
+                calls[step.key] = [
+                    task_ids[step.key],
+                    step.name,
+                    parameters,
+                    "",
+                    deadline,
+                    workflow_arg(workflow_id, step.key),
+                ]
+                if depends_on:
+                    waiting[step.key] = len(depends_on)
+                    entries[step.key] = serialization.dumps(
+                        {
+                            "call": calls[step.key],
+                            "options": options[step.key],
+                            "timeout": step.timeout,
+                            "depends_on": depends_on,
+                        }
+                    )
+                for dependency in depends_on:
+                    dependents.setdefault(dependency, []).append(step.key)
+
+            pipe.hset(
+                workflow_key(workflow_id),
+                mapping={
+                    "workflow_id": workflow_id,
+                    "callback_url": str(workflow.callback_url or ""),
+                    "total": len(steps),
+                    "steps": serialization.dumps(task_ids),
+                    "created_at": datetime.utcnow().isoformat(),
+                },
+            )
+            if waiting:
+                pipe.hset(workflow_key(workflow_id, "calls"), mapping=entries)
+                pipe.hset(workflow_key(workflow_id, "waiting"), mapping=waiting)
+                pipe.hset(
+                    workflow_key(workflow_id, "dependents"),
+                    mapping={key: ",".join(keys) for key, keys in dependents.items()},
+                )
+            if settings.TASK_ACTIVE_TTL_SECONDS > 0:
+                for key in [workflow_key(workflow_id)] + [
+                    workflow_key(workflow_id, part) for part in WORKFLOW_PARTS
+                ]:
+                    pipe.expire(key, settings.TASK_ACTIVE_TTL_SECONDS)
+            for payload in payloads:
+                await self._store_payload(pipe, payload)
+            started = time.perf_counter()
+            await asyncio.wait_for(pipe.execute(), timeout=30.0)
+            metrics.REDIS_STORE_TASKS_SECONDS.observe(time.perf_counter() - started)
+            stored = True
+
+            failures: Dict[int, str] = {}
+            for admission in set(admissions.values()):
+                keys = [key for key in roots if admissions[key] == admission]
+                args = ([calls[key] for key in keys], [options[key] for key in keys])
+                if admission == DEFER:
+                    unqueued = await self._defer_calls(*args)
+                else:
+                    unqueued = await asyncio.to_thread(self._publish_calls, *args)
+                failures.update(unqueued)
+            if failures:
+                raise Exception(next(iter(failures.values())))
+            for key in roots:
+                self._load.charge(options[key]["queue"], admissions[key])
+            logger.info(f"Created workflow {workflow_id} with {len(steps)} steps")
+            return WorkflowResponse(workflow_id=workflow_id, task_ids=task_ids)
+
+        except asyncio.TimeoutError:
+            logger.error("Redis operation timed out")
+            raise HTTPException(
+                status_code=500,
+                detail="Redis operation timed out. Please try again later.",
+            )
+        except Exception as e:
+            logger.error(f"Failed to create workflow: {str(e)}")
+            if "task_ids" in locals():
+                # Steps already published find no record at their first status
+                # write and stop there, without advancing the workflow.
+                try:
+                    pipe = self.client.pipeline(transaction=False)
+                    pipe.delete(*(task_key(task_id) for task_id in task_ids.values()))
+                    pipe.delete(
+                        workflow_key(workflow_id),
+                        *(workflow_key(workflow_id, part) for part in WORKFLOW_PARTS),
+                    )
+                    if locals().get("stored"):
+                        pipe.decrby(IN_FLIGHT_KEY, len(task_ids))
+                        pipe.zrem(
+                            status_index_key(TaskStatus.PENDING), *task_ids.values()
+                        )
+                        for step in steps:
+                            pipe.zrem(name_index_key(step.name), task_ids[step.key])
+                    await pipe.execute()
+                except Exception:
+                    pass
+            raise HTTPException(
+                status_code=500, detail=f"Failed to create workflow: {str(e)}"
+            )
+
+    @metrics.timed(metrics.GET_WORKFLOW_STATUS_SECONDS)
+    async def get_workflow_status(self, workflow_id: str) -> WorkflowStatusResponse:
+        """The status of a workflow and each of its steps, read in one round trip."""
+        steps = await self._workflow_steps(workflow_id)
+        found, _ = await self.get_task_statuses(list(steps.values()))
+        return self._workflow_status(
+            workflow_id, steps, {status.task_id: status for status in found}
+        )
+
+    async def _workflow_steps(self, workflow_id: str) -> Dict[str, str]:
+        try:
+            if self._redis is None:
+                await self.initialize()
+            steps = await asyncio.wait_for(
+                self.client.hget(workflow_key(workflow_id), "steps"), timeout=5.0
+            )
+        except asyncio.TimeoutError:
+            logger.error("Redis operation timed out")
+            raise HTTPException(
+                status_code=500,
+                detail="Redis operation timed out. Please try again later.",
+            )
+        if steps is None:
+            raise HTTPException(
+                status_code=404, detail=f"Workflow {workflow_id} not found"
+            )
+        task_ids: Dict[str, str] = serialization.loads(steps)
+        return task_ids
+
+    @staticmethod
+    def _workflow_status(
+        workflow_id: str,
+        steps: Dict[str, str],
+        statuses: Dict[str, TaskStatusResponse],
+        only: Optional[List[str]] = None,
+    ) -> WorkflowStatusResponse:
+        """
+        Aggregate the step statuses; ``steps`` of the response is limited to the
+        step keys in ``only`` when given. Steps whose record has expired count
+        as cancelled.
+        """
+        states = {
+            key: statuses.get(task_id)
+            or TaskStatusResponse(
+                task_id=task_id, status=TaskStatus.CANCELLED, progress=0.0
+            )
+            for key, task_id in steps.items()
+        }
+        return WorkflowStatusResponse(
+            workflow_id=workflow_id,
+            status=aggregate_status(state.status for state in states.values()),
+            progress=sum(state.progress for state in states.values()) / len(states),
+            steps=states if only is None else {key: states[key] for key in only},
+        )
+
+    async def stream_workflow_status(
+        self, workflow_id: str, slot: Optional[StreamSlot] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream the aggregate status of a workflow until it finishes.
+
+        The first event lists every step. Each later one is sent when a step
+        changes and lists only the steps that changed since the previous one.
+        ``slot`` is released when the stream ends.
+        """
+        subscription = None
+        metrics.OPEN_WORKFLOW_STREAMS.inc()
+        try:
+            steps = await self._workflow_steps(workflow_id)
+            step_keys = {task_id: key for key, task_id in steps.items()}
+            subscription = await self._broadcaster.subscribe(list(step_keys))
+            events: List[Tuple[str, Optional[str]]] = [
+                (task_id, RESYNC) for task_id in step_keys
+            ]
+            statuses: Dict[str, TaskStatusResponse] = {}
+            while True:
+                if not events:
+                    yield HEARTBEAT
+                else:
+                    resync = [
+                        task_id for task_id, payload in events if payload is RESYNC
+                    ]
+                    if resync:
+                        found, _ = await self.get_task_statuses(resync)
+                        statuses.update((status.task_id, status) for status in found)
+                    for task_id, payload in events:
+                        if payload is not None and payload is not RESYNC:
+                            statuses[task_id] = TaskStatusResponse(
+                                **serialization.loads(payload)
+                            )
+                    changed = list(
+                        dict.fromkeys(step_keys[task_id] for task_id, _ in events)
+                    )
+                    status = self._workflow_status(
+                        workflow_id, steps, statuses, changed
+                    )
+                    yield f"data: {serialization.model_dumps(status)}\n\n"
+                    if status.status in TERMINAL_STATUSES:
+                        logger.info(
+                            f"Workflow {workflow_id} finished "
+                            f"with status {status.status}"
+                        )
+                        break
+
+                events = await subscription.get(settings.TASK_STATUS_UPDATE_INTERVAL)
+
+        except asyncio.TimeoutError:
+            logger.error("Redis operation timed out")
+            raise HTTPException(
+                status_code=500,
+                detail="Redis operation timed out. Please try again later.",
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to stream workflow status: {str(e)}")
+            raise HTTPException(
+                status_code=500, detail=f"Failed to stream workflow status: {str(e)}"
+            )
+        finally:
+            if slot is not None:
+                slot.release()
+            metrics.OPEN_WORKFLOW_STREAMS.dec()
+            if subscription is not None:
+                self._broadcaster.unsubscribe(subscription)
+
+    async def get_load(self) -> LoadResponse:
+        """The load snapshot admission control works from, for autoscalers."""
+        try:
+            if self._redis is None:
+                await self.initialize()
+            return LoadResponse(**await self._load.get())
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to sample task load: {str(e)!r}")
+            raise HTTPException(
+                status_code=503, detail=f"Failed to sample task load: {str(e)}"
+            )
+
+    @metrics.timed(metrics.CANCEL_TASK_SECONDS)
+    async def cancel_task(self, task_id: str) -> TaskStatusResponse:
+        """
+        Cancel a task that has not finished yet.
+
+        The task is marked CANCELLED right away. A worker running it notices at
+        its next progress write and stops; a queued message is revoked so that
+        no worker starts it.
+        """
         try:
             if self._redis is None:
                 await self.initialize()
 
             task_data = await asyncio.wait_for(
-                self._redis.get(f"task:{task_id}"),
-                timeout=5.0
+                self._read_status_fields(task_id), timeout=5.0
             )
             if not task_data:
                 raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
 
-            task_data = json.loads(task_data)
+            started = time.perf_counter()
+            stored = await asyncio.wait_for(
+                update_status_async(
+                    self.client,
+                    task_id,
+                    TaskStatus.CANCELLED,
+                    float(task_data["progress"]),
+                    "Task cancelled",
+                ),
+                timeout=5.0,
+            )
+            metrics.REDIS_UPDATE_STATUS_SECONDS.observe(time.perf_counter() - started)
+            if stored is None:
+                raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+            if stored != TaskStatus.CANCELLED:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Task {task_id} already finished as {stored}",
+                )
+            if self._cache is not None:
+                self._cache.invalidate(task_id)
+
+            try:
+                await asyncio.to_thread(execute_task.app.control.revoke, task_id)
+            except Exception as e:
+                # The worker still stops at its first progress write.
+                logger.warning(f"Failed to revoke task {task_id}: {str(e)}")
+
+            logger.info(f"Cancelled task {task_id}")
             return TaskStatusResponse(
+                task_id=task_id,
+                status=TaskStatus.CANCELLED,
+                progress=float(task_data["progress"]),
+                message="Task cancelled",
+            )
+        except asyncio.TimeoutError:
+            logger.error("Redis operation timed out")
+            raise HTTPException(
+                status_code=500,
+                detail="Redis operation timed out. Please try again later.",
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to cancel task: {str(e)}")
+            raise HTTPException(
+                status_code=500, detail=f"Failed to cancel task: {str(e)}"
+            )
+
+    @metrics.timed(metrics.CANCEL_SCHEDULE_SECONDS)
+    async def cancel_schedule(self, schedule_id: str) -> TaskStatusResponse:
+        """
+        Take a delayed or recurring task off the schedule and cancel its next
+        run. Returns the status of that run, which is left to finish if it has
+        already been published.
+        """
+        try:
+            if self._redis is None:
+                await self.initialize()
+
+            pipe = self.client.pipeline(transaction=True)
+            pipe.hget(SCHEDULE_ENTRIES_KEY, schedule_id)
+            pipe.hdel(SCHEDULE_ENTRIES_KEY, schedule_id)
+            pipe.zrem(SCHEDULED_KEY, schedule_id)
+            entry, _, _ = await asyncio.wait_for(pipe.execute(), timeout=5.0)
+        except asyncio.TimeoutError:
+            logger.error("Redis operation timed out")
+            raise HTTPException(
+                status_code=500,
+                detail="Redis operation timed out. Please try again later.",
+            )
+        if entry is None:
+            raise HTTPException(
+                status_code=404, detail=f"Schedule {schedule_id} not found"
+            )
+        logger.info(f"Cancelled schedule {schedule_id}")
+
+        task_id = serialization.loads(entry)["call"][0]
+        try:
+            return await self.cancel_task(task_id)
+        except HTTPException as e:
+            if e.status_code != 409:
+                raise
+            return await self.get_task_status(task_id)
+
+    @metrics.timed(metrics.GET_TASK_STATUS_SECONDS)
+    async def get_task_status(self, task_id: str) -> TaskStatusResponse:
+        try:
+            if self._redis is None:
+                await self.initialize()
+
+            if self._cache is not None:
+                cached = self._cache.get(task_id)
+                if cached is not None:
+                    return cached
+
+            read_started = time.monotonic()
+            task_data = await asyncio.wait_for(
+                self._read_status_fields(task_id), timeout=5.0
+            )
+            if not task_data:
+                raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+
+            status = TaskStatusResponse(
                 task_id=task_id,
                 status=TaskStatus(task_data["status"]),
                 progress=task_data["progress"],
                 message=task_data["message"],
+                seq=task_data.get("seq") or 0,
             )
+            if self._cache is not None:
+                self._cache.put(status, read_started)
+            return status
         except asyncio.TimeoutError:
             logger.error("Redis operation timed out")
             raise HTTPException(
                 status_code=500,
-                detail="Redis operation timed out. Please try again later."
+                detail="Redis operation timed out. Please try again later.",
             )
         except HTTPException:
             raise
         except Exception as e:
             logger.error(f"Failed to get task status: {str(e)}")
             raise HTTPException(
-                status_code=500,
-                detail=f"Failed to get task status: {str(e)}"
+                status_code=500, detail=f"Failed to get task status: {str(e)}"
             )
 
-    async def stream_task_status(self, task_id: str) -> AsyncGenerator[str, None]:
+    @metrics.timed(metrics.GET_TASK_STATUSES_SECONDS)
+    async def get_task_statuses(
+        self, task_ids: List[str]
+    ) -> Tuple[List[TaskStatusResponse], List[str]]:
+        """
+        Resolve many tasks, reading the uncached ones in one pipelined round
+        trip; returns (found, missing).
+        """
         try:
             if self._redis is None:
                 await self.initialize()
 
-            while True:
-                task_data = await asyncio.wait_for(
-                    self._redis.get(f"task:{task_id}"),
-                    timeout=5.0
+            statuses: Dict[str, TaskStatusResponse] = {}
+            if self._cache is not None:
+                for task_id in task_ids:
+                    cached = self._cache.get(task_id)
+                    if cached is not None:
+                        statuses[task_id] = cached
+            uncached = [task_id for task_id in task_ids if task_id not in statuses]
+
+            if uncached:
+                read_started = time.monotonic()
+                records = await asyncio.wait_for(
+                    self._read_status_fields_many(uncached), timeout=5.0
                 )
-                if not task_data:
-                    raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+                for task_id, task_data in zip(uncached, records):
+                    if task_data is None:
+                        continue
+                    status = TaskStatusResponse(
+                        task_id=task_id,
+                        status=TaskStatus(task_data["status"]),
+                        progress=task_data["progress"],
+                        message=task_data["message"],
+                        seq=task_data.get("seq") or 0,
+                    )
+                    statuses[task_id] = status
+                    if self._cache is not None:
+                        self._cache.put(status, read_started)
 
-                task_data = json.loads(task_data)
-                status = TaskStatus(task_data["status"])
+            found = [statuses[task_id] for task_id in task_ids if task_id in statuses]
+            missing = [task_id for task_id in task_ids if task_id not in statuses]
+            return found, missing
+        except asyncio.TimeoutError:
+            logger.error("Redis operation timed out")
+            raise HTTPException(
+                status_code=500,
+                detail="Redis operation timed out. Please try again later.",
+            )
+        except Exception as e:
+            logger.error(f"Failed to get task statuses: {str(e)}")
+            raise HTTPException(
+                status_code=500, detail=f"Failed to get task statuses: {str(e)}"
+            )
+
+    @metrics.timed(metrics.LIST_TASKS_SECONDS)
+    async def list_tasks(
+        self,
+        status: Optional[TaskStatus] = None,
+        name: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> TaskListResponse:
+        """
+        List the tasks with a status and/or name, newest first.
+
+        The page is read from the status or name index a batch of entries at a
+        time, with the records of each batch in one pipelined round trip. With
+        both filters the smaller index is walked and the other filter checked
+        on the records. At most ``TASK_LIST_MAX_SCAN`` index entries are read
+        per page.
+        """
+        indexes = []
+        if status is not None:
+            indexes.append(status_index_key(status))
+        if name is not None:
+            indexes.append(name_index_key(name))
+        max_score, after = self._parse_cursor(cursor) if cursor else ("+inf", "")
+        min_score = (
+            f"({timestamp(created_after)!r}" if created_after is not None else "-inf"
+        )
+        try:
+            if self._redis is None:
+                await self.initialize()
 
-                status_response = TaskStatusResponse(
-                    task_id=task_id,
-                    status=status,
-                    progress=task_data["progress"],
-                    message=task_data["message"],
+            started = time.perf_counter()
+            found, position = await asyncio.wait_for(
+                list_tasks_async(
+                    self.client,
+                    indexes,
+                    max_score,
+                    min_score,
+                    after,
+                    limit,
+                    status.value if status is not None else None,
+                    name,
+                ),
+                timeout=5.0,
+            )
+            metrics.REDIS_LIST_TASKS_SECONDS.observe(time.perf_counter() - started)
+        except asyncio.TimeoutError:
+            logger.error("Redis operation timed out")
+            raise HTTPException(
+                status_code=500,
+                detail="Redis operation timed out. Please try again later.",
+            )
+        except Exception as e:
+            logger.error(f"Failed to list tasks: {str(e)}")
+            raise HTTPException(
+                status_code=500, detail=f"Failed to list tasks: {str(e)}"
+            )
+
+        tasks = []
+        for fields in found:
+            tasks.append(
+                TaskSummary(
+                    task_id=fields["task_id"],
+                    status=TaskStatus(fields["status"]),
+                    progress=float(fields["progress"] or 0.0),
+                    message=fields["message"] or None,
+                    seq=int(fields["seq"] or 0),
+                    name=fields["name"] or None,
+                    created_at=fields["created_at"] or None,
+                    updated_at=fields["updated_at"] or None,
                 )
+            )
+        return TaskListResponse(
+            tasks=tasks,
+            next_cursor=f"{position[0]!r}:{position[1]}"
+            if position is not None
+            else None,
+        )
 
-                yield f"data: {json.dumps(status_response.dict())}\n\n"
+    @staticmethod
+    def _parse_cursor(cursor: str) -> Tuple[str, str]:
+        """The score and task ID a listing cursor points at."""
+        score, _, task_id = cursor.partition(":")
+        try:
+            float(score)
+        except ValueError:
+            task_id = ""
+        if not task_id:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return score, task_id
 
-                if status in [TaskStatus.COMPLETED, TaskStatus.FAILED]:
-                    logger.info(f"Task {task_id} finished with status {status}")
-                    break
+    async def _read_status_fields(self, task_id: str) -> Optional[Dict[str, Any]]:
+        started = time.perf_counter()
+        try:
+            values = await self.client.hmget(task_key(task_id), STATUS_FIELDS)
+            metrics.REDIS_READ_STATUS_SECONDS.observe(time.perf_counter() - started)
+        except ResponseError:
+            # Records written before the hash layout are plain JSON strings.
+            task_data = await self.client.get(task_key(task_id))
+            return serialization.loads(task_data) if task_data else None
+        if values[0] is None:
+            return None
+        return dict(zip(STATUS_FIELDS, values))
+
+    async def _read_status_fields_many(
+        self, task_ids: List[str]
+    ) -> List[Optional[Dict[str, Any]]]:
+        pipe = self.client.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hmget(task_key(task_id), STATUS_FIELDS)
+        started = time.perf_counter()
+        results = await pipe.execute(raise_on_error=False)
+        metrics.REDIS_READ_STATUSES_SECONDS.observe(time.perf_counter() - started)
+
+        records: List[Optional[Dict[str, Any]]] = []
+        for task_id, values in zip(task_ids, results):
+            if isinstance(values, ResponseError):
+                records.append(await self._read_status_fields(task_id))
+            elif values[0] is None:
+                records.append(None)
+            else:
+                records.append(dict(zip(STATUS_FIELDS, values)))
+        return records
+
+    @metrics.timed(metrics.GET_TASK_EVENTS_SECONDS)
+    async def get_task_events(
+        self, task_id: str, since: Optional[int] = None, limit: Optional[int] = None
+    ) -> TaskEventsResponse:
+        """
+        Replay the recorded status transitions of a task, oldest first.
+
+        Only events after ``since`` (a ``seq``, as sent in SSE event IDs) are
+        returned, at most ``limit`` of them.
+        """
+        try:
+            if self._redis is None:
+                await self.initialize()
+
+            count = min(
+                limit or settings.TASK_HISTORY_MAX_READ, settings.TASK_HISTORY_MAX_READ
+            )
+            pipe = self.client.pipeline(transaction=False)
+            pipe.exists(task_key(task_id))
+            pipe.xrange(history_key(task_id), min=str((since or 0) + 1), count=count)
+            started = time.perf_counter()
+            exists, entries = await asyncio.wait_for(pipe.execute(), timeout=5.0)
+            metrics.REDIS_READ_HISTORY_SECONDS.observe(time.perf_counter() - started)
+            if not exists and not entries:
+                raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+
+            events = [TaskEvent(**decode_event(*entry)) for entry in entries]
+            return TaskEventsResponse(
+                task_id=task_id,
+                events=events,
+                truncated=bool(events) and events[0].seq > (since or 0) + 1,
+            )
+        except asyncio.TimeoutError:
+            logger.error("Redis operation timed out")
+            raise HTTPException(
+                status_code=500,
+                detail="Redis operation timed out. Please try again later.",
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to get task events: {str(e)}")
+            raise HTTPException(
+                status_code=500, detail=f"Failed to get task events: {str(e)}"
+            )
+
+    async def _read_history(
+        self, task_id: str, after: int, until: int
+    ) -> List[Tuple[int, str]]:
+        """``(seq, SSE payload)`` of the recorded events, ``after < seq < until``."""
+        if settings.TASK_HISTORY_MAX_EVENTS <= 0 or until - after <= 1:
+            return []
+        started = time.perf_counter()
+        entries = await asyncio.wait_for(
+            self.client.xrange(
+                history_key(task_id),
+                min=str(after + 1),
+                max=str(until - 1),
+                count=settings.TASK_HISTORY_MAX_READ,
+            ),
+            timeout=5.0,
+        )
+        metrics.REDIS_READ_HISTORY_SECONDS.observe(time.perf_counter() - started)
+        events = [
+            decode_event(*entry)
+            for entry in cast(List[Tuple[str, Dict[str, str]]], entries)
+        ]
+        return [
+            (event["seq"], serialization.dumps({"task_id": task_id, **event}))
+            for event in events
+        ]
+
+    def reserve_stream(self) -> Optional[StreamSlot]:
+        """
+        Take a stream slot, or None if this process holds as many streams as it
+        may. The slot is counted from now on, before its stream has started.
+        """
+        if self._open_streams >= settings.TASK_STREAM_MAX_OPEN:
+            return None
+        self._open_streams += 1
+        return StreamSlot(self)
+
+    async def stream_task_status(
+        self,
+        task_id: str,
+        last_event_id: Optional[int] = None,
+        slot: Optional[StreamSlot] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream the status of a task until it finishes.
+
+        Each event carries the task's ``seq`` as its ID. A client resuming with
+        ``last_event_id`` only receives states newer than that. States skipped
+        between two pushed events, or missed while the client was away, are
+        replayed from the task's history. A keep-alive comment is sent whenever
+        ``TASK_STATUS_UPDATE_INTERVAL`` passes without a change. ``slot`` is
+        released when the stream ends.
+        """
+        subscription = None
+        metrics.OPEN_TASK_STREAMS.inc()
+        try:
+            if self._redis is None:
+                await self.initialize()
 
-                await asyncio.sleep(5.0)
+            # Subscribe before the first read so no change can slip in between.
+            subscription = await self._broadcaster.subscribe([task_id])
+            sent = last_event_id
+            events: List[Tuple[str, Optional[str]]] = [(task_id, RESYNC)]
+            while True:
+                if not events:
+                    yield HEARTBEAT
+                else:
+                    _, payload = events[-1]
+                    if payload is RESYNC:
+                        status_response = await self.get_task_status(task_id)
+                        status, seq = status_response.status, status_response.seq
+                        payload = serialization.model_dumps(status_response)
+                    else:
+                        event = serialization.loads(payload)
+                        status, seq = TaskStatus(event["status"]), event.get("seq")
+
+                    if seq is None:
+                        yield f"data: {payload}\n\n"
+                    elif sent is None or seq > sent:
+                        if sent is not None:
+                            missed = await self._read_history(task_id, sent, seq)
+                            for missed_seq, missed_payload in missed:
+                                yield f"id: {missed_seq}\ndata: {missed_payload}\n\n"
+                        yield f"id: {seq}\ndata: {payload}\n\n"
+                        sent = seq
+
+                    if status in TERMINAL_STATUSES:
+                        logger.info(f"Task {task_id} finished with status {status}")
+                        break
+
+                events = await subscription.get(settings.TASK_STATUS_UPDATE_INTERVAL)
 
         except asyncio.TimeoutError:
             logger.error("Redis operation timed out")
             raise HTTPException(
                 status_code=500,
-                detail="Redis operation timed out. Please try again later."
+                detail="Redis operation timed out. Please try again later.",
             )
         except HTTPException:
             raise
         except Exception as e:
             logger.error(f"Failed to stream task status: {str(e)}")
+            raise HTTPException(
+                status_code=500, detail=f"Failed to stream task status: {str(e)}"
+            )
+        finally:
+            if slot is not None:
+                slot.release()
+            metrics.OPEN_TASK_STREAMS.dec()
+            if subscription is not None:
+                self._broadcaster.unsubscribe(subscription)
+
+    async def stream_tasks_status(
+        self,
+        task_ids: List[str],
+        name: Optional[str] = None,
+        slot: Optional[StreamSlot] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream updates of many tasks over one connection.
+
+        With ``task_ids`` every task is reported once up front and then on each
+        change until it finishes; the stream ends once all of them have. Without
+        IDs, changes of every task (optionally only those named ``name``) are
+        streamed until the client disconnects. ``slot`` is released when the
+        stream ends.
+        """
+        subscription = None
+        metrics.OPEN_MULTI_STREAMS.inc()
+        try:
+            if self._redis is None:
+                await self.initialize()
+
+            subscription = await self._broadcaster.subscribe(task_ids, name)
+            events: List[Tuple[str, Optional[str]]] = [
+                (task_id, RESYNC) for task_id in task_ids
+            ]
+            while True:
+                resync = [task_id for task_id, payload in events if payload is RESYNC]
+                if resync:
+                    found, missing = await self.get_task_statuses(resync)
+                    for task_id in missing:
+                        self._broadcaster.unsubscribe(subscription, [task_id])
+                        missing_event = serialization.dumps({"task_id": task_id})
+                        yield f"event: missing\ndata: {missing_event}\n\n"
+                    current = {
+                        status.task_id: serialization.model_dumps(status)
+                        for status in found
+                    }
+                    events = [
+                        (
+                            task_id,
+                            current.get(task_id) if payload is RESYNC else payload,
+                        )
+                        for task_id, payload in events
+                    ]
+
+                for task_id, payload in events:
+                    if payload is None:
+                        continue
+                    if task_ids and task_id not in subscription.task_ids:
+                        continue
+                    yield f"data: {payload}\n\n"
+                    if (
+                        task_ids
+                        and serialization.loads(payload)["status"] in TERMINAL_STATUSES
+                    ):
+                        self._broadcaster.unsubscribe(subscription, [task_id])
+
+                if task_ids and not subscription.task_ids:
+                    break
+                events = await subscription.get(settings.TASK_STATUS_UPDATE_INTERVAL)
+                if not events:
+                    yield HEARTBEAT
+
+        except asyncio.TimeoutError:
+            logger.error("Redis operation timed out")
             raise HTTPException(
                 status_code=500,
-                detail=f"Failed to stream task status: {str(e)}"
+                detail="Redis operation timed out. Please try again later.",
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to stream task statuses: {str(e)}")
+            raise HTTPException(
+                status_code=500, detail=f"Failed to stream task statuses: {str(e)}"
             )
+        finally:
+            if slot is not None:
+                slot.release()
+            metrics.OPEN_MULTI_STREAMS.dec()
+            if subscription is not None:
+                self._broadcaster.unsubscribe(subscription)
+
 
 task_manager = TaskManager()
@@ -0,0 +1,213 @@
+"""
+Task workflows.
+
+A workflow is a small DAG of steps, each of them an ordinary task with a
+record, history and SSE stream of its own. Steps without dependencies are
+published when the workflow is submitted. Every other step starts as soon as
+all the steps it depends on have completed, released by the worker that ran
+the last of them, so no client or API process sits between two stages.
+
+Results of completed steps are stored once as payloads (see
+``app.tasks.payloads``) and passed by reference: a step receives the results
+of the steps it depends on in ``run.inputs``, keyed by step, and the workflow
+callback lists all of them. When a step fails, times out or is cancelled,
+the steps depending on it are cancelled instead of started.
+
+A workflow is stored under ``workflow:{id}`` and its
+``:waiting``, ``:dependents``, ``:calls``, ``:results`` and ``:done`` keys.
+Its status and progress are computed from those of its steps.
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, cast
+
+from redis import Redis
+
+from app.core import serialization
+from app.core.config import settings
+from app.models.task import TaskStatus
+from app.tasks.payloads import STORE_PAYLOAD_SCRIPT, reference, store_payload_call
+from app.tasks.status_store import TERMINAL_STATUSES, task_key, update_status
+
+logger = logging.getLogger(__name__)
+
+WORKFLOW_KEY_PREFIX = "workflow:"
+WORKFLOW_PARTS = ("waiting", "dependents", "calls", "results", "done")
+
+# KEYS: workflow, waiting, dependents, results, done
+# ARGV: step key, step status, result reference (JSON, empty unless COMPLETED), TTL
+# Records a finished step once, counting down the steps that depend on it.
+# Returns {finished steps, total steps, released step keys, skipped step keys},
+# or nil if the step was already recorded or the workflow has expired. A
+# skipped step's count is pushed far below zero so it is never released.
+ADVANCE_WORKFLOW_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 or redis.call('SADD', KEYS[5], ARGV[1]) == 0 then
+    return false
+end
+local ttl = tonumber(ARGV[4])
+if ARGV[3] ~= '' then
+    redis.call('HSET', KEYS[4], ARGV[1], ARGV[3])
+end
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[5], ttl)
+    redis.call('EXPIRE', KEYS[4], ttl)
+end
+local released, skipped = {}, {}
+local dependents = redis.call('HGET', KEYS[3], ARGV[1]) or ''
+for dependent in string.gmatch(dependents, '[^,]+') do
+    if ARGV[2] == 'COMPLETED' then
+        if redis.call('HINCRBY', KEYS[2], dependent, -1) == 0 then
+            table.insert(released, dependent)
+        end
+    elseif tonumber(redis.call('HGET', KEYS[2], dependent) or '0') > 0 then
+        redis.call('HSET', KEYS[2], dependent, -1000000)
+        table.insert(skipped, dependent)
+    end
+end
+local total = tonumber(redis.call('HGET', KEYS[1], 'total'))
+return {redis.call('SCARD', KEYS[5]), total, released, skipped}
+"""
+
+Publish = Callable[[List[Any], Dict[str, Any]], None]
+Deliver = Callable[[str, Dict[str, Any]], None]
+
+
+def workflow_key(workflow_id: str, part: Optional[str] = None) -> str:
+    key = f"{WORKFLOW_KEY_PREFIX}{workflow_id}"
+    return f"{key}:{part}" if part else key
+
+
+def workflow_arg(workflow_id: str, step: str) -> Dict[str, Any]:
+    """The ``workflow`` argument of a step's ``execute_task`` call, without inputs."""
+    return {"id": workflow_id, "step": step, "inputs": {}}
+
+
+def aggregate_status(statuses: Iterable[str]) -> TaskStatus:
+    """A workflow's status from those of its steps."""
+    statuses = [TaskStatus(status) for status in statuses]
+    if all(status in TERMINAL_STATUSES for status in statuses):
+        if any(
+            status in (TaskStatus.FAILED, TaskStatus.TIMED_OUT) for status in statuses
+        ):
+            return TaskStatus.FAILED
+        if TaskStatus.CANCELLED in statuses:
+            return TaskStatus.CANCELLED
+        return TaskStatus.COMPLETED
+    if all(status == TaskStatus.PENDING for status in statuses):
+        return TaskStatus.PENDING
+    return TaskStatus.RUNNING
+
+
+def advance_workflow(
+    redis: Redis,
+    workflow: Dict[str, Any],
+    outcome: Dict[str, Any],
+    publish: Publish,
+    deliver: Deliver,
+) -> None:
+    """
+    Record the outcome (a ``TaskResult``) of a finished step, start the steps
+    it released, cancel those it leaves unrunnable and, once every step has
+    finished, deliver the workflow callback.
+    """
+    workflow_id = workflow["id"]
+    advance = redis.register_script(ADVANCE_WORKFLOW_SCRIPT)
+    store_payload = redis.register_script(STORE_PAYLOAD_SCRIPT)
+    keys = [workflow_key(workflow_id)] + [
+        workflow_key(workflow_id, part)
+        for part in ("waiting", "dependents", "results", "done")
+    ]
+    result = (outcome.get("result") or {}).get("result_data")
+    finished: List[Tuple[str, str, Any]] = [
+        (workflow["step"], outcome["status"], result)
+    ]
+    while finished:
+        step, status, result = finished.pop()
+        ref = ""
+        if status == TaskStatus.COMPLETED:
+            result_ref, payload = reference(result)
+            store_payload(**store_payload_call(*payload))
+            ref = serialization.dumps(result_ref)
+        recorded = advance(
+            keys=keys, args=[step, status, ref, settings.TASK_ACTIVE_TTL_SECONDS]
+        )
+        if not recorded:
+            continue
+        done, total, released, skipped = recorded
+        if released:
+            for failed in _release(redis, workflow_id, released, publish):
+                finished.append((failed, TaskStatus.FAILED.value, None))
+        for dependent in skipped:
+            entry = serialization.loads(
+                cast(str, redis.hget(workflow_key(workflow_id, "calls"), dependent))
+            )
+            update_status(
+                redis,
+                entry["call"][0],
+                TaskStatus.CANCELLED,
+                0.0,
+                f"Skipped: step {step} ended as {status}",
+            )
+            finished.append((dependent, TaskStatus.CANCELLED.value, None))
+        if done == total:
+            _finish(redis, workflow_id, deliver)
+
+
+def _release(
+    redis: Redis, workflow_id: str, steps: List[str], publish: Publish
+) -> List[str]:
+    """Publish released steps with their inputs; returns the steps that could not be."""
+    pipe = redis.pipeline(transaction=False)
+    pipe.hmget(workflow_key(workflow_id, "calls"), steps)
+    pipe.hgetall(workflow_key(workflow_id, "results"))
+    entries, results = pipe.execute()
+    failed = []
+    for step, raw in zip(steps, entries):
+        entry = serialization.loads(raw)
+        call = entry["call"]
+        call[5]["inputs"] = {
+            dependency: serialization.loads(results[dependency])
+            for dependency in entry["depends_on"]
+        }
+        if entry.get("timeout"):
+            call[4] = time.time() + entry["timeout"]
+        try:
+            publish(call, entry["options"])
+        except Exception as e:
+            logger.error(
+                f"Failed to start step {step} of workflow {workflow_id}: {str(e)}"
+            )
+            update_status(
+                redis,
+                call[0],
+                TaskStatus.FAILED,
+                0.0,
+                f"Failed to create Celery task: {str(e)}",
+            )
+            failed.append(step)
+    return failed
+
+
+def _finish(redis: Redis, workflow_id: str, deliver: Deliver) -> None:
+    workflow = cast(Dict[str, str], redis.hgetall(workflow_key(workflow_id)))
+    steps = serialization.loads(workflow["steps"])
+    pipe = redis.pipeline(transaction=False)
+    for task_id in steps.values():
+        pipe.hget(task_key(task_id), "status")
+    pipe.hgetall(workflow_key(workflow_id, "results"))
+    *statuses, results = pipe.execute()
+    status = aggregate_status(status or TaskStatus.CANCELLED for status in statuses)
+    logger.info(f"Workflow {workflow_id} finished with status {status.value}")
+    if workflow.get("callback_url"):
+        deliver(
+            workflow["callback_url"],
+            {
+                "workflow_id": workflow_id,
+                "status": status.value,
+                "results": {
+                    step: serialization.loads(ref) for step, ref in results.items()
+                },
+                "completed_at": datetime.utcnow().isoformat(),
+            },
+        )
@@ -1,24 +1,9 @@
-from celery import Celery
-from app.core.config import settings
+"""
+Celery entry point: ``celery -A app.worker <command>``.
 
-celery_app = Celery(
-    "tasks",
-    broker=f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/0",
-    backend=f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/0",
-)
+The app is defined once, with its tasks, in ``app.tasks.celery_tasks``.
+"""
+from app.tasks.celery_tasks import celery as celery_app
+from app.tasks.celery_tasks import execute_task, send_callback, update_task_status
 
-celery_app.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
-    timezone="UTC",
-    enable_utc=True,
-    task_track_started=True,
-    task_time_limit=3600,
-    worker_prefetch_multiplier=1,
-    task_acks_late=True,
-    task_reject_on_worker_lost=True,
-    task_default_queue="default",
-)
-
-from app.tasks.celery_tasks import execute_task, update_task_status, send_callback 
\ No newline at end of file
+__all__ = ["celery_app", "execute_task", "update_task_status", "send_callback"]
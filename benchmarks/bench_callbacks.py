@@ -0,0 +1,87 @@
+"""
+Callback delivery throughput against a local stub receiver.
+
+Compares one worker process POSTing callbacks one at a time (a new connection
+per request, then a keep-alive session) with the asyncio dispatcher. The
+dispatcher runs against fakeredis, so the numbers measure delivery overhead
+rather than Redis latency.
+
+    python -m benchmarks.bench_callbacks --count 2000 --latency 0.02
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict
+
+import fakeredis.aioredis
+import requests
+
+from app.tasks.callbacks import PENDING_KEY, CallbackDispatcher, new_callback_entry
+from app.tasks.connections import create_http_session
+from benchmarks.stub_server import stub_server
+
+PAYLOAD = {"task_id": "bench", "status": "COMPLETED", "result": {"value": 1}}
+
+
+def bench_sequential(url: str, count: int, session: Any) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        session.post(url, json=PAYLOAD, timeout=10).raise_for_status()
+    return time.perf_counter() - start
+
+
+async def bench_dispatcher(url: str, count: int, **options: Any) -> float:
+    redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await redis.rpush(
+        PENDING_KEY, *[new_callback_entry(url, PAYLOAD) for _ in range(count)]
+    )
+    async with CallbackDispatcher(redis, **options) as dispatcher:
+        start = time.perf_counter()
+        while dispatcher.delivered < count:
+            if not await dispatcher.dispatch_once():
+                await asyncio.sleep(0.001)
+        return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, float]] = {}
+    with stub_server(args.latency) as base_url:
+        url = f"{base_url}/callback"
+        scenarios = {
+            "sequential_new_connection": lambda n: bench_sequential(url, n, requests),
+            "sequential_keepalive_session": lambda n: bench_sequential(
+                url, n, create_http_session()
+            ),
+            "dispatcher_per_host_20": lambda n: asyncio.run(
+                bench_dispatcher(url, n, max_per_host=20)
+            ),
+            "dispatcher_per_host_100": lambda n: asyncio.run(
+                bench_dispatcher(url, n, max_per_host=100)
+            ),
+            "dispatcher_per_host_20_batch_10": lambda n: asyncio.run(
+                bench_dispatcher(url, n, max_per_host=20, batch_size=10)
+            ),
+        }
+        for name, run in scenarios.items():
+            # Sequential delivery is bounded by latency; a smaller sample is enough.
+            count = (
+                args.count if name.startswith("dispatcher") else min(args.count, 200)
+            )
+            elapsed = run(count)
+            results[name] = {
+                "callbacks": count,
+                "seconds": round(elapsed, 3),
+                "callbacks_per_second": round(count / elapsed, 1),
+            }
+
+    print(json.dumps({"latency": args.latency, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,508 @@
+"""
+End-to-end benchmarks of the API and the worker pipeline.
+
+The FastAPI app runs in-process against fakeredis (or a local Redis with
+``--redis-url``) and Celery publishes to an in-memory broker. Queued messages
+are executed in this process, like a single solo worker would. Callbacks go
+through the dispatcher to the local stub receiver. Tasks run a zero-sleep
+workload unless ``--step-seconds`` is given, so the numbers measure framework
+overhead. One JSON document is printed with:
+
+- ``submissions``: POST /api/tasks and /api/tasks/batch throughput
+- ``state_latency``: GET /api/tasks/{id}/state latency with and without the
+  status cache
+- ``pipeline``: completed tasks per second and Redis commands per task for each
+  stage (API, worker, callback dispatcher)
+- ``sse_streams``: status streams held open by one uvicorn server, and how
+  long one update takes to reach all of them
+
+    python -m benchmarks.bench_pipeline --tasks 500 --streams 100,500,1000
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import socket
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import aiohttp
+import fakeredis
+import fakeredis.aioredis
+import httpx
+import redis.asyncio as aioredis
+import redis.asyncio.client
+import redis.client
+import uvicorn
+from redis import ConnectionPool
+
+from app.core.config import settings
+from app.main import app
+from app.models.task import TaskStatus
+from app.tasks import connections
+from app.tasks.cache import StatusCache
+from app.tasks.callbacks import PENDING_KEY, CallbackDispatcher
+from app.tasks.celery_tasks import celery
+from app.tasks.queues import WORKER_POOLS
+from app.tasks.status_store import task_key, update_status
+from app.tasks.task_manager import TaskManager
+from benchmarks.stub_server import stub_server
+
+TASK_NAME = "bench_task"
+
+
+class RedisCommandCounter:
+    """Counts the commands sent by every redis-py client, including pipelined ones."""
+
+    def __init__(self) -> None:
+        self.commands: Counter = Counter()
+
+    @contextmanager
+    def installed(self) -> Iterator["RedisCommandCounter"]:
+        counter = self.commands
+        originals = {}
+
+        def patch(cls: Any, name: str, wrapper: Any) -> None:
+            originals[(cls, name)] = getattr(cls, name)
+            setattr(cls, name, wrapper(getattr(cls, name)))
+
+        def count_command(original: Any) -> Any:
+            def execute_command(client: Any, *args: Any, **options: Any) -> Any:
+                counter[str(args[0]).upper()] += 1
+                return original(client, *args, **options)
+
+            return execute_command
+
+        def count_async_command(original: Any) -> Any:
+            async def execute_command(client: Any, *args: Any, **options: Any) -> Any:
+                counter[str(args[0]).upper()] += 1
+                return await original(client, *args, **options)
+
+            return execute_command
+
+        def count_pipeline(original: Any) -> Any:
+            def execute(pipe: Any, *args: Any, **kwargs: Any) -> Any:
+                for command_args, _ in pipe.command_stack:
+                    counter[str(command_args[0]).upper()] += 1
+                return original(pipe, *args, **kwargs)
+
+            return execute
+
+        def count_async_pipeline(original: Any) -> Any:
+            async def execute(pipe: Any, *args: Any, **kwargs: Any) -> Any:
+                for command in pipe.command_stack:
+                    counter[str(command[0][0]).upper()] += 1
+                return await original(pipe, *args, **kwargs)
+
+            return execute
+
+        # Pipelines override execute_command to queue commands, so these only
+        # see commands sent on their own.
+        patch(redis.client.Redis, "execute_command", count_command)
+        patch(redis.asyncio.client.Redis, "execute_command", count_async_command)
+        patch(redis.client.Pipeline, "execute", count_pipeline)
+        patch(redis.asyncio.client.Pipeline, "execute", count_async_pipeline)
+        try:
+            yield self
+        finally:
+            for (cls, name), original in originals.items():
+                setattr(cls, name, original)
+
+    def take(self) -> Counter:
+        commands = Counter(self.commands)
+        self.commands.clear()
+        return commands
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def pick(fraction: float) -> float:
+        return round(
+            ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3
+        )
+
+    return {
+        "p50_ms": pick(0.5),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": pick(1.0),
+    }
+
+
+def per_task(commands: Counter, tasks: int) -> Dict[str, Any]:
+    return {
+        "commands_per_task": round(sum(commands.values()) / tasks, 2),
+        "by_command": {
+            name: round(count / tasks, 2) for name, count in commands.most_common()
+        },
+    }
+
+
+def task_body(callback_url: str) -> Dict[str, Any]:
+    return {"name": TASK_NAME, "parameters": {"value": 1}, "callback_url": callback_url}
+
+
+def configure(args: argparse.Namespace) -> aioredis.Redis:
+    """Point the API, the workers and Celery at the benchmark backends."""
+    settings.TASK_WORKLOAD_MIN_STEPS = settings.TASK_WORKLOAD_MAX_STEPS = args.steps
+    settings.TASK_WORKLOAD_MIN_STEP_SECONDS = args.step_seconds
+    settings.TASK_WORKLOAD_MAX_STEP_SECONDS = args.step_seconds
+    settings.CALLBACK_DELIVERY = "dispatcher"
+    celery.conf.update(broker_url="memory://", result_backend="cache+memory://")
+
+    if args.redis_url:
+        connections._redis_pool = ConnectionPool.from_url(
+            args.redis_url, decode_responses=True
+        )
+        pool = connections.create_async_redis_pool(
+            **aioredis.ConnectionPool.from_url(args.redis_url).connection_kwargs
+        )
+    else:
+        server = fakeredis.FakeServer()
+        connections._redis_pool = fakeredis.FakeRedis(
+            server=server, decode_responses=True
+        ).connection_pool
+        fake_pool = fakeredis.aioredis.FakeRedis(
+            server=server, decode_responses=True
+        ).connection_pool
+        pool = connections.create_async_redis_pool(
+            connection_class=fake_pool.connection_class, **fake_pool.connection_kwargs
+        )
+    # Same pool limits as the API uses in production.
+    client = aioredis.Redis(connection_pool=pool)
+
+    tm = TaskManager()
+    tm._redis = client
+    tm._broadcaster.bind(client)
+    return client
+
+
+def set_status_cache(enabled: bool) -> Optional[StatusCache]:
+    tm = TaskManager()
+    tm._cache = StatusCache.from_settings() if enabled else None
+    if tm._cache is not None:
+        tm._broadcaster.add_hook(tm._cache.invalidate)
+        tm._broadcaster.start()
+    return tm._cache
+
+
+def run_queued_tasks() -> int:
+    """
+    Execute every queued Celery message in this process, like one solo worker
+    consuming all queues. Returns the number of tasks executed.
+    """
+    executed = 0
+    queue_names = {name for pool in WORKER_POOLS.values() for name in pool}
+    with celery.connection_for_read() as connection:
+        queues = [connection.SimpleQueue(name, no_ack=True) for name in queue_names]
+        try:
+            idle = False
+            while not idle:
+                idle = True
+                for queue in queues:
+                    try:
+                        message = queue.get(block=False)
+                    except queue.Empty:
+                        continue
+                    idle = False
+                    args, kwargs, _ = message.payload
+                    celery.tasks[message.headers["task"]].apply(args, kwargs)
+                    if message.headers["task"] == "execute_task":
+                        executed += 1
+        finally:
+            for queue in queues:
+                queue.close()
+    return executed
+
+
+async def submit(
+    client: httpx.AsyncClient, count: int, concurrency: int, callback_url: str
+) -> List[str]:
+    task_ids: List[str] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            response = await client.post("/api/tasks", json=task_body(callback_url))
+            response.raise_for_status()
+            task_ids.append(response.json()["task_id"])
+
+    await asyncio.gather(*(one() for _ in range(count)))
+    return task_ids
+
+
+async def bench_submissions(
+    args: argparse.Namespace, counter: RedisCommandCounter, callback_url: str
+) -> Dict[str, Any]:
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        counter.take()
+        start = time.perf_counter()
+        await submit(client, args.tasks, args.concurrency, callback_url)
+        single = time.perf_counter() - start
+        single_commands = counter.take()
+
+        start = time.perf_counter()
+        response = await client.post(
+            "/api/tasks/batch",
+            json={"tasks": [task_body(callback_url) for _ in range(args.tasks)]},
+        )
+        response.raise_for_status()
+        batch = time.perf_counter() - start
+        batch_commands = counter.take()
+
+    run_queued_tasks()
+    return {
+        "single": {
+            "tasks": args.tasks,
+            "concurrency": args.concurrency,
+            "tasks_per_second": round(args.tasks / single, 1),
+            **per_task(single_commands, args.tasks),
+        },
+        "batch": {
+            "tasks": args.tasks,
+            "tasks_per_second": round(args.tasks / batch, 1),
+            **per_task(batch_commands, args.tasks),
+        },
+    }
+
+
+async def bench_state_latency(
+    args: argparse.Namespace, callback_url: str
+) -> Dict[str, Any]:
+    results = {}
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        task_ids = await submit(client, args.tasks, args.concurrency, callback_url)
+        run_queued_tasks()
+        for cache_enabled in (False, True):
+            cache = set_status_cache(cache_enabled)
+            semaphore = asyncio.Semaphore(args.concurrency)
+            latencies: List[float] = []
+
+            async def one(task_id: str) -> None:
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.get(f"/api/tasks/{task_id}/state")
+                    latencies.append(time.perf_counter() - start)
+                    response.raise_for_status()
+
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(one(random.choice(task_ids)) for _ in range(args.requests))
+            )
+            elapsed = time.perf_counter() - start
+            results["cached" if cache_enabled else "uncached"] = {
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "requests_per_second": round(args.requests / elapsed, 1),
+                **percentiles(latencies),
+                **({"cache": cache.stats()} if cache is not None else {}),
+            }
+    return results
+
+
+async def bench_pipeline(
+    args: argparse.Namespace,
+    redis: aioredis.Redis,
+    counter: RedisCommandCounter,
+    callback_url: str,
+) -> Dict[str, Any]:
+    await redis.delete(PENDING_KEY)
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        counter.take()
+        start = time.perf_counter()
+        await submit(client, args.tasks, args.concurrency, callback_url)
+        submitted = time.perf_counter()
+        api_commands = counter.take()
+
+    executed = await asyncio.to_thread(run_queued_tasks)
+    finished = time.perf_counter()
+    worker_commands = counter.take()
+
+    async with CallbackDispatcher(redis) as dispatcher:
+        while dispatcher.delivered + dispatcher.dead_lettered < executed:
+            if not await dispatcher.dispatch_once():
+                await asyncio.sleep(0.001)
+    delivered = time.perf_counter()
+    callback_commands = counter.take()
+
+    return {
+        "tasks": args.tasks,
+        "executed": executed,
+        "steps_per_task": args.steps,
+        "step_seconds": args.step_seconds,
+        "tasks_per_second": round(args.tasks / (delivered - start), 1),
+        "stage_seconds": {
+            "api": round(submitted - start, 3),
+            "worker": round(finished - submitted, 3),
+            "callbacks": round(delivered - finished, 3),
+        },
+        "redis": {
+            **per_task(api_commands + worker_commands + callback_commands, args.tasks),
+            "api": per_task(api_commands, args.tasks),
+            "worker": per_task(worker_commands, args.tasks),
+            "callbacks": per_task(callback_commands, args.tasks),
+        },
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def bench_sse_streams(
+    args: argparse.Namespace, redis: aioredis.Redis
+) -> List[Dict[str, Any]]:
+    """
+    Open ``level`` streams against a uvicorn server in this process, then
+    update every watched task once and measure how long the update takes to
+    reach its stream. Client and server share the process, so the numbers are
+    a lower bound for a dedicated API process.
+    """
+    port = _free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"
+        )
+    )
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    worker_redis = connections.get_redis_connection()
+    results = []
+    try:
+        for level in args.streams:
+            task_ids = [f"bench-sse-{level}-{index}" for index in range(level)]
+            pipe = redis.pipeline(transaction=False)
+            for task_id in task_ids:
+                pipe.hset(
+                    task_key(task_id),
+                    mapping={
+                        "task_id": task_id,
+                        "name": TASK_NAME,
+                        "status": "RUNNING",
+                        "progress": "0.0",
+                        "message": "",
+                    },
+                )
+            await pipe.execute()
+
+            connector = aiohttp.TCPConnector(limit=0)
+            timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+            async with aiohttp.ClientSession(
+                connector=connector, timeout=timeout
+            ) as session:
+                opened = asyncio.Event()
+                received: Dict[str, float] = {}
+                ready = 0
+                failures = 0
+
+                async def follow(task_id: str) -> None:
+                    nonlocal ready, failures
+                    try:
+                        async with session.get(
+                            f"http://127.0.0.1:{port}/api/tasks/{task_id}"
+                        ) as response:
+                            frames = 0
+                            async for line in response.content:
+                                if not line.startswith(b"data: "):
+                                    continue
+                                frames += 1
+                                if frames == 1:
+                                    ready += 1
+                                    if ready == level - failures:
+                                        opened.set()
+                                elif frames == 2:
+                                    received[task_id] = time.perf_counter()
+                    except (aiohttp.ClientError, asyncio.TimeoutError):
+                        failures += 1
+                        if ready == level - failures:
+                            opened.set()
+
+                start = time.perf_counter()
+                followers = [
+                    asyncio.create_task(follow(task_id)) for task_id in task_ids
+                ]
+                await asyncio.wait_for(opened.wait(), timeout=120)
+                open_seconds = time.perf_counter() - start
+                rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+                sent: Dict[str, float] = {}
+
+                def finish_tasks() -> None:
+                    for task_id in task_ids:
+                        sent[task_id] = time.perf_counter()
+                        update_status(
+                            worker_redis, task_id, TaskStatus.COMPLETED, 1.0, "Done"
+                        )
+
+                # Published from a thread, like a worker, so the server loop runs on.
+                await asyncio.to_thread(finish_tasks)
+                await asyncio.wait_for(asyncio.gather(*followers), timeout=120)
+
+            results.append(
+                {
+                    "streams": level,
+                    "failed": failures,
+                    "open_seconds": round(open_seconds, 3),
+                    "max_rss_mb": round(rss_kb / 1024, 1),
+                    "fanout": percentiles(
+                        [received[task_id] - sent[task_id] for task_id in received]
+                    ),
+                }
+            )
+    finally:
+        server.should_exit = True
+        await serving
+    return results
+
+
+async def run(args: argparse.Namespace, callback_url: str) -> Dict[str, Any]:
+    redis = configure(args)
+    counter = RedisCommandCounter()
+    with counter.installed():
+        results: Dict[str, Any] = {
+            "backend": "redis" if args.redis_url else "fakeredis",
+            "submissions": await bench_submissions(args, counter, callback_url),
+            "state_latency": await bench_state_latency(args, callback_url),
+        }
+        set_status_cache(settings.TASK_STATUS_CACHE_ENABLED)
+        results["pipeline"] = await bench_pipeline(args, redis, counter, callback_url)
+    results["sse_streams"] = await bench_sse_streams(args, redis)
+    await TaskManager()._broadcaster.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument(
+        "--streams",
+        type=lambda v: [int(n) for n in v.split(",")],
+        default=[100, 500, 1000],
+    )
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--step-seconds", type=float, default=0.0)
+    parser.add_argument("--callback-latency", type=float, default=0.0)
+    parser.add_argument("--redis-url", help="use this Redis instead of fakeredis")
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    with stub_server(args.callback_latency) as base_url:
+        results = asyncio.run(run(args, f"{base_url}/callback"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Queueing latency of short jobs, with and without a backlog of long jobs.
+
+Tasks are published through the real routing (``TaskManager._publish_tasks``)
+to Celery's in-memory broker and consumed by worker threads that sleep for the
+job's duration instead of running ``execute_task``. Two layouts with the same
+number of workers are compared:
+
+- ``shared``: every task on the default queue, consumed by all workers
+- ``routed``: short jobs on the ``short`` queue and long jobs on the ``long``
+  queue, each consumed by half of the workers
+
+    python -m benchmarks.bench_queues --workers 4 --long-jobs 200
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+from app.models.task import TaskCreate, TaskQueue
+from app.tasks.celery_tasks import celery
+from app.tasks.task_manager import TaskManager
+from benchmarks.bench_pipeline import percentiles
+
+
+class Worker(threading.Thread):
+    """Consumes queues in order, a message at a time, like a worker with prefetch 1."""
+
+    def __init__(
+        self, queue_names: List[str], started: Dict[str, float], stop: threading.Event
+    ):
+        super().__init__(daemon=True)
+        self.queue_names = queue_names
+        self.started = started
+        self.stop = stop
+
+    def run(self) -> None:
+        with celery.connection_for_read() as connection:
+            queues = [
+                connection.SimpleQueue(name, no_ack=True) for name in self.queue_names
+            ]
+            while not self.stop.is_set():
+                for queue in queues:
+                    try:
+                        message = queue.get(block=False)
+                    except queue.Empty:
+                        continue
+                    task_id, _, parameters, _ = message.payload[0]
+                    self.started[task_id] = time.perf_counter()
+                    time.sleep(parameters["duration"])
+                    break
+                else:
+                    time.sleep(0.001)
+            for queue in queues:
+                queue.close()
+
+
+def publish(queue: TaskQueue, duration: float, published: Dict[str, float]) -> str:
+    task_id = str(uuid.uuid4())
+    task = TaskCreate(
+        name="bench_task",
+        parameters={"duration": duration},
+        callback_url="http://127.0.0.1/callback",
+        queue=queue,
+    )
+    published[task_id] = time.perf_counter()
+    failures = TaskManager._publish_tasks([task_id], [task], [task.parameters])
+    if failures:
+        raise RuntimeError(failures[0])
+    return task_id
+
+
+def run_scenario(
+    args: argparse.Namespace, routed: bool, long_jobs: int
+) -> Dict[str, Any]:
+    published: Dict[str, float] = {}
+    started: Dict[str, float] = {}
+    stop = threading.Event()
+    if routed:
+        half = args.workers // 2
+        layout = [[TaskQueue.LONG.value]] * half
+        layout += [[TaskQueue.SHORT.value]] * (args.workers - half)
+        short_queue, long_queue = TaskQueue.SHORT, TaskQueue.LONG
+    else:
+        layout = [[TaskQueue.DEFAULT.value]] * args.workers
+        short_queue = long_queue = TaskQueue.DEFAULT
+
+    for _ in range(long_jobs):
+        publish(long_queue, args.long_duration, published)
+    workers = [Worker(queue_names, started, stop) for queue_names in layout]
+    for worker in workers:
+        worker.start()
+
+    short_ids = []
+    for _ in range(args.short_jobs):
+        short_ids.append(publish(short_queue, args.short_duration, published))
+        time.sleep(args.short_interval)
+
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline and not all(t in started for t in short_ids):
+        time.sleep(0.01)
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    waits = [started[t] - published[t] for t in short_ids if t in started]
+    return {
+        "short_jobs": len(short_ids),
+        "short_jobs_started": len(waits),
+        "short_wait": percentiles(waits),
+    }
+
+
+def drain_queues() -> None:
+    with celery.connection_for_write() as connection:
+        for queue in TaskQueue:
+            connection.SimpleQueue(queue.value).clear()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--long-jobs", type=int, default=200)
+    parser.add_argument("--long-duration", type=float, default=0.1)
+    parser.add_argument("--short-jobs", type=int, default=200)
+    parser.add_argument("--short-duration", type=float, default=0.005)
+    parser.add_argument("--short-interval", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    celery.conf.update(broker_url="memory://", result_backend="cache+memory://")
+    results: Dict[str, Any] = {}
+    for layout in ("shared", "routed"):
+        results[layout] = {}
+        for backlog in (0, args.long_jobs):
+            drain_queues()
+            scenario = "with_backlog" if backlog else "no_backlog"
+            results[layout][scenario] = run_scenario(args, layout == "routed", backlog)
+    print(
+        json.dumps(
+            {"workers": args.workers, "long_jobs": args.long_jobs, **results}, indent=2
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+CPU cost of serialization on the hot paths, per codec.
+
+Each codec in ``SERIALIZER`` (``json`` is the standard library, which is what
+the API used before the serialization layer) is measured on:
+
+- ``record``: encoding and decoding a task record hash
+- ``celery_message``: encoding and decoding an ``execute_task`` message body
+- ``state_request``: CPU time per GET /api/tasks/{id}/state, status cache off
+- ``sse_frame``: CPU time per frame of a multi-task SSE stream, driven by
+  status events like the ones the workers publish
+
+The API runs in-process against fakeredis, so the request numbers include the
+framework and client overhead that a codec cannot remove.
+
+    python -m benchmarks.bench_serialization --requests 2000 --frames 20000
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Callable, Dict
+
+import fakeredis.aioredis
+import httpx
+from kombu.serialization import dumps as kombu_dumps
+from kombu.serialization import loads as kombu_loads
+from kombu.serialization import prepare_accept_content
+
+from app.core import serialization
+from app.core.config import settings
+from app.main import app
+from app.tasks.status_store import decode_record, encode_record, task_key
+from app.tasks.task_manager import TaskManager
+
+CODECS = ("json", "orjson", "msgpack")
+
+RECORD = {
+    "task_id": "5f0c1f7e-1d6a-4a53-9d85-0a7c9a4bbd1c",
+    "name": "resize_images",
+    "parameters": {
+        "bucket": "uploads",
+        "keys": [f"images/{i:05d}.jpg" for i in range(20)],
+        "sizes": [[64, 64], [256, 256], [1024, 768]],
+        "quality": 0.85,
+        "overwrite": False,
+    },
+    "callback_url": "http://example.com/callback",
+    "status": "PENDING",
+    "progress": 0.0,
+    "message": "Task created",
+    "created_at": "2026-01-01T00:00:00",
+    "queue": "default",
+}
+
+
+def cpu_per_op(operation: Callable[[], Any], count: int) -> float:
+    """Microseconds of process CPU time per call."""
+    started = time.process_time()
+    for _ in range(count):
+        operation()
+    return round((time.process_time() - started) / count * 1e6, 2)
+
+
+def record_cost(count: int) -> float:
+    return cpu_per_op(lambda: decode_record(encode_record(RECORD)), count)
+
+
+def celery_message_cost(count: int) -> float:
+    body = (
+        (
+            RECORD["task_id"],
+            RECORD["name"],
+            RECORD["parameters"],
+            RECORD["callback_url"],
+            None,
+        ),
+        {},
+        {"callbacks": None, "errbacks": None, "chain": None, "chord": None},
+    )
+    serializer = serialization.celery_serializer()
+    accept = prepare_accept_content(serialization.celery_accept_content())
+
+    def round_trip() -> None:
+        content_type, encoding, payload = kombu_dumps(body, serializer=serializer)
+        kombu_loads(payload, content_type, encoding, accept=accept)
+
+    return cpu_per_op(round_trip, count)
+
+
+async def state_request_cost(client: httpx.AsyncClient, count: int) -> float:
+    await client.get(f"/api/tasks/{RECORD['task_id']}/state")
+    started = time.process_time()
+    for _ in range(count):
+        response = await client.get(f"/api/tasks/{RECORD['task_id']}/state")
+        response.raise_for_status()
+    return round((time.process_time() - started) / count * 1e6, 2)
+
+
+async def sse_frame_cost(tm: TaskManager, count: int, tasks: int) -> float:
+    task_ids = [f"sse-{i}" for i in range(tasks)]
+    for task_id in task_ids:
+        await tm._redis.hset(
+            task_key(task_id),
+            mapping=encode_record({**RECORD, "task_id": task_id, "status": "RUNNING"}),
+        )
+    # Payloads as the status script publishes them (cjson, compact).
+    events = {
+        task_id: json.dumps(
+            {
+                "task_id": task_id,
+                "name": RECORD["name"],
+                "status": "RUNNING",
+                "progress": 0.5,
+                "message": "Processing step 5/10 (50.0%)",
+            },
+            separators=(",", ":"),
+        )
+        for task_id in task_ids
+    }
+
+    stream = tm.stream_tasks_status(task_ids)
+    for _ in task_ids:
+        await stream.__anext__()
+    rounds = max(1, count // tasks)
+    started = time.process_time()
+    for _ in range(rounds):
+        for task_id, payload in events.items():
+            tm._broadcaster._dispatch(task_id, payload)
+        for _ in task_ids:
+            await stream.__anext__()
+    elapsed = time.process_time() - started
+    await stream.aclose()
+    return round(elapsed / (rounds * tasks) * 1e6, 2)
+
+
+async def measure(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    tm = TaskManager()
+    tm._redis = redis
+    tm._cache = None
+    tm._broadcaster.bind(redis)
+    await redis.hset(task_key(RECORD["task_id"]), mapping=encode_record(RECORD))
+
+    # Codecs take turns so drift over the run does not favour one of them;
+    # the best round of each is reported.
+    results: Dict[str, Dict[str, float]] = {codec: {} for codec in CODECS}
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        for _ in range(args.rounds):
+            for codec in CODECS:
+                settings.SERIALIZER = codec
+                costs = {
+                    "record_us": record_cost(args.operations),
+                    "celery_message_us": celery_message_cost(args.operations),
+                    "state_request_us": await state_request_cost(client, args.requests),
+                    "sse_frame_us": await sse_frame_cost(
+                        tm, args.frames, args.sse_tasks
+                    ),
+                }
+                for metric, cost in costs.items():
+                    results[codec][metric] = min(cost, results[codec].get(metric, cost))
+    await tm._broadcaster.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--operations", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--sse-tasks", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(measure(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
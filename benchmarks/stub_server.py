@@ -0,0 +1,46 @@
+"""Local stand-in for callback receivers, run in a separate process."""
+import asyncio
+import multiprocessing
+import socket
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from aiohttp import web
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve(port: int, latency: float) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        await request.read()
+        if latency:
+            await asyncio.sleep(latency)
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_post("/{tail:.*}", handler)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+@contextmanager
+def stub_server(latency: float = 0.0) -> Iterator[str]:
+    """Run a callback receiver that answers every POST after ``latency`` seconds."""
+    port = _free_port()
+    process = multiprocessing.Process(target=_serve, args=(port, latency), daemon=True)
+    process.start()
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.join()
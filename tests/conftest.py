@@ -0,0 +1,26 @@
+from unittest.mock import MagicMock, patch
+
+import fakeredis.aioredis
+import pytest
+
+from app.tasks.cache import StatusCache
+from app.tasks.task_manager import TaskManager, execute_task
+
+
+@pytest.fixture
+def fake_redis():
+    redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    tm = TaskManager()
+    tm._redis = redis
+    tm._cache = StatusCache(max_entries=100, max_bytes=1 << 20, ttl=5.0)
+    yield redis
+    tm._redis = None
+    del tm._cache
+
+
+@pytest.fixture
+def mock_publish():
+    with patch.object(
+        execute_task.app, "producer_or_acquire", MagicMock()
+    ), patch.object(execute_task, "apply_async") as apply_async:
+        yield apply_async
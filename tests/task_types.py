@@ -0,0 +1,15 @@
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from app.tasks.registry import task_body
+
+
+class ResizeParameters(BaseModel):
+    images: List[str] = Field(..., min_length=1)
+    width: int = Field(..., gt=0)
+
+
+@task_body("resize_images", parameters=ResizeParameters)
+def resize_images(run):
+    return {"resized": len(run.parameters["images"])}
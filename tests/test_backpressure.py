@@ -0,0 +1,130 @@
+import json
+from unittest.mock import patch
+
+import fakeredis
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.models.task import TaskStatus
+from app.tasks.backpressure import LoadMonitor, deferred_key
+from app.tasks.status_store import IN_FLIGHT_KEY, report_usage, task_key, update_status
+from app.tasks.task_manager import TaskManager
+
+TASK = {"name": "t", "parameters": {}, "callback_url": "http://example.com/cb"}
+
+
+@pytest.fixture
+def load(fake_redis, monkeypatch):
+    monitor = LoadMonitor()
+    monitor.bind(fake_redis)
+    monkeypatch.setattr(TaskManager, "_load", monitor)
+    monkeypatch.setattr(
+        "app.tasks.backpressure.settings.TASK_BACKPRESSURE_QUEUE_HIGH_WATER", 10
+    )
+    return monitor
+
+
+async def sample(monitor, depths):
+    with patch("app.tasks.backpressure.queue_depths", return_value=dict(depths)):
+        await monitor.sample()
+
+
+@pytest.mark.asyncio
+async def test_submissions_over_the_high_water_mark_are_refused(
+    fake_redis, mock_publish, load
+):
+    await sample(load, {"default": 10, "short": 0})
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        refused = await ac.post("/api/tasks", json=TASK)
+        batch = await ac.post("/api/tasks/batch", json={"tasks": [TASK]})
+        accepted = await ac.post("/api/tasks", json={**TASK, "queue": "short"})
+
+    assert refused.status_code == batch.status_code == 429
+    assert refused.headers["retry-after"] == "5"
+    assert accepted.status_code == 200
+    assert mock_publish.call_count == 1
+    assert len(await fake_redis.keys("task:*")) == 1
+
+
+@pytest.mark.asyncio
+async def test_deferred_submissions_are_published_once_the_queue_drains(
+    fake_redis, mock_publish, load, monkeypatch
+):
+    monkeypatch.setattr(
+        "app.tasks.backpressure.settings.TASK_BACKPRESSURE_MODE", "defer"
+    )
+    await sample(load, {"default": 10})
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = (await ac.post("/api/tasks", json=TASK)).json()["task_id"]
+        batch = (await ac.post("/api/tasks/batch", json={"tasks": [TASK]})).json()
+
+    assert batch["accepted"] == 1
+    mock_publish.assert_not_called()
+    entries = [
+        json.loads(raw)
+        for raw in await fake_redis.lrange(deferred_key("default"), 0, -1)
+    ]
+    assert [entry["call"][0] for entry in entries] == [first, batch["task_ids"][0]]
+
+    await sample(load, {"default": 9})
+    assert await load.drain() == 0
+    await sample(load, {"default": 7})
+    assert await load.drain() == 2
+    assert [call.args[0][0] for call in mock_publish.call_args_list] == [
+        first,
+        batch["task_ids"][0],
+    ]
+    assert not await fake_redis.exists(deferred_key("default"))
+
+
+@pytest.mark.asyncio
+async def test_only_new_queued_tasks_use_up_the_admission_budget(
+    fake_redis, mock_publish, load
+):
+    await sample(load, {"default": 5})
+    retried = {**TASK, "idempotency_key": "order-1"}
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = await ac.post("/api/tasks", json=retried)
+        duplicates = await ac.post("/api/tasks/batch", json={"tasks": [retried] * 3})
+        fresh = await ac.post("/api/tasks/batch", json={"tasks": [TASK] * 4})
+        refused = await ac.post("/api/tasks", json=TASK)
+
+    assert set(duplicates.json()["task_ids"]) == {first.json()["task_id"]}
+    assert fresh.json()["accepted"] == 4
+    assert refused.status_code == 429
+    assert load._snapshot["queues"]["default"] == 10
+    assert mock_publish.call_count == 5
+
+
+@pytest.mark.asyncio
+async def test_load_endpoint_reports_pool_backlogs(fake_redis, load):
+    await fake_redis.set(IN_FLIGHT_KEY, 12)
+    await fake_redis.rpush(deferred_key("long"), "{}")
+    with patch(
+        "app.tasks.backpressure.queue_depths",
+        return_value={"short": 3, "status": 1, "default": 10, "long": 4},
+    ):
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get("/api/load")
+
+    body = response.json()
+    assert body["pools"] == {"short": 4, "default": 10, "long": 5}
+    assert body["in_flight"] == 12
+    assert body["saturated"] == ["default"]
+
+
+def test_in_flight_counter_follows_task_lifecycle():
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    for task_id in ("task-1", "task-2"):
+        redis.hset(task_key(task_id), mapping={"status": "PENDING", "progress": "0"})
+    redis.set(IN_FLIGHT_KEY, 5)
+
+    update_status(redis, "task-1", TaskStatus.RUNNING, 0.5, "")
+    assert redis.get(IN_FLIGHT_KEY) == "5"
+    update_status(redis, "task-1", TaskStatus.COMPLETED, 1.0, "")
+    update_status(redis, "task-1", TaskStatus.FAILED, 1.0, "")
+    assert redis.get(IN_FLIGHT_KEY) == "4"
+
+    report_usage(redis)
+    assert redis.get(IN_FLIGHT_KEY) == "1"
@@ -0,0 +1,88 @@
+from unittest.mock import patch
+
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.tasks.status_store import IN_FLIGHT_KEY
+
+
+def task_item(name="test_task"):
+    return {
+        "name": name,
+        "parameters": {"param1": "value1"},
+        "callback_url": "http://example.com/callback",
+    }
+
+
+@pytest.mark.asyncio
+async def test_create_tasks_in_batch(fake_redis, mock_publish):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/api/tasks/batch",
+            json={"tasks": [task_item(), task_item(""), task_item()]},
+        )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["accepted"] == 2
+    assert body["task_ids"][1] is None
+    assert [error["index"] for error in body["errors"]] == [1]
+    assert mock_publish.call_count == 2
+    for task_id in (body["task_ids"][0], body["task_ids"][2]):
+        assert await fake_redis.hget(f"task:{task_id}", "status") == "PENDING"
+
+
+@pytest.mark.asyncio
+async def test_batch_reports_tasks_that_could_not_be_queued(fake_redis, mock_publish):
+    mock_publish.side_effect = [None, Exception("broker unavailable")]
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/api/tasks/batch", json={"tasks": [task_item(), task_item()]}
+        )
+
+    body = response.json()
+    assert body["accepted"] == 1
+    assert body["task_ids"][1] is None
+    assert "broker unavailable" in body["errors"][0]["detail"]
+    assert len(await fake_redis.keys("task:*")) == 1
+    assert await fake_redis.get(IN_FLIGHT_KEY) == "1"
+
+
+@pytest.mark.asyncio
+async def test_large_batches_are_published_in_chunks(
+    fake_redis, mock_publish, monkeypatch
+):
+    monkeypatch.setattr(
+        "app.tasks.task_manager.settings.TASK_BATCH_PUBLISH_CHUNK_SIZE", 2
+    )
+    with patch("app.tasks.task_manager.dispatch_tasks.apply_async") as dispatch:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post(
+                "/api/tasks/batch", json={"tasks": [task_item() for _ in range(5)]}
+            )
+
+    assert response.json()["accepted"] == 5
+    mock_publish.assert_not_called()
+    assert [len(call.args[0][0]) for call in dispatch.call_args_list] == [2, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_get_many_task_states(fake_redis):
+    await fake_redis.hset(
+        "task:task-1",
+        mapping={"status": "RUNNING", "progress": "0.5", "message": "Halfway"},
+    )
+    await fake_redis.set(
+        "task:task-2", '{"status": "COMPLETED", "progress": 1.0, "message": "Done"}'
+    )
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/tasks/state?ids=task-1,missing&ids=task-2")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [(task["task_id"], task["status"]) for task in body["tasks"]] == [
+        ("task-1", "RUNNING"),
+        ("task-2", "COMPLETED"),
+    ]
+    assert body["missing"] == ["missing"]
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import fakeredis.aioredis
+import pytest
+
+from app.models.task import TaskStatus, TaskStatusResponse
+from app.tasks.broadcaster import StatusBroadcaster
+from app.tasks.cache import StatusCache
+from app.tasks.status_store import task_channel
+
+
+def status(task_id, state=TaskStatus.RUNNING, message=""):
+    return TaskStatusResponse(
+        task_id=task_id, status=state, progress=0.5, message=message
+    )
+
+
+def test_cache_evicts_least_recently_used():
+    cache = StatusCache(max_entries=2, max_bytes=1 << 20, ttl=5.0)
+    for task_id in ("task-1", "task-2"):
+        cache.put(status(task_id, TaskStatus.COMPLETED), time.monotonic())
+    cache.get("task-1")
+    cache.put(status("task-3", TaskStatus.COMPLETED), time.monotonic())
+
+    assert cache.get("task-2") is None
+    assert cache.get("task-1") is not None
+    assert cache.stats()["evictions"] == 1
+
+    small = StatusCache(max_entries=100, max_bytes=1000, ttl=5.0)
+    small.put(status("task-1", TaskStatus.COMPLETED, "x" * 2000), time.monotonic())
+    assert len(small) == 0
+
+
+def test_unfinished_states_expire_and_stale_reads_are_not_cached():
+    cache = StatusCache(max_entries=100, max_bytes=1 << 20, ttl=5.0)
+    cache.put(status("task-1"), time.monotonic())
+    cache.put(status("task-2", TaskStatus.FAILED), time.monotonic())
+    with patch("app.tasks.cache.time.monotonic", return_value=time.monotonic() + 10):
+        assert cache.get("task-1") is None
+        assert cache.get("task-2") is not None
+
+    read_started = time.monotonic()
+    cache.invalidate("task-3")
+    cache.put(status("task-3"), read_started)
+    assert cache.get("task-3") is None
+
+    cache.put(status("task-1"), time.monotonic())
+    cache.invalidate(None)
+    assert cache.get("task-1") is None
+    assert cache.get("task-2") is not None
+
+
+@pytest.mark.asyncio
+async def test_polling_reads_redis_once_per_change():
+    from app.tasks.task_manager import TaskManager
+
+    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    tm = TaskManager()
+    tm._redis = fake_redis
+    tm._broadcaster = StatusBroadcaster()
+    tm._broadcaster.bind(fake_redis)
+    tm._cache = StatusCache(max_entries=100, max_bytes=1 << 20, ttl=60.0)
+    tm._broadcaster.add_hook(tm._cache.invalidate)
+    await tm._broadcaster.subscribe(["other"])
+    await fake_redis.hset(
+        "task:task-1", mapping={"status": "RUNNING", "progress": "0.1", "message": ""}
+    )
+
+    try:
+        for _ in range(5):
+            assert (await tm.get_task_status("task-1")).progress == 0.1
+        assert tm._cache.stats()["misses"] == 1
+
+        await fake_redis.hset(
+            "task:task-1", mapping={"status": "COMPLETED", "progress": "1.0"}
+        )
+        await fake_redis.publish(task_channel("task-1"), "{}")
+        for _ in range(50):
+            if "task-1" not in tm._cache._entries:
+                break
+            await asyncio.sleep(0.01)
+        for _ in range(5):
+            assert (await tm.get_task_status("task-1")).status == TaskStatus.COMPLETED
+        assert tm._cache.stats()["misses"] == 2
+    finally:
+        await tm._broadcaster.close()
+        tm._redis = None
+        del tm._broadcaster
+        del tm._cache
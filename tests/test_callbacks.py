@@ -0,0 +1,180 @@
+import asyncio
+import json
+
+import fakeredis.aioredis
+import pytest
+from aiohttp import web
+
+from app.tasks.callbacks import (
+    DEAD_LETTER_KEY,
+    PENDING_KEY,
+    SCHEDULED_KEY,
+    CallbackDispatcher,
+    new_callback_entry,
+)
+from app.tasks.payloads import REF_FIELD, offload
+
+
+@pytest.fixture
+def fake_redis():
+    return fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+
+async def start_stub_server(handler):
+    app = web.Application()
+    app.router.add_post("/callback", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/callback"
+
+
+async def dispatch_until_idle(dispatcher):
+    while await dispatcher.dispatch_once():
+        await dispatcher.drain()
+    await dispatcher.drain()
+
+
+async def make_scheduled_due(redis):
+    scheduled = await redis.zrange(SCHEDULED_KEY, 0, -1)
+    if scheduled:
+        await redis.zadd(SCHEDULED_KEY, {entry: 0 for entry in scheduled})
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_caps_requests_per_host(fake_redis):
+    received = []
+    in_flight = peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        received.append(await request.json())
+        in_flight -= 1
+        return web.Response()
+
+    runner, url = await start_stub_server(handler)
+    for i in range(20):
+        await fake_redis.rpush(PENDING_KEY, new_callback_entry(url, {"n": i}))
+
+    async with CallbackDispatcher(fake_redis, max_per_host=3) as dispatcher:
+        for _ in range(50):
+            await dispatch_until_idle(dispatcher)
+            await make_scheduled_due(fake_redis)
+            if len(received) == 20:
+                break
+    await runner.cleanup()
+
+    assert sorted(item["n"] for item in received) == list(range(20))
+    assert peak <= 3
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_batches_results_for_the_same_url(fake_redis):
+    bodies = []
+
+    async def handler(request):
+        bodies.append(await request.json())
+        return web.Response()
+
+    runner, url = await start_stub_server(handler)
+    for i in range(4):
+        await fake_redis.rpush(PENDING_KEY, new_callback_entry(url, {"n": i}))
+
+    async with CallbackDispatcher(fake_redis, batch_size=4) as dispatcher:
+        await dispatch_until_idle(dispatcher)
+    await runner.cleanup()
+
+    assert bodies == [[{"n": 0}, {"n": 1}, {"n": 2}, {"n": 3}]]
+    assert await fake_redis.zcard(SCHEDULED_KEY) == 0
+
+
+@pytest.mark.asyncio
+async def test_failing_callbacks_are_retried_then_dead_lettered(
+    fake_redis, monkeypatch
+):
+    monkeypatch.setattr("app.tasks.callbacks.settings.CALLBACK_MAX_RETRIES", 2)
+    attempts = 0
+
+    async def handler(request):
+        nonlocal attempts
+        attempts += 1
+        return web.Response(status=503)
+
+    runner, url = await start_stub_server(handler)
+    await fake_redis.rpush(PENDING_KEY, new_callback_entry(url, {"n": 1}))
+
+    async with CallbackDispatcher(fake_redis) as dispatcher:
+        for _ in range(3):
+            await dispatch_until_idle(dispatcher)
+            await make_scheduled_due(fake_redis)
+    await runner.cleanup()
+
+    assert attempts == 3
+    assert await fake_redis.zcard(SCHEDULED_KEY) == 0
+    dead = json.loads((await fake_redis.lrange(DEAD_LETTER_KEY, 0, -1))[0])
+    assert dead["data"] == {"n": 1}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_dispatcher_splices_offloaded_payloads(fake_redis, monkeypatch, stream):
+    monkeypatch.setattr("app.tasks.callbacks.settings.CALLBACK_STREAM_PAYLOADS", stream)
+    monkeypatch.setattr(
+        "app.tasks.payloads.settings.TASK_PAYLOAD_INLINE_MAX_BYTES", 256
+    )
+    monkeypatch.setattr("app.tasks.payloads.settings.TASK_PAYLOAD_CHUNK_BYTES", 333)
+    large = {"rows": ["row-%d" % i for i in range(200)]}
+    bodies = []
+
+    async def handler(request):
+        bodies.append(await request.json())
+        return web.Response()
+
+    runner, url = await start_stub_server(handler)
+    ref, (key, chunks) = offload(large)
+    await fake_redis.rpush(key, *chunks)
+    result = {"task_id": "task-1", "result": {"parameters": ref, "other": ref}}
+    await fake_redis.rpush(PENDING_KEY, new_callback_entry(url, result))
+    expired = {
+        "task_id": "task-2",
+        "result": {"parameters": {**ref, REF_FIELD: "gone"}},
+    }
+    await fake_redis.rpush(PENDING_KEY, new_callback_entry(url, expired))
+
+    async with CallbackDispatcher(fake_redis) as dispatcher:
+        await dispatch_until_idle(dispatcher)
+    await runner.cleanup()
+
+    by_id = {body["task_id"]: body for body in bodies}
+    assert by_id["task-1"]["result"] == {"parameters": large, "other": large}
+    assert by_id["task-2"]["result"] == {"parameters": None}
+
+
+@pytest.mark.asyncio
+async def test_callbacks_that_cannot_be_built_are_dead_lettered(fake_redis):
+    received = []
+
+    async def handler(request):
+        received.append(await request.json())
+        return web.Response()
+
+    runner, url = await start_stub_server(handler)
+    await fake_redis.rpush(PENDING_KEY, "not json")
+    await fake_redis.rpush(PENDING_KEY, json.dumps({"url": url, "attempts": 0}))
+    await fake_redis.rpush(PENDING_KEY, new_callback_entry(url, {"n": 1}))
+
+    async with CallbackDispatcher(fake_redis, batch_size=1) as dispatcher:
+        await dispatch_until_idle(dispatcher)
+    await runner.cleanup()
+
+    assert received == [{"n": 1}]
+    assert await fake_redis.zcard(SCHEDULED_KEY) == 0
+    assert sorted(await fake_redis.lrange(DEAD_LETTER_KEY, 0, -1)) == sorted(
+        ["not json", json.dumps({"url": url, "attempts": 0})]
+    )
+    assert dispatcher.dead_lettered == 2
@@ -0,0 +1,92 @@
+import json
+import time
+from unittest.mock import patch
+
+import fakeredis
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.models.task import TaskStatus
+from app.tasks import celery_tasks
+from app.tasks.callbacks import PENDING_KEY
+from app.tasks.status_store import encode_record, task_key, update_status
+
+
+@pytest.fixture
+def redis():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    client.hset(
+        task_key("task-1"),
+        mapping=encode_record(
+            {"task_id": "task-1", "status": "PENDING", "progress": 0.0}
+        ),
+    )
+    return client
+
+
+def run_task(redis, sleep=None, deadline=None):
+    with patch.object(
+        celery_tasks, "get_redis_connection", return_value=redis
+    ), patch.object(celery_tasks.time, "sleep", side_effect=sleep) as sleep_mock:
+        celery_tasks.execute_task.run(
+            "task-1", "test_task", {}, "http://example.com", deadline
+        )
+    callback = json.loads(redis.lpop(PENDING_KEY))["data"]
+    return sleep_mock.call_count, callback
+
+
+def test_cancelled_task_stops_after_the_current_step(redis):
+    calls = []
+
+    def fake_sleep(seconds):
+        calls.append(seconds)
+        if len(calls) == 2:
+            update_status(redis, "task-1", TaskStatus.CANCELLED, 0.2, "Task cancelled")
+
+    steps, callback = run_task(redis, sleep=fake_sleep)
+
+    assert steps == 2
+    assert callback["status"] == "CANCELLED"
+    assert redis.hget(task_key("task-1"), "status") == "CANCELLED"
+    assert redis.hget(task_key("task-1"), "message") == "Task cancelled"
+
+
+def test_task_cancelled_while_queued_never_runs(redis):
+    update_status(redis, "task-1", TaskStatus.CANCELLED, 0.0, "Task cancelled")
+
+    steps, callback = run_task(redis)
+
+    assert steps == 0
+    assert callback["status"] == "CANCELLED"
+
+
+def test_task_times_out_at_its_deadline(redis):
+    steps, callback = run_task(redis, deadline=time.time() - 1)
+
+    assert steps == 0
+    assert callback["status"] == "TIMED_OUT"
+    assert redis.hget(task_key("task-1"), "status") == "TIMED_OUT"
+
+
+@pytest.mark.asyncio
+async def test_cancel_endpoint(fake_redis):
+    for task_id, status in (("task-1", "RUNNING"), ("task-2", "COMPLETED")):
+        await fake_redis.hset(
+            task_key(task_id),
+            mapping={"status": status, "progress": "0.5", "message": ""},
+        )
+
+    with patch.object(celery_tasks.celery.control, "revoke") as revoke:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            cancelled = await ac.delete("/api/tasks/task-1")
+            finished = await ac.delete("/api/tasks/task-2")
+            missing = await ac.delete("/api/tasks/missing")
+            state = await ac.get("/api/tasks/task-1/state")
+
+    assert cancelled.status_code == 200
+    assert cancelled.json()["status"] == "CANCELLED"
+    assert state.json()["status"] == "CANCELLED"
+    revoke.assert_called_once_with("task-1")
+    assert finished.status_code == 409
+    assert missing.status_code == 404
@@ -0,0 +1,38 @@
+from app.tasks import connections
+
+
+def test_connections_are_shared_until_worker_process_init():
+    first = connections.get_redis_connection()
+    second = connections.get_redis_connection()
+    session = connections.get_http_session()
+    assert first.connection_pool is second.connection_pool
+    assert connections.get_http_session() is session
+
+    connections.init_worker_connections()
+
+    assert (
+        connections.get_redis_connection().connection_pool is not first.connection_pool
+    )
+    assert connections.get_http_session() is not session
+    adapter = connections.get_http_session().get_adapter("https://example.com")
+    assert adapter._pool_maxsize == connections.settings.CALLBACK_POOL_MAXSIZE
+
+
+def test_async_pool_waits_for_free_connections():
+    pool = connections.create_async_redis_pool(max_connections=3)
+    assert isinstance(pool, connections.aioredis.BlockingConnectionPool)
+    assert pool.max_connections == 3
+    assert pool.timeout == connections.settings.REDIS_POOL_TIMEOUT
+
+
+def test_pools_connect_to_the_configured_redis_url(monkeypatch):
+    monkeypatch.setattr(
+        connections.settings, "REDIS_URL", "redis://cache.internal:6380/2"
+    )
+    for pool in (
+        connections.create_redis_pool(),
+        connections.create_async_redis_pool(),
+    ):
+        assert pool.connection_kwargs["host"] == "cache.internal"
+        assert pool.connection_kwargs["port"] == 6380
+        assert pool.connection_kwargs["db"] == 2
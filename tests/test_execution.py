@@ -0,0 +1,190 @@
+import asyncio
+import json
+import threading
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+
+from app.tasks import celery_tasks, execution, registry
+from app.tasks.callbacks import PENDING_KEY
+from app.tasks.execution import DETACHED_ENTRIES_KEY, DETACHED_KEY, AsyncExecutor
+from app.tasks.payloads import STORE_PAYLOAD_SCRIPT, offload
+from app.tasks.registry import TaskType
+from app.tasks.scheduler import Scheduler
+from app.tasks.status_store import encode_record, task_key, update_status
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(execution, "create_async_redis_pool", lambda **options: None)
+    monkeypatch.setattr(
+        execution,
+        "AsyncRedis",
+        lambda **options: fakeredis.aioredis.FakeRedis(
+            server=server, decode_responses=True
+        ),
+    )
+    return server
+
+
+@pytest.fixture
+def redis(server):
+    client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    for index in range(6):
+        client.hset(
+            task_key(f"task-{index}"),
+            mapping=encode_record({"task_id": f"task-{index}", "status": "PENDING"}),
+        )
+    return client
+
+
+def run(task_id, name):
+    celery_tasks.execute_task.run(task_id, name, {}, "http://example.com")
+
+
+def callbacks(redis):
+    return {
+        entry["data"]["task_id"]: entry["data"]
+        for entry in map(json.loads, redis.lrange(PENDING_KEY, 0, -1))
+    }
+
+
+def test_coroutine_bodies_share_one_event_loop_up_to_the_limit(redis, monkeypatch):
+    active, peak = [0], [0]
+
+    async def fetch(run):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await run.sleep(0.05)
+        await run.report(0.5, "halfway")
+        active[0] -= 1
+        return {"fetched": run.task_id}
+
+    executor = AsyncExecutor(concurrency=2)
+    monkeypatch.setitem(registry._types, "fetch", TaskType("fetch", fetch))
+    monkeypatch.setattr(celery_tasks, "async_executor", lambda: executor)
+    monkeypatch.setattr(celery_tasks, "get_redis_connection", lambda: redis)
+    try:
+        threads = [
+            threading.Thread(target=run, args=(f"task-{index}", "fetch"))
+            for index in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        executor.stop()
+
+    assert peak[0] == 2
+    assert {redis.hget(task_key(f"task-{index}"), "status") for index in range(6)} == {
+        "COMPLETED"
+    }
+    assert callbacks(redis)["task-3"]["result"]["result_data"] == {"fetched": "task-3"}
+    assert redis.zcard(DETACHED_KEY) == 0
+    assert redis.hlen(DETACHED_ENTRIES_KEY) == 0
+
+
+def test_tasks_of_a_stopped_executor_are_redelivered(redis, monkeypatch, mock_publish):
+    started = threading.Event()
+
+    async def hang(run):
+        started.set()
+        await asyncio.sleep(10)
+
+    async def quick(run):
+        return {}
+
+    executor = AsyncExecutor(concurrency=10)
+    monkeypatch.setitem(registry._types, "hang", TaskType("hang", hang))
+    monkeypatch.setitem(registry._types, "quick", TaskType("quick", quick))
+    monkeypatch.setattr(celery_tasks, "async_executor", lambda: executor)
+    monkeypatch.setattr(celery_tasks, "get_redis_connection", lambda: redis)
+    try:
+        # Both calls return before their tasks have finished.
+        run("task-0", "hang")
+        run("task-1", "quick")
+        assert started.wait(5)
+        assert redis.zscore(DETACHED_KEY, "task-0") > 0
+    finally:
+        executor.stop(timeout=0.1)
+
+    assert redis.hget(task_key("task-0"), "status") == "RUNNING"
+    assert redis.zscore(DETACHED_KEY, "task-0") == 0
+    assert redis.zscore(DETACHED_KEY, "task-1") is None
+    # A lease left behind by a task that finished anyway is dropped.
+    redis.hset(DETACHED_ENTRIES_KEY, "task-2", "{}")
+    redis.zadd(DETACHED_KEY, {"task-2": 0})
+    update_status(redis, "task-2", "COMPLETED", 1.0, "Task completed")
+
+    assert Scheduler(redis).redeliver() == 2
+    mock_publish.assert_called_once()
+    call = mock_publish.call_args
+    assert call.args[0][:4] == ["task-0", "hang", {}, "http://example.com"]
+    assert call.kwargs["queue"] == "default"
+    assert redis.zcard(DETACHED_KEY) == 0
+    assert redis.hlen(DETACHED_ENTRIES_KEY) == 0
+
+
+def test_coroutine_body_stops_when_cancelled_without_a_shared_loop(redis, monkeypatch):
+    async def poll(run):
+        await asyncio.to_thread(
+            update_status, redis, run.task_id, "CANCELLED", 0.1, "Task cancelled"
+        )
+        await run.report(0.2, "still polling")
+        raise AssertionError("not stopped")
+
+    monkeypatch.setitem(registry._types, "poll", TaskType("poll", poll))
+    run("task-0", "poll")
+
+    assert callbacks(redis)["task-0"]["status"] == "CANCELLED"
+    assert redis.hget(task_key("task-0"), "message") == "Task cancelled"
+
+
+def test_coroutine_body_is_held_to_the_time_limit(redis, monkeypatch):
+    async def hang(run):
+        await asyncio.sleep(10)
+
+    monkeypatch.setitem(registry._types, "hang", TaskType("hang", hang))
+    monkeypatch.setattr(execution.settings, "CELERY_TASK_TIME_LIMIT", 0.01)
+    run("task-0", "hang")
+
+    assert callbacks(redis)["task-0"]["status"] == "TIMED_OUT"
+    assert redis.hget(task_key("task-0"), "message") == "Task time limit exceeded"
+
+
+def test_registered_bodies_get_offloaded_parameters_resolved(redis, monkeypatch):
+    monkeypatch.setattr(registry, "_types", {})
+    monkeypatch.setattr(
+        "app.tasks.registry.settings.TASK_TYPE_MODULES",
+        {"resize_images": "tests.task_types"},
+    )
+    resize_images = registry.lookup("resize_images").body
+
+    async def resize_images_async(run):
+        return resize_images(run)
+
+    monkeypatch.setitem(
+        registry._types, "resize_async", TaskType("resize_async", resize_images_async)
+    )
+    monkeypatch.setattr(
+        "app.tasks.payloads.settings.TASK_PAYLOAD_INLINE_MAX_BYTES", 256
+    )
+    parameters = {"images": ["image-%d.png" % i for i in range(100)], "width": 640}
+    ref, (key, chunks) = offload(parameters)
+    redis.register_script(STORE_PAYLOAD_SCRIPT)(keys=[key], args=[60, *chunks])
+    monkeypatch.setattr(celery_tasks, "get_redis_connection", lambda: redis)
+
+    celery_tasks.execute_task.run("task-0", "resize_images", ref, "http://example.com")
+    celery_tasks.execute_task.run("task-1", "resize_async", ref, "http://example.com")
+    redis.delete(key)
+    celery_tasks.execute_task.run("task-2", "resize_images", ref, "http://example.com")
+
+    sent = callbacks(redis)
+    for task_id in ("task-0", "task-1"):
+        assert sent[task_id]["status"] == "COMPLETED"
+        assert sent[task_id]["result"]["result_data"] == {"resized": 100}
+        assert sent[task_id]["result"]["parameters"] == ref
+    assert sent["task-2"]["error"] == "Task failed: Task parameters have expired"
@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import fakeredis
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.models.task import TaskStatus
+from app.tasks.broadcaster import StatusBroadcaster
+from app.tasks.status_store import (
+    encode_record,
+    history_key,
+    task_channel,
+    task_key,
+    update_status,
+)
+
+
+@pytest.fixture
+def redis():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    client.hset(
+        task_key("task-1"),
+        mapping=encode_record(
+            {"task_id": "task-1", "status": "PENDING", "progress": 0.0}
+        ),
+    )
+    return client
+
+
+def test_updates_are_appended_to_a_capped_history(redis, monkeypatch):
+    monkeypatch.setattr("app.tasks.status_store.settings.TASK_HISTORY_MAX_EVENTS", 3)
+    for step in range(1, 5):
+        update_status(redis, "task-1", TaskStatus.RUNNING, step / 10, f"Step {step}")
+    update_status(redis, "task-1", TaskStatus.COMPLETED, 1.0, "Done")
+    # Refused updates are not recorded.
+    update_status(redis, "task-1", TaskStatus.RUNNING, 0.5, "Late")
+
+    entries = redis.xrange(history_key("task-1"))
+    assert [entry_id for entry_id, _ in entries] == ["3-0", "4-0", "5-0"]
+    assert entries[-1][1]["status"] == "COMPLETED"
+    assert redis.hget(task_key("task-1"), "seq") == "5"
+    assert 0 < redis.ttl(history_key("task-1")) <= redis.ttl(task_key("task-1"))
+
+
+def test_history_can_be_disabled(redis, monkeypatch):
+    monkeypatch.setattr("app.tasks.status_store.settings.TASK_HISTORY_MAX_EVENTS", 0)
+    update_status(redis, "task-1", TaskStatus.RUNNING, 0.5, "Halfway")
+
+    assert not redis.exists(history_key("task-1"))
+    assert redis.hget(task_key("task-1"), "status") == "RUNNING"
+
+
+@pytest.mark.asyncio
+async def test_events_endpoint_replays_history_since(fake_redis):
+    await fake_redis.hset(task_key("task-1"), mapping={"status": "RUNNING", "seq": "3"})
+    for seq, progress in ((2, "0.2"), (3, "0.3")):
+        await fake_redis.xadd(
+            history_key("task-1"),
+            {
+                "status": "RUNNING",
+                "progress": progress,
+                "message": "",
+                "at": "2026-01-02T00:00:00",
+            },
+            id=f"{seq}-0",
+        )
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/tasks/task-1/events", params={"since": 2})
+        everything = await ac.get("/api/tasks/task-1/events")
+        missing = await ac.get("/api/tasks/task-2/events")
+
+    assert response.json()["events"] == [
+        {
+            "seq": 3,
+            "status": "RUNNING",
+            "progress": 0.3,
+            "message": None,
+            "at": "2026-01-02T00:00:00",
+        }
+    ]
+    assert response.json()["truncated"] is False
+    assert [event["seq"] for event in everything.json()["events"]] == [2, 3]
+    assert everything.json()["truncated"] is True
+    assert missing.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_stream_replays_states_skipped_between_pushes(fake_redis):
+    from app.tasks.task_manager import TaskManager
+
+    tm = TaskManager()
+    tm._broadcaster = StatusBroadcaster()
+    tm._broadcaster.bind(fake_redis)
+    await fake_redis.hset(
+        task_key("task-1"),
+        mapping={"status": "RUNNING", "progress": "0.1", "message": "", "seq": "1"},
+    )
+    for seq in (2, 3):
+        await fake_redis.xadd(
+            history_key("task-1"),
+            {"status": "RUNNING", "progress": str(seq / 10), "message": "", "at": ""},
+            id=f"{seq}-0",
+        )
+
+    stream = tm.stream_task_status("task-1")
+    first = await asyncio.wait_for(stream.__anext__(), timeout=1)
+    assert first.startswith("id: 1\n")
+
+    done = {
+        "task_id": "task-1",
+        "status": "COMPLETED",
+        "progress": 1.0,
+        "message": "",
+        "seq": 4,
+    }
+    await fake_redis.publish(task_channel("task-1"), json.dumps(done))
+    frames = [frame async for frame in stream]
+
+    assert [frame.split("\n", 1)[0] for frame in frames] == ["id: 2", "id: 3", "id: 4"]
+    assert json.loads(frames[0].split("data: ", 1)[1])["progress"] == 0.2
+    await tm._broadcaster.close()
+    del tm._broadcaster
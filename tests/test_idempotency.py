@@ -0,0 +1,108 @@
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.models.task import TaskStatus
+from app.tasks.status_store import (
+    content_dedupe_key,
+    idempotency_dedupe_key,
+    task_key,
+    update_status_async,
+)
+
+
+def task_item(**fields):
+    return {
+        "name": "test_task",
+        "parameters": {"param1": "value1"},
+        "callback_url": "http://example.com/callback",
+        **fields,
+    }
+
+
+async def submit(ac, headers=None, **fields):
+    response = await ac.post("/api/tasks", json=task_item(**fields), headers=headers)
+    assert response.status_code == 200
+    return response.json()["task_id"]
+
+
+@pytest.mark.asyncio
+async def test_idempotency_key_returns_the_original_task(fake_redis, mock_publish):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = await submit(ac, idempotency_key="order-1")
+        second = await submit(ac, headers={"Idempotency-Key": "order-1"})
+        other = await submit(ac, idempotency_key="order-2")
+
+    assert second == first
+    assert other != first
+    assert mock_publish.call_count == 2
+    assert await fake_redis.get(idempotency_dedupe_key("order-1")) == first
+    assert await fake_redis.hget(
+        task_key(first), "dedupe_key"
+    ) == idempotency_dedupe_key("order-1")
+
+
+@pytest.mark.asyncio
+async def test_dedupe_matches_name_and_parameters(fake_redis, mock_publish):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = await submit(ac, dedupe=True)
+        same = await submit(ac, dedupe=True)
+        changed = await submit(ac, dedupe=True, parameters={"param1": "other"})
+        undeduped = await submit(ac)
+        batch = await ac.post(
+            "/api/tasks/batch", json={"tasks": [task_item(dedupe=True), task_item()]}
+        )
+
+    assert same == first
+    assert len({first, changed, undeduped}) == 3
+    assert batch.json()["task_ids"][0] == first
+    assert batch.json()["accepted"] == 2
+    assert mock_publish.call_count == 4
+
+
+@pytest.mark.asyncio
+async def test_failed_task_releases_its_claim(fake_redis, mock_publish):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = await submit(ac, idempotency_key="order-1")
+        await update_status_async(
+            fake_redis, first, TaskStatus.FAILED, 1.0, "Task failed"
+        )
+        retried = await submit(ac, idempotency_key="order-1")
+
+    assert retried != first
+    assert await fake_redis.get(idempotency_dedupe_key("order-1")) == retried
+
+
+@pytest.mark.asyncio
+async def test_completed_task_keeps_its_claim_for_the_result_ttl(
+    fake_redis, mock_publish, monkeypatch
+):
+    monkeypatch.setattr(
+        "app.tasks.status_store.settings.TASK_RESULT_CACHE_TTL_SECONDS", 60
+    )
+    key = content_dedupe_key("test_task", {"param1": "value1"})
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = await submit(ac, dedupe=True)
+        await update_status_async(fake_redis, first, TaskStatus.COMPLETED, 1.0, "Done")
+        assert 0 < await fake_redis.ttl(key) <= 60
+        assert await submit(ac, dedupe=True) == first
+
+        monkeypatch.setattr(
+            "app.tasks.status_store.settings.TASK_RESULT_CACHE_TTL_SECONDS", 0
+        )
+        second = await submit(ac, idempotency_key="order-1")
+        await update_status_async(fake_redis, second, TaskStatus.COMPLETED, 1.0, "Done")
+        assert await submit(ac, idempotency_key="order-1") == second
+
+    assert await fake_redis.ttl(idempotency_dedupe_key("order-1")) > 60
+
+
+@pytest.mark.asyncio
+async def test_claim_of_an_expired_task_is_free(fake_redis, mock_publish):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = await submit(ac, idempotency_key="order-1")
+        await fake_redis.delete(task_key(first))
+        second = await submit(ac, idempotency_key="order-1")
+
+    assert second != first
+    assert await fake_redis.exists(task_key(second)) == 1
@@ -0,0 +1,151 @@
+import time
+from unittest.mock import patch
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.models.task import TaskStatus
+from app.tasks.status_store import (
+    EXPIRING_INDEX_KEY,
+    list_tasks_async,
+    name_index_key,
+    prune_indexes,
+    status_index_key,
+    task_key,
+    update_status,
+)
+from app.tasks.task_manager import TaskManager
+
+
+@pytest.fixture
+def redis(fake_redis):
+    # The API and the worker share one fake server.
+    server = fakeredis.FakeServer()
+    TaskManager()._redis = fakeredis.aioredis.FakeRedis(
+        server=server, decode_responses=True
+    )
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+def task(name):
+    return {"name": name, "parameters": {}, "callback_url": "http://example.com/cb"}
+
+
+async def create(ac, names):
+    response = await ac.post(
+        "/api/tasks/batch", json={"tasks": [task(name) for name in names]}
+    )
+    return response.json()["task_ids"]
+
+
+@pytest.mark.asyncio
+async def test_tasks_are_listed_by_status_and_name(redis, mock_publish):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        resize = await create(ac, ["resize"] * 5)
+        other = await create(ac, ["encode"] * 2)
+        for task_id in resize[:3] + other[:1]:
+            update_status(redis, task_id, TaskStatus.FAILED, 0.0, "Broken")
+
+        pages = []
+        cursor = None
+        while True:
+            params = {"status": "FAILED", "name": "resize", "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            page = (await ac.get("/api/tasks", params=params)).json()
+            pages.append(page["tasks"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        pending = (await ac.get("/api/tasks", params={"status": "PENDING"})).json()
+        by_name = (await ac.get("/api/tasks", params={"name": "encode"})).json()
+
+    listed = [item for page in pages for item in page]
+    assert sorted(item["task_id"] for item in listed) == sorted(resize[:3])
+    assert all(len(page) <= 2 for page in pages)
+    created = [item["created_at"] for item in listed]
+    assert created == sorted(created, reverse=True)
+    assert {item["task_id"] for item in pending["tasks"]} == set(resize[3:] + other[1:])
+    assert {item["task_id"]: item["status"] for item in by_name["tasks"]} == {
+        other[0]: "FAILED",
+        other[1]: "PENDING",
+    }
+    assert {item["name"] for item in by_name["tasks"]} == {"encode"}
+    assert by_name["next_cursor"] is None
+
+
+@pytest.mark.asyncio
+async def test_listing_filters_by_creation_time(redis, mock_publish):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        await create(ac, ["report"])
+        created = (await ac.get("/api/tasks", params={"name": "report"})).json()
+        after = created["tasks"][0]["created_at"]
+        later = await create(ac, ["report"])
+        listed = (
+            await ac.get(
+                "/api/tasks", params={"name": "report", "created_after": after}
+            )
+        ).json()
+        unfiltered = await ac.get("/api/tasks")
+        bad_cursor = await ac.get(
+            "/api/tasks", params={"name": "report", "cursor": "x"}
+        )
+
+    assert [item["task_id"] for item in listed["tasks"]] == later
+    assert unfiltered.status_code == 400
+    assert bad_cursor.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_indexes_are_pruned_with_the_records(redis, mock_publish, monkeypatch):
+    monkeypatch.setattr("app.tasks.status_store.settings.TASK_TERMINAL_TTL_SECONDS", 60)
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        finished, abandoned = await create(ac, ["cleanup", "cleanup"])
+        update_status(redis, finished, TaskStatus.COMPLETED, 1.0, "Done")
+        assert (
+            redis.zscore(EXPIRING_INDEX_KEY, f"COMPLETED:{finished}:cleanup")
+            > time.time()
+        )
+
+        assert prune_indexes(redis) == 0
+        with patch("app.tasks.status_store.time.time", return_value=time.time() + 61):
+            assert prune_indexes(redis) == 1
+        assert redis.zscore(status_index_key(TaskStatus.COMPLETED), finished) is None
+        assert redis.zrange(name_index_key("cleanup"), 0, -1) == [abandoned]
+
+        # A record that expired unfinished is dropped when a listing reaches it.
+        redis.delete(task_key(abandoned))
+        listed = (await ac.get("/api/tasks", params={"status": "PENDING"})).json()
+
+    assert listed["tasks"] == []
+    assert redis.zcard(status_index_key(TaskStatus.PENDING)) == 0
+
+
+@pytest.mark.asyncio
+async def test_pages_follow_the_cursor_through_equal_scores():
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    status, name = status_index_key(TaskStatus.PENDING), name_index_key("tie")
+    for task_id in "abcdefg":
+        await client.zadd(status, {task_id: 100.0})
+        await client.zadd(name, {task_id: 100.0})
+        if task_id != "c":
+            await client.hset(
+                task_key(task_id), mapping={"status": "PENDING", "name": "tie"}
+            )
+
+    listed, max_score, after = [], "+inf", ""
+    while True:
+        found, position = await list_tasks_async(
+            client, [status, name], max_score, "-inf", after, 2, "PENDING", "tie"
+        )
+        listed += [fields["task_id"] for fields in found]
+        if position is None:
+            break
+        max_score, after = repr(position[0]), position[1]
+
+    assert listed == list("gfedba")
+    assert await client.zrange(status, 0, -1) == await client.zrange(name, 0, -1)
+    assert "c" not in await client.zrange(status, 0, -1)
@@ -0,0 +1,69 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+
+from app.main import app
+from app.tasks import celery_tasks
+from app.tasks.queues import queue_depths
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_api_operations(fake_redis, mock_publish):
+    created = sample("task_api_operation_seconds_count", operation="create_task")
+    stored = sample("task_api_redis_seconds_count", operation="store_task")
+
+    with patch("app.main.queue_depths", return_value={"short": 3}):
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            await ac.post(
+                "/api/tasks",
+                json={
+                    "name": "t",
+                    "parameters": {},
+                    "callback_url": "http://example.com",
+                },
+            )
+            response = await ac.get("/metrics")
+
+    assert response.status_code == 200
+    assert "task_open_streams" in response.text
+    assert (
+        sample("task_api_operation_seconds_count", operation="create_task")
+        == created + 1
+    )
+    assert sample("task_api_redis_seconds_count", operation="store_task") == stored + 1
+    assert sample("task_queue_depth", queue="short") == 3
+
+
+def test_queue_depths_are_read_from_the_broker(monkeypatch):
+    monkeypatch.setattr(celery_tasks.celery.conf, "broker_url", "memory://")
+    with celery_tasks.celery.connection_for_write() as connection:
+        queue = connection.SimpleQueue("long")
+        queue.clear()
+        queue.put({"n": 1})
+        queue.put({"n": 2})
+        depths = queue_depths(celery_tasks.celery)
+        queue.clear()
+
+    assert depths["long"] == 2
+    assert set(depths) >= {"short", "default", "long", "status", "callbacks"}
+
+
+def test_worker_records_queue_wait_and_run_time():
+    waited = sample("task_queue_wait_seconds_count", queue="short")
+    ran = sample("task_run_seconds_count", task="execute_task")
+    task = MagicMock()
+    task.name = "execute_task"
+    task.request.get.return_value = 0.0
+    task.request.delivery_info = {"routing_key": "short"}
+
+    celery_tasks.record_task_start(task_id="t", task=task)
+    celery_tasks.record_task_end(task_id="t", task=task)
+
+    assert sample("task_queue_wait_seconds_count", queue="short") == waited + 1
+    assert sample("task_run_seconds_count", task="execute_task") == ran + 1
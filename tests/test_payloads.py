@@ -0,0 +1,74 @@
+import json
+
+import fakeredis
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.tasks.payloads import (
+    REF_FIELD,
+    STORE_PAYLOAD_SCRIPT,
+    PayloadExpired,
+    iter_body,
+    load,
+    offload,
+)
+from app.tasks.status_store import task_key
+
+LARGE = {"rows": ["żółw-%d" % i for i in range(200)]}
+
+
+@pytest.fixture
+def small_payloads(monkeypatch):
+    monkeypatch.setattr(
+        "app.tasks.payloads.settings.TASK_PAYLOAD_INLINE_MAX_BYTES", 256
+    )
+    monkeypatch.setattr("app.tasks.payloads.settings.TASK_PAYLOAD_CHUNK_BYTES", 333)
+
+
+def test_only_large_payloads_are_offloaded(small_payloads):
+    small = {"param1": "value1"}
+    assert offload(small) == (small, None)
+
+    ref, (key, chunks) = offload(LARGE)
+    assert ref[REF_FIELD] == key and ref["chunks"] == len(chunks) > 1
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    redis.register_script(STORE_PAYLOAD_SCRIPT)(keys=[key], args=[60, *chunks])
+    assert load(redis, ref) == LARGE
+    assert load(redis, small) == small
+
+
+@pytest.mark.asyncio
+async def test_large_parameters_are_stored_once_and_passed_by_reference(
+    fake_redis, mock_publish, small_payloads
+):
+    task = {"name": "big", "parameters": LARGE, "callback_url": "http://example.com/cb"}
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = (await ac.post("/api/tasks", json=task)).json()["task_id"]
+        batch = await ac.post("/api/tasks/batch", json={"tasks": [task]})
+
+    stored = json.loads(await fake_redis.hget(task_key(first), "parameters"))
+    assert REF_FIELD in stored
+    assert batch.json()["accepted"] == 1
+    sent = [call.args[0][2] for call in mock_publish.call_args_list]
+    assert sent == [stored, stored]
+    assert await fake_redis.keys("task_payload:*") == [stored[REF_FIELD]]
+
+
+def test_streamed_bodies_are_never_truncated(small_payloads):
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    ref, (key, chunks) = offload(LARGE)
+    redis.rpush(key, *chunks[:-1])
+    assert json.loads(b"".join(iter_body(redis, {"p": ref}, stream=True))) == {
+        "p": None
+    }
+
+    redis.rpush(key, chunks[-1])
+    body = iter_body(redis, {"p": ref}, stream=True)
+    assert json.loads(b"".join(body)) == {"p": LARGE}
+
+    body = iter_body(redis, {"p": ref}, stream=True)
+    next(body), next(body)
+    redis.delete(key)
+    with pytest.raises(PayloadExpired):
+        b"".join(body)
@@ -0,0 +1,109 @@
+from unittest.mock import patch
+
+import fakeredis
+import pytest
+
+from app.models.task import TaskStatus
+from app.tasks import celery_tasks
+from app.tasks.callbacks import PENDING_KEY
+from app.tasks.execution import TaskInterrupted, TaskRun
+from app.tasks.progress import ProgressReporter
+from app.tasks.status_store import encode_record, task_key, update_status
+
+
+@pytest.fixture
+def redis():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    client.hset(
+        task_key("task-1"),
+        mapping=encode_record(
+            {"task_id": "task-1", "status": "PENDING", "progress": 0.0}
+        ),
+    )
+    return client
+
+
+def test_updates_are_coalesced_and_finish_is_always_written(redis):
+    clock = [100.0]
+    with patch("app.tasks.progress.time.monotonic", side_effect=lambda: clock[0]):
+        progress = ProgressReporter(redis, "task-1", max_updates_per_second=2)
+        progress.start()
+        clock[0] += 0.1
+        assert progress.update(0.2, "step 1") is None
+        clock[0] += 0.1
+        assert progress.update(0.4, "step 2") is None
+        assert redis.hget(task_key("task-1"), "progress") == "0.0"
+
+        clock[0] += 0.4
+        assert progress.update(0.6, "step 3") == "RUNNING"
+        assert redis.hget(task_key("task-1"), "message") == "step 3"
+
+        clock[0] += 0.1
+        progress.update(0.8, "step 4")
+        progress.finish(TaskStatus.COMPLETED, 1.0, "Task completed")
+
+    assert redis.hget(task_key("task-1"), "status") == "COMPLETED"
+    assert progress.flush() is None
+
+
+def test_execute_task_sends_nothing_through_the_broker(redis):
+    with patch.object(
+        celery_tasks, "get_redis_connection", return_value=redis
+    ), patch.object(celery_tasks.time, "sleep"), patch.object(
+        celery_tasks.update_task_status, "delay"
+    ) as status_delay, patch.object(
+        celery_tasks.send_callback, "delay"
+    ) as callback_delay:
+        celery_tasks.execute_task.run("task-1", "test_task", {}, "http://example.com")
+
+    status_delay.assert_not_called()
+    callback_delay.assert_not_called()
+    assert redis.llen(PENDING_KEY) == 1
+    assert redis.hget(task_key("task-1"), "status") == "COMPLETED"
+
+
+def test_coalesced_updates_still_notice_cancellation(redis, monkeypatch):
+    monkeypatch.setattr(
+        "app.tasks.progress.settings.TASK_PROGRESS_MAX_UPDATES_PER_SECOND", 1
+    )
+    clock = [100.0]
+    with patch("app.tasks.progress.time.monotonic", side_effect=lambda: clock[0]):
+        run = TaskRun(redis, "task-1", "test_task", {})
+        run.progress.start()
+        update_status(redis, "task-1", TaskStatus.CANCELLED, 0.0, "Task cancelled")
+        clock[0] += 0.05
+        run.report(0.1, "step 1")
+
+        clock[0] += 0.1
+        with pytest.raises(TaskInterrupted):
+            run.report(0.2, "step 2")
+
+    assert run.progress.interrupted == TaskStatus.CANCELLED
+    assert redis.hget(task_key("task-1"), "progress") == "0.0"
+
+
+def test_sleep_writes_a_coalesced_update_once_it_is_due(redis, monkeypatch):
+    monkeypatch.setattr(
+        "app.tasks.progress.settings.TASK_PROGRESS_MAX_UPDATES_PER_SECOND", 1
+    )
+    clock = [100.0]
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        clock[0] += seconds
+
+    with patch(
+        "app.tasks.progress.time.monotonic", side_effect=lambda: clock[0]
+    ), patch("app.tasks.execution.time.sleep", side_effect=sleep):
+        run = TaskRun(redis, "task-1", "test_task", {})
+        run.progress.start()
+        clock[0] += 0.25
+        run.report(0.5, "halfway")
+        assert redis.hget(task_key("task-1"), "progress") == "0.0"
+
+        run.sleep(10.0)
+
+    assert slept == [0.75, 9.25]
+    assert redis.hget(task_key("task-1"), "message") == "halfway"
+    assert run.progress.pending_delay() is None
@@ -0,0 +1,84 @@
+from unittest.mock import patch
+
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.models.task import TaskQueue
+from app.tasks.queues import WORKER_POOLS, execution_options, worker_argv
+
+
+def task_item(**fields):
+    return {
+        "name": "test_task",
+        "parameters": {},
+        "callback_url": "http://example.com/callback",
+        **fields,
+    }
+
+
+def test_priorities_follow_the_broker_scale():
+    assert execution_options(None, None, "redis://redis:6379/0") == {"queue": "default"}
+    assert execution_options(TaskQueue.SHORT, 9, "redis://redis:6379/0") == {
+        "queue": "short",
+        "priority": 0,
+    }
+    assert execution_options(TaskQueue.LONG, 9, "amqp://rabbitmq//") == {
+        "queue": "long",
+        "priority": 9,
+    }
+
+
+def test_every_routed_queue_has_a_worker_pool():
+    from app.tasks.celery_tasks import celery
+
+    consumed = {queue for pool in WORKER_POOLS.values() for queue in pool}
+    routed = {route["queue"] for route in celery.conf.task_routes.values()}
+    assert routed | {queue.value for queue in TaskQueue} <= consumed
+    assert worker_argv("long")[:3] == ["worker", "--queues", "long"]
+
+
+def test_event_loop_pools_run_on_threads(monkeypatch):
+    monkeypatch.setattr(
+        "app.tasks.queues.settings.TASK_QUEUE_EXECUTOR",
+        {"short": "prefork", "default": "prefork", "long": "asyncio"},
+    )
+    monkeypatch.setattr("app.tasks.queues.settings.TASK_ASYNC_CONCURRENCY", 500)
+
+    argv = worker_argv("long")
+
+    # Coroutines do not hold pool threads, so the pool is not grown for them.
+    assert argv[argv.index("--concurrency") + 1] == "2"
+    assert argv[-2:] == ["--pool", "threads"]
+
+
+@pytest.mark.asyncio
+async def test_task_is_published_to_its_queue(fake_redis, mock_publish):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/api/tasks", json=task_item(queue="short", priority=7)
+        )
+
+    assert response.status_code == 200
+    task_id = response.json()["task_id"]
+    assert mock_publish.call_args.kwargs["queue"] == "short"
+    assert await fake_redis.hget(f"task:{task_id}", "queue") == "short"
+    assert await fake_redis.hget(f"task:{task_id}", "priority") == "7"
+
+
+@pytest.mark.asyncio
+async def test_batch_chunks_are_grouped_by_queue(fake_redis, mock_publish, monkeypatch):
+    monkeypatch.setattr(
+        "app.tasks.task_manager.settings.TASK_BATCH_PUBLISH_CHUNK_SIZE", 2
+    )
+    tasks = [task_item(queue=queue) for queue in ("long", "short", "long", "long")]
+    with patch("app.tasks.task_manager.dispatch_tasks.apply_async") as dispatch:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post("/api/tasks/batch", json={"tasks": tasks})
+
+    assert response.json()["accepted"] == 4
+    chunks = [
+        (call.args[0][1]["queue"], len(call.args[0][0]))
+        for call in dispatch.call_args_list
+    ]
+    assert chunks == [("long", 2), ("long", 1), ("short", 1)]
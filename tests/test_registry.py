@@ -0,0 +1,74 @@
+import sys
+
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.tasks import execution, registry
+
+
+@pytest.fixture(autouse=True)
+def task_types(monkeypatch):
+    monkeypatch.setattr(registry, "_types", {})
+    monkeypatch.setattr(
+        "app.tasks.registry.settings.TASK_TYPE_MODULES",
+        {"resize_images": "tests.task_types"},
+    )
+    monkeypatch.delitem(sys.modules, "tests.task_types", raising=False)
+
+
+def task_item(name="resize_images", **parameters):
+    return {
+        "name": name,
+        "parameters": parameters,
+        "callback_url": "http://example.com/callback",
+    }
+
+
+def test_task_modules_are_imported_on_first_lookup():
+    assert "tests.task_types" not in sys.modules
+    assert registry.lookup("test_task") is None
+    assert "tests.task_types" not in sys.modules
+
+    body = execution.body_for("resize_images")
+
+    assert body.__module__ == "tests.task_types"
+    assert registry.lookup("resize_images").body is body
+
+
+@pytest.mark.asyncio
+async def test_parameters_are_validated_before_anything_is_queued(
+    fake_redis, mock_publish
+):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        invalid = await ac.post("/api/tasks", json=task_item(images=[], width="wide"))
+        valid = await ac.post(
+            "/api/tasks", json=task_item(images=["a.png"], width="640")
+        )
+
+    assert invalid.status_code == 422
+    assert [error["loc"] for error in invalid.json()["detail"]] == [
+        ["body", "parameters", "images"],
+        ["body", "parameters", "width"],
+    ]
+    assert valid.status_code == 200
+    assert mock_publish.call_count == 1
+    assert mock_publish.call_args.args[0][2] == {"images": ["a.png"], "width": 640}
+
+
+@pytest.mark.asyncio
+async def test_unregistered_names_can_be_refused(fake_redis, mock_publish, monkeypatch):
+    monkeypatch.setattr("app.tasks.registry.settings.TASK_REJECT_UNREGISTERED", True)
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/api/tasks/batch",
+            json={
+                "tasks": [task_item(images=["a.png"], width=1), task_item("test_task")]
+            },
+        )
+
+    body = response.json()
+    assert body["accepted"] == 1
+    assert body["errors"][0]["index"] == 1
+    assert body["errors"][0]["detail"][0]["type"] == "unknown_task"
+    assert mock_publish.call_count == 1
@@ -0,0 +1,186 @@
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.tasks import celery_tasks
+from app.tasks.scheduler import (
+    SCHEDULE_ENTRIES_KEY,
+    SCHEDULED_KEY,
+    Scheduler,
+    jitter_offset,
+    schedule_entry,
+)
+from app.tasks.task_manager import TaskManager
+
+TASK = {
+    "name": "report",
+    "parameters": {"day": 1},
+    "callback_url": "http://example.com/cb",
+}
+
+
+@pytest.fixture
+def redis(fake_redis):
+    # The API and the scheduler share one fake server.
+    server = fakeredis.FakeServer()
+    TaskManager()._redis = fakeredis.aioredis.FakeRedis(
+        server=server, decode_responses=True
+    )
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+def at(seconds):
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+def make_due(redis, name):
+    redis.zadd(SCHEDULED_KEY, {name: time.time() - 1})
+
+
+@pytest.mark.asyncio
+async def test_delayed_tasks_are_published_once_due(redis, mock_publish):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        task_id = (
+            await ac.post("/api/tasks", json={**TASK, "run_at": at(3600)})
+        ).json()["task_id"]
+        state = (await ac.get(f"/api/tasks/{task_id}/state")).json()
+
+    assert state["status"] == "PENDING"
+    assert state["message"].startswith("Scheduled for")
+    assert redis.ttl(f"task:{task_id}") > 7 * 24 * 3600
+    scheduler = Scheduler(redis)
+    assert scheduler.tick() == 0
+    mock_publish.assert_not_called()
+
+    make_due(redis, task_id)
+    assert scheduler.tick() == 1
+    call = mock_publish.call_args
+    assert call.args[0][:3] == [task_id, "report", {"day": 1}]
+    assert call.kwargs["task_id"] == task_id
+    assert redis.zcard(SCHEDULED_KEY) == 0
+    assert redis.hlen(SCHEDULE_ENTRIES_KEY) == 0
+
+
+@pytest.mark.asyncio
+async def test_recurring_tasks_create_a_run_per_occurrence(redis, mock_publish):
+    run_at = time.time() - 1
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/api/tasks/batch",
+            json={
+                "tasks": [
+                    {
+                        **TASK,
+                        "run_at": datetime.fromtimestamp(
+                            run_at, timezone.utc
+                        ).isoformat(),
+                        "recurrence": {"every": 60, "count": 3},
+                        "timeout": 30,
+                    }
+                ]
+            },
+        )
+        schedule_id = response.json()["task_ids"][0]
+
+        scheduler = Scheduler(redis)
+        assert scheduler.tick() == 1
+        first = mock_publish.call_args.args[0]
+        assert first[0] == schedule_id
+        assert first[4] == pytest.approx(time.time() + 30, abs=5)
+        next_run = json.loads(redis.hget(SCHEDULE_ENTRIES_KEY, schedule_id))["call"][0]
+        assert redis.zscore(SCHEDULED_KEY, schedule_id) == pytest.approx(run_at + 60)
+        assert redis.hget(f"task:{next_run}", "schedule_id") == schedule_id
+        assert redis.hget(f"task:{next_run}", "status") == "PENDING"
+
+        make_due(redis, schedule_id)
+        assert scheduler.tick() == 1
+        assert mock_publish.call_args.args[0][0] == next_run
+
+        with patch.object(celery_tasks.celery.control, "revoke"):
+            cancelled = await ac.delete(f"/api/schedules/{schedule_id}")
+            missing = await ac.delete(f"/api/schedules/{schedule_id}")
+
+    last_run = cancelled.json()["task_id"]
+    assert cancelled.json()["status"] == "CANCELLED"
+    assert last_run not in (schedule_id, next_run)
+    assert missing.status_code == 404
+    assert redis.zcard(SCHEDULED_KEY) == 0
+    assert scheduler.tick() == 0
+    assert mock_publish.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_claimed_runs_are_leased_to_one_scheduler(redis, mock_publish):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        task_id = (await ac.post("/api/tasks", json={**TASK, "run_at": at(-1)})).json()[
+            "task_id"
+        ]
+
+    mock_publish.side_effect = Exception("broker unavailable")
+    assert Scheduler(redis).tick() == 1
+    # Still scheduled, but leased: no other replica claims it until the lease ends.
+    assert redis.zscore(SCHEDULED_KEY, task_id) > time.time() + 30
+    assert Scheduler(redis).tick() == 0
+
+    mock_publish.side_effect = None
+    make_due(redis, task_id)
+    assert Scheduler(redis).tick() == 1
+    assert mock_publish.call_count == 2
+    assert redis.zcard(SCHEDULED_KEY) == 0
+
+
+def test_jitter_spreads_a_cohort_evenly():
+    names = [str(uuid.uuid4()) for _ in range(2000)]
+    offsets = [
+        schedule_entry([name, "t", {}, "", None], {}, None, 1000.0, None, None, 60.0)[1]
+        - 1000.0
+        for name in names
+    ]
+    assert all(0 <= offset < 60 for offset in offsets)
+    buckets = [0] * 6
+    for offset in offsets:
+        buckets[int(offset // 10)] += 1
+    assert min(buckets) > 250
+    assert jitter_offset(names[0], 60.0) == pytest.approx(offsets[0])
+
+
+@pytest.mark.asyncio
+async def test_offloaded_parameters_outlive_every_scheduled_run(
+    redis, mock_publish, monkeypatch
+):
+    monkeypatch.setattr(
+        "app.tasks.payloads.settings.TASK_PAYLOAD_INLINE_MAX_BYTES", 256
+    )
+    large = {**TASK, "parameters": {"rows": ["row-%d" % i for i in range(100)]}}
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        delayed = (
+            await ac.post("/api/tasks", json={**large, "run_at": at(10 * 24 * 3600)})
+        ).json()["task_id"]
+        response = await ac.post(
+            "/api/tasks/batch",
+            json={
+                "tasks": [
+                    {
+                        **large,
+                        "run_at": at(-1),
+                        "recurrence": {"every": 20 * 24 * 3600},
+                    }
+                ]
+            },
+        )
+        schedule_id = response.json()["task_ids"][0]
+
+    payload_key = json.loads(redis.hget(f"task:{delayed}", "parameters"))["$payload"]
+    assert redis.ttl(payload_key) >= redis.ttl(f"task:{delayed}") > 17 * 24 * 3600 - 10
+
+    assert Scheduler(redis).tick() == 1
+    next_run = json.loads(redis.hget(SCHEDULE_ENTRIES_KEY, schedule_id))["call"][0]
+    assert redis.ttl(payload_key) >= redis.ttl(f"task:{next_run}") > 27 * 24 * 3600 - 10
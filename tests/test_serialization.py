@@ -0,0 +1,65 @@
+import json
+from datetime import datetime
+from uuid import UUID
+
+import pytest
+from kombu.serialization import dumps, loads, prepare_accept_content
+
+from app.core import serialization
+from app.models.task import TaskStatus, TaskStatusResponse
+from app.tasks.status_store import decode_record, encode_record
+
+
+def test_records_stay_json_across_codecs(monkeypatch):
+    task = {"task_id": "t", "status": TaskStatus.PENDING, "parameters": {"a": [1, "é"]}}
+    monkeypatch.setattr(serialization.settings, "SERIALIZER", "json")
+    legacy = encode_record(task)
+    monkeypatch.setattr(serialization.settings, "SERIALIZER", "orjson")
+    record = encode_record(task)
+
+    assert json.loads(record["parameters"]) == {"a": [1, "é"]}
+    assert decode_record(legacy) == decode_record(record)
+
+
+def test_sse_payloads_encode_models_and_datetimes():
+    status = TaskStatusResponse(task_id="t", status=TaskStatus.RUNNING, progress=0.5)
+    assert json.loads(serialization.model_dumps(status)) == {
+        "task_id": "t",
+        "status": "RUNNING",
+        "progress": 0.5,
+        "message": None,
+        "seq": None,
+    }
+    assert json.loads(serialization.dumps({"at": datetime(2026, 1, 2)})) == {
+        "at": "2026-01-02T00:00:00"
+    }
+
+
+def test_celery_messages_round_trip_with_the_configured_codec(monkeypatch):
+    accept = prepare_accept_content(serialization.celery_accept_content())
+    body = (("t", "name", {"a": 1}, "http://example.com", None), {}, {})
+    for codec, expected in (
+        ("json", "json"),
+        ("orjson", "orjson"),
+        ("msgpack", "msgpack"),
+    ):
+        monkeypatch.setattr(serialization.settings, "SERIALIZER", codec)
+        assert serialization.celery_serializer() == expected
+        content_type, encoding, payload = dumps(body, serializer=expected)
+        assert loads(payload, content_type, encoding, accept=accept) == [
+            ["t", "name", {"a": 1}, "http://example.com", None],
+            {},
+            {},
+        ]
+
+
+def test_unsupported_values_are_refused_by_every_codec(monkeypatch):
+    value = {"id": UUID(int=1), "status": TaskStatus.RUNNING}
+    for codec in ("json", "orjson"):
+        monkeypatch.setattr(serialization.settings, "SERIALIZER", codec)
+        assert json.loads(serialization.dumps(value)) == {
+            "id": "00000000-0000-0000-0000-000000000001",
+            "status": "RUNNING",
+        }
+        with pytest.raises(TypeError):
+            serialization.dumps({"value": object()})
@@ -0,0 +1,130 @@
+import json
+
+import fakeredis
+import pytest
+
+from app.models.task import TaskStatus
+from app.tasks.status_store import (
+    collect_usage,
+    decode_record,
+    encode_record,
+    migrate_legacy_records,
+    task_channel,
+    task_key,
+    update_status,
+)
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def create_record(redis, task_id="task-1", **overrides):
+    task_data = {
+        "task_id": task_id,
+        "name": "test_task",
+        "parameters": {"param1": "value1"},
+        "callback_url": "http://example.com/callback",
+        "status": TaskStatus.PENDING,
+        "progress": 0.0,
+        "message": "Task created",
+    }
+    task_data.update(overrides)
+    redis.hset(task_key(task_id), mapping=encode_record(task_data))
+
+
+def test_update_status_touches_only_status_fields(redis):
+    create_record(redis)
+    pubsub = redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(task_channel("task-1"))
+
+    assert (
+        update_status(redis, "task-1", TaskStatus.RUNNING, 0.5, "Halfway") == "RUNNING"
+    )
+
+    task_data = decode_record(redis.hgetall(task_key("task-1")))
+    assert task_data["status"] == "RUNNING"
+    assert task_data["progress"] == 0.5
+    assert task_data["parameters"] == {"param1": "value1"}
+    message = None
+    for _ in range(3):
+        message = message or pubsub.get_message(timeout=1)
+    event = json.loads(message["data"])
+    assert event == {
+        "task_id": "task-1",
+        "name": "test_task",
+        "status": "RUNNING",
+        "progress": 0.5,
+        "message": "Halfway",
+        "seq": 1,
+    }
+
+
+def test_update_status_never_leaves_terminal_state(redis):
+    create_record(redis)
+    update_status(redis, "task-1", TaskStatus.COMPLETED, 1.0, "Task completed")
+
+    assert (
+        update_status(redis, "task-1", TaskStatus.RUNNING, 0.8, "Late") == "COMPLETED"
+    )
+    assert redis.hget(task_key("task-1"), "message") == "Task completed"
+
+
+def test_update_status_ignores_missing_task(redis):
+    assert update_status(redis, "missing", TaskStatus.RUNNING, 0.1, "") is None
+    assert not redis.exists(task_key("missing"))
+
+
+def test_legacy_json_records_are_migrated(redis):
+    legacy = {
+        "task_id": "task-1",
+        "name": "test_task",
+        "parameters": {"nested": [1, 2]},
+        "status": "RUNNING",
+        "progress": 0.25,
+        "message": None,
+    }
+    redis.set(task_key("task-1"), json.dumps(legacy))
+    redis.set(task_key("task-2"), json.dumps(dict(legacy, task_id="task-2")), ex=600)
+
+    update_status(redis, "task-1", TaskStatus.RUNNING, 0.5, "Halfway")
+    assert migrate_legacy_records(redis) == 1
+
+    task_data = decode_record(redis.hgetall(task_key("task-1")))
+    assert task_data["parameters"] == {"nested": [1, 2]}
+    assert task_data["progress"] == 0.5
+    assert redis.type(task_key("task-2")) == "hash"
+    assert 0 < redis.ttl(task_key("task-2")) <= 600
+
+
+def test_finished_tasks_expire_and_can_be_compacted(redis, monkeypatch):
+    monkeypatch.setattr("app.tasks.status_store.settings.TASK_ACTIVE_TTL_SECONDS", 3600)
+    monkeypatch.setattr("app.tasks.status_store.settings.TASK_TERMINAL_TTL_SECONDS", 60)
+    monkeypatch.setattr("app.tasks.status_store.settings.TASK_COMPACT_ON_FINISH", True)
+    create_record(redis)
+
+    update_status(redis, "task-1", TaskStatus.RUNNING, 0.5, "Halfway")
+    assert 60 < redis.ttl(task_key("task-1")) <= 3600
+    assert redis.hexists(task_key("task-1"), "parameters")
+
+    update_status(redis, "task-1", TaskStatus.FAILED, 0.5, "Task failed")
+    assert 0 < redis.ttl(task_key("task-1")) <= 60
+    assert not redis.hexists(task_key("task-1"), "parameters")
+    assert not redis.hexists(task_key("task-1"), "callback_url")
+    assert redis.hget(task_key("task-1"), "status") == "FAILED"
+
+
+def test_collect_usage_groups_records_by_status(redis):
+    create_record(redis, "task-1")
+    create_record(redis, "task-2")
+    create_record(redis, "task-3", status=TaskStatus.COMPLETED)
+    redis.set(task_key("task-4"), json.dumps({"status": "RUNNING"}))
+
+    usage = collect_usage(redis, batch_size=2)
+
+    assert {status: totals["keys"] for status, totals in usage.items()} == {
+        "PENDING": 2,
+        "COMPLETED": 1,
+        "legacy": 1,
+    }
@@ -0,0 +1,214 @@
+import asyncio
+import json
+
+import fakeredis.aioredis
+import pytest
+
+from app.tasks.broadcaster import RESYNC, StatusBroadcaster, StatusSubscription
+from app.tasks.status_store import task_channel
+
+
+@pytest.fixture
+def fake_redis():
+    return fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+
+@pytest.mark.asyncio
+async def test_broadcaster_fans_out_events(fake_redis):
+    broadcaster = StatusBroadcaster()
+    broadcaster.bind(fake_redis)
+    first = await broadcaster.subscribe(["task-1"])
+    second = await broadcaster.subscribe(["task-1", "task-2"])
+    other = await broadcaster.subscribe(["task-3"])
+    named = await broadcaster.subscribe(name="test_task")
+
+    event = json.dumps({"task_id": "task-1", "name": "test_task", "status": "RUNNING"})
+    await fake_redis.publish(task_channel("task-1"), event)
+
+    assert await asyncio.wait_for(first.get(), timeout=1) == [("task-1", event)]
+    assert await asyncio.wait_for(second.get(), timeout=1) == [("task-1", event)]
+    assert await asyncio.wait_for(named.get(), timeout=1) == [("task-1", event)]
+    assert not other._pending
+    await broadcaster.close()
+
+
+@pytest.mark.asyncio
+async def test_subscription_keeps_latest_event_per_task():
+    subscription = StatusSubscription(["task-1", "task-2"])
+    for task_id, data in (("task-1", "a"), ("task-2", "b"), ("task-1", RESYNC)):
+        subscription.push(task_id, data)
+
+    assert await subscription.get() == [("task-2", "b"), ("task-1", RESYNC)]
+
+
+@pytest.mark.asyncio
+async def test_stream_pushes_updates_until_terminal(fake_redis):
+    from app.tasks.task_manager import TaskManager
+
+    tm = TaskManager()
+    tm._redis = fake_redis
+    tm._broadcaster = StatusBroadcaster()
+    tm._broadcaster.bind(fake_redis)
+    tm._cache = None
+    await fake_redis.set(
+        "task:task-1",
+        json.dumps({"status": "RUNNING", "progress": 0.5, "message": "Halfway"}),
+    )
+
+    stream = tm.stream_task_status("task-1")
+    first = await asyncio.wait_for(stream.__anext__(), timeout=1)
+    assert first.startswith("id: 0\n")
+    assert json.loads(first.split("data: ", 1)[1])["progress"] == 0.5
+
+    done = {
+        "task_id": "task-1",
+        "status": "COMPLETED",
+        "progress": 1.0,
+        "message": "Done",
+    }
+    await fake_redis.publish(task_channel("task-1"), json.dumps(done))
+    second = await asyncio.wait_for(stream.__anext__(), timeout=1)
+    assert json.loads(second[len("data: ") :])["status"] == "COMPLETED"
+
+    with pytest.raises(StopAsyncIteration):
+        await stream.__anext__()
+    assert "task-1" not in tm._broadcaster._subscribers
+    await tm._broadcaster.close()
+    tm._redis = None
+    del tm._broadcaster
+    del tm._cache
+
+
+@pytest.mark.asyncio
+async def test_multiplexed_stream_ends_when_all_tasks_finish(fake_redis):
+    from app.tasks.task_manager import TaskManager
+
+    tm = TaskManager()
+    tm._redis = fake_redis
+    tm._broadcaster = StatusBroadcaster()
+    tm._broadcaster.bind(fake_redis)
+    tm._cache = None
+    for task_id, status in (("task-1", "RUNNING"), ("task-2", "COMPLETED")):
+        await fake_redis.hset(
+            f"task:{task_id}",
+            mapping={"status": status, "progress": "0.5", "message": "", "name": "n"},
+        )
+
+    stream = tm.stream_tasks_status(["task-1", "task-2", "missing"])
+    frames = [await asyncio.wait_for(stream.__anext__(), timeout=1) for _ in range(3)]
+    assert frames[0] == 'event: missing\ndata: {"task_id":"missing"}\n\n'
+    assert [json.loads(frame[len("data: ") :])["task_id"] for frame in frames[1:]] == [
+        "task-1",
+        "task-2",
+    ]
+
+    done = {"task_id": "task-1", "status": "FAILED", "progress": 0.5, "message": "x"}
+    await fake_redis.publish(task_channel("task-1"), json.dumps(done))
+    last = await asyncio.wait_for(stream.__anext__(), timeout=1)
+    assert json.loads(last[len("data: ") :])["status"] == "FAILED"
+    with pytest.raises(StopAsyncIteration):
+        await stream.__anext__()
+    assert not tm._broadcaster._subscribers
+    await tm._broadcaster.close()
+    tm._redis = None
+    del tm._broadcaster
+    del tm._cache
+
+
+@pytest.mark.asyncio
+async def test_stream_resumes_after_last_event_id_and_sends_heartbeats(
+    fake_redis, monkeypatch
+):
+    from app.tasks.task_manager import HEARTBEAT, TaskManager
+
+    monkeypatch.setattr(
+        "app.tasks.task_manager.settings.TASK_STATUS_UPDATE_INTERVAL", 0.01
+    )
+    tm = TaskManager()
+    tm._redis = fake_redis
+    tm._broadcaster = StatusBroadcaster()
+    tm._broadcaster.bind(fake_redis)
+    tm._cache = None
+    await fake_redis.hset(
+        "task:task-1",
+        mapping={"status": "RUNNING", "progress": "0.5", "message": "", "seq": "3"},
+    )
+
+    stream = tm.stream_task_status("task-1", last_event_id=3)
+    assert await asyncio.wait_for(stream.__anext__(), timeout=1) == HEARTBEAT
+
+    stale = {
+        "task_id": "task-1",
+        "status": "RUNNING",
+        "progress": 0.4,
+        "message": "",
+        "seq": 2,
+    }
+    await fake_redis.publish(task_channel("task-1"), json.dumps(stale))
+    done = {
+        "task_id": "task-1",
+        "status": "COMPLETED",
+        "progress": 1.0,
+        "message": "",
+        "seq": 4,
+    }
+    await fake_redis.publish(task_channel("task-1"), json.dumps(done))
+    frames = []
+    async for frame in stream:
+        if frame != HEARTBEAT:
+            frames.append(frame)
+
+    assert frames == [f"id: 4\ndata: {json.dumps(done)}\n\n"]
+    assert tm._open_streams == 0
+    await tm._broadcaster.close()
+    tm._redis = None
+    del tm._broadcaster
+    del tm._cache
+
+
+@pytest.mark.asyncio
+async def test_streams_beyond_the_limit_are_refused(fake_redis, monkeypatch):
+    from httpx import AsyncClient
+
+    from app.main import app
+    from app.tasks.task_manager import TaskManager
+
+    monkeypatch.setattr("app.api.routes.settings.TASK_STREAM_MAX_OPEN", 0)
+    tm = TaskManager()
+    tm._redis = fake_redis
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/tasks/task-1")
+    tm._redis = None
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+
+@pytest.mark.asyncio
+async def test_stream_slots_are_held_from_reservation_until_the_response_ends(
+    monkeypatch,
+):
+    from app.api.routes import EventStreamResponse
+    from app.tasks.task_manager import HEARTBEAT, TaskManager
+
+    async def stream():
+        yield HEARTBEAT
+
+    async def disconnect():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    monkeypatch.setattr("app.tasks.task_manager.settings.TASK_STREAM_MAX_OPEN", 1)
+    tm = TaskManager()
+    slot = tm.reserve_stream()
+    # Counted before the stream starts, so a burst cannot overshoot the limit.
+    assert tm.reserve_stream() is None
+
+    # The client is gone before the stream starts: the response releases the slot.
+    await EventStreamResponse(stream(), slot)({"type": "http"}, disconnect, send)
+    slot.release()
+
+    assert tm._open_streams == 0
+    tm.reserve_stream().release()
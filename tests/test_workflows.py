@@ -0,0 +1,161 @@
+import json
+from unittest.mock import patch
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.tasks import celery_tasks, registry
+from app.tasks.callbacks import PENDING_KEY
+from app.tasks.payloads import load
+from app.tasks.registry import TaskType
+from app.tasks.task_manager import TaskManager
+from app.tasks.workflows import workflow_key
+
+
+@pytest.fixture
+def server(fake_redis):
+    # The API and the worker share one fake server.
+    server = fakeredis.FakeServer()
+    TaskManager()._redis = fakeredis.aioredis.FakeRedis(
+        server=server, decode_responses=True
+    )
+    return server
+
+
+@pytest.fixture
+def redis(server):
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+@pytest.fixture
+def steps(monkeypatch, redis):
+    def fetch(run):
+        return {"items": [1, 2, 3]}
+
+    def scale(run):
+        if run.parameters.get("fail"):
+            raise ValueError("cannot scale")
+        items = load(redis, run.inputs["fetch"])["items"]
+        return [item * run.parameters["factor"] for item in items]
+
+    def total(run):
+        return sum(sum(load(redis, ref)) for ref in run.inputs.values())
+
+    for name, body in (("fetch", fetch), ("scale", scale), ("total", total)):
+        monkeypatch.setitem(registry._types, name, TaskType(name, body))
+
+
+def diamond(fail=False):
+    return {
+        "steps": [
+            {"key": "fetch", "name": "fetch"},
+            {
+                "key": "double",
+                "name": "scale",
+                "parameters": {"factor": 2},
+                "depends_on": ["fetch"],
+            },
+            {
+                "key": "triple",
+                "name": "scale",
+                "parameters": {"factor": 3, "fail": fail},
+                "depends_on": ["fetch"],
+            },
+            {"key": "sum", "name": "total", "depends_on": ["double", "triple"]},
+        ],
+        "callback_url": "http://example.com/workflow",
+    }
+
+
+def run_published(redis, mock_publish):
+    """Run every published step on the worker, including those it releases."""
+    ran = 0
+    with patch.object(celery_tasks, "get_redis_connection", return_value=redis):
+        while ran < mock_publish.call_count:
+            call = mock_publish.call_args_list[ran].args[0]
+            ran += 1
+            celery_tasks.execute_task.run(*call)
+    return ran
+
+
+@pytest.mark.asyncio
+async def test_steps_start_once_their_dependencies_complete(redis, steps, mock_publish):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        created = (await ac.post("/api/workflows", json=diamond())).json()
+        assert mock_publish.call_count == 1
+
+        assert run_published(redis, mock_publish) == 4
+        state = (await ac.get(f"/api/workflows/{created['workflow_id']}/state")).json()
+
+    assert state["status"] == "COMPLETED"
+    assert state["progress"] == 1.0
+    assert state["steps"]["sum"]["task_id"] == created["task_ids"]["sum"]
+    callback = json.loads(redis.lpop(PENDING_KEY))
+    assert callback["url"] == "http://example.com/workflow"
+    assert callback["data"]["status"] == "COMPLETED"
+    assert load(redis, callback["data"]["results"]["sum"]) == 30
+    assert redis.llen(PENDING_KEY) == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_step_cancels_the_steps_depending_on_it(
+    redis, steps, mock_publish
+):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        created = (await ac.post("/api/workflows", json=diamond(fail=True))).json()
+        assert run_published(redis, mock_publish) == 3
+        state = (await ac.get(f"/api/workflows/{created['workflow_id']}/state")).json()
+
+    assert state["status"] == "FAILED"
+    assert state["steps"]["double"]["status"] == "COMPLETED"
+    assert state["steps"]["triple"]["status"] == "FAILED"
+    assert state["steps"]["sum"]["status"] == "CANCELLED"
+    assert state["steps"]["sum"]["message"] == "Skipped: step triple ended as FAILED"
+    callback = json.loads(redis.lpop(PENDING_KEY))
+    assert callback["data"]["status"] == "FAILED"
+    assert set(callback["data"]["results"]) == {"fetch", "double"}
+
+
+@pytest.mark.asyncio
+async def test_invalid_graphs_are_rejected(redis, mock_publish):
+    cycle = {
+        "steps": [
+            {"key": "a", "name": "t", "depends_on": ["b"]},
+            {"key": "b", "name": "t", "depends_on": ["a"]},
+        ]
+    }
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post("/api/workflows", json=cycle)
+        missing = await ac.get("/api/workflows/missing/state")
+
+    assert response.status_code == 422
+    assert "cycle" in response.json()["detail"][0]["msg"]
+    assert missing.status_code == 404
+    mock_publish.assert_not_called()
+    assert redis.keys(workflow_key("*")) == []
+
+
+@pytest.mark.asyncio
+async def test_steps_of_an_abandoned_workflow_stop_at_their_first_write(
+    redis, mock_publish
+):
+    ran = []
+    with patch.dict(
+        registry._types, {"t": TaskType("t", lambda run: ran.append(run.task_id))}
+    ):
+        mock_publish.side_effect = [None, Exception("broker unavailable")]
+        workflow = {"steps": [{"key": "a", "name": "t"}, {"key": "b", "name": "t"}]}
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post("/api/workflows", json=workflow)
+        assert response.status_code == 500
+
+        mock_publish.side_effect = None
+        run_published(redis, mock_publish)
+
+    assert ran == []
+    assert redis.keys("task:*") == []
+    assert redis.keys(workflow_key("*")) == []
+    assert redis.llen(PENDING_KEY) == 0